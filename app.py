@@ -1,11 +1,18 @@
-from flask import Flask, render_template, send_file, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, send_file, request, jsonify, session, redirect, url_for, Response
 import io
 import json
 import csv
-from email_processor import process_emails, save_to_json
-from llm_processor import extract_data_with_llm
-from auth import auth, get_credentials
+import queue
+from email_processor import process_emails
+from llm_processor import extract_data_with_llm, llm_call_stats
+from extraction_cache import get_cache
+from llm_usage import get_usage_log
+from record_store import get_record_store, FILTER_COLUMNS
+from columnar_export import export_records, exports_available, ExportUnavailableError
+from auth import auth, get_credentials, get_account
+from mail_transport import create_transport
 from config import SECRET_KEY
+from job_queue import get_job_queue
 from flask_session import Session
 from datetime import timedelta
 import os
@@ -19,6 +26,8 @@ app.config['SECRET_KEY'] = SECRET_KEY
 app.config['SESSION_FILE_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flask_session')
 app.config['SESSION_FILE_THRESHOLD'] = 100
 app.config['SESSION_FILE_MODE'] = 0o600
+# Cross-site POSTs (which start paid LLM work) are sent without the session cookie
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
 # Initialize Flask-Session
 Session(app)
@@ -45,14 +54,19 @@ def index():
         return render_template('login.html')
         
     global latest_data, current_fields
-    return render_template('index.html', data=latest_data, fields=current_fields)
+    return render_template('index.html', data=latest_data, fields=current_fields,
+                           columnar_exports=exports_available())
 
 @app.route('/update_fields', methods=['POST'])
 @login_required
 def update_fields():
-    global current_fields
+    global current_fields, latest_data
     data = request.get_json()
     if 'fields' in data:
+        # Removed fields are projected out of the current results; added ones are
+        # extracted on the next run, which only asks the LLM for fields it has not cached
+        removed = set(current_fields) - set(data['fields'])
+        latest_data = [{k: v for k, v in record.items() if k not in removed} for record in latest_data]
         # Update the fields to extract
         current_fields = data['fields']
         return jsonify({'status': 'success', 'message': 'Fields updated successfully'})
@@ -142,37 +156,201 @@ def download_csv():
         download_name='data.csv'
     )
 
+@app.route('/download/<export_format>')
+@login_required
+def download_columnar(export_format):
+    """Download the whole stored history as Parquet or an Arrow IPC file (zstd compressed)."""
+    global current_fields
+    mimetypes = {'parquet': 'application/vnd.apache.parquet', 'arrow': 'application/vnd.apache.arrow.file'}
+    if export_format not in mimetypes:
+        return "Unknown export format", 404
+    if not get_record_store().count():
+        return "No data available", 404
+    try:
+        path = export_records(current_fields, export_format)
+    except ExportUnavailableError as e:
+        return str(e), 501
+    
+    return send_file(
+        os.path.abspath(path),
+        mimetype=mimetypes[export_format],
+        as_attachment=True,
+        download_name=f'data.{export_format}'
+    )
+
+def _extraction_job(account, credentials, fields):
+    """
+    The function a background job runs: one process_emails run over the account's mailbox
+    whose records are saved. An error that stops the run fails the job.
+    """
+    def run(job):
+        global latest_data
+        results = process_emails(
+            fields_to_extract=fields,
+            credentials_provider=lambda: credentials,
+            transport=create_transport(account=account),
+            on_record=job.add_record,
+            on_progress=job.set_progress,
+            raise_errors=True,
+            save=True,
+        )
+        if not results:
+            return "No new relevant emails found."
+        # Update the latest_data with these results; process_emails has stored them
+        latest_data = results
+        return f"Successfully processed {len(results)} emails"
+    return run
+
+def _submit_extraction():
+    """
+    Queue a process_emails run for the signed-in account's mailbox with the current fields.
+    A run already queued or running for the mailbox is returned instead of starting another one.
+    """
+    # The job runs outside this request, so read the session now
+    account = get_account()
+    credentials = get_credentials()
+    if not account or not credentials:
+        return None, False
+    return get_job_queue().submit(account, _extraction_job(account, credentials, list(current_fields)))
+
 @app.route('/process_emails', methods=['POST'])
 def process_emails_endpoint():
-    """Process emails and return results."""
+    """Queue an email processing run and return its job ID; follow it at /jobs/<id>."""
     try:
-        global latest_data, current_fields
-        
         if 'credentials' not in session:
             return jsonify({"error": "Not authenticated. Please sign in first."}), 401
-            
-        # Process emails with the current fields
-        results = process_emails(fields_to_extract=current_fields)
         
-        if not results:
-            return jsonify({"message": "No relevant emails found or processing failed. Check server logs for details."})
-            
-        # Update the latest_data with these results
-        latest_data = results
-        
-        # Save results to JSON file
-        save_to_json(results)
+        job, coalesced = _submit_extraction()
+        if job is None:
+            # Expired credentials, or a session from before the account was stored
+            return jsonify({"error": "Session expired. Please sign in again."}), 401
         
         return jsonify({
-            "success": True,
-            "message": f"Successfully processed {len(results)} emails",
-            "data": results
-        })
+            "job_id": job.id,
+            "status": job.status,
+            "coalesced": coalesced,
+            "status_url": url_for('job_status', job_id=job.id),
+            "stream_url": url_for('job_stream', job_id=job.id),
+        }), 202
     except Exception as e:
         print(f"Error in process_emails endpoint: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    """
+    Report a job's status, progress counts, timings and, with ?records=1 (the default),
+    the records it extracted so far.
+    """
+    job = get_job_queue().get(job_id)
+    # Jobs of other accounts are not shown
+    if job is None or job.key != get_account():
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict(include_records=request.args.get('records', '1') != '0'))
+
+@app.route('/jobs')
+@login_required
+def list_jobs():
+    """List the signed-in account's recent jobs without their records."""
+    account = get_account()
+    return jsonify([job.to_dict(include_records=False) for job in get_job_queue().list() if job.key == account])
+
+# Seconds between keep-alive comments on an idle event stream
+STREAM_KEEPALIVE = 15
+
+def _sse(event, data):
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.route('/jobs/<job_id>/stream')
+def job_stream(job_id):
+    """
+    Follow a job queued with POST /process_emails as Server-Sent Events: a 'record' event
+    for each extracted record (those found so far first), 'progress' events with the running
+    counts, and a final 'done' (or 'error') event. This only watches the job; it never starts
+    one, so a prefetch, reload or reconnect costs nothing. Closing the stream does not stop
+    the job.
+    """
+    if 'credentials' not in session:
+        return Response(_sse('error', {"error": "Not authenticated. Please sign in first."}),
+                        mimetype='text/event-stream')
+    
+    job = get_job_queue().get(job_id)
+    if job is None or job.key != get_account():
+        return Response(_sse('error', {"error": "Unknown job"}), mimetype='text/event-stream')
+    events = job.subscribe()
+    
+    def stream():
+        while True:
+            try:
+                event, data = events.get(timeout=STREAM_KEEPALIVE)
+            except queue.Empty:
+                # Keeps proxies from closing a stream that is waiting on a slow LLM call
+                yield ": keep-alive\n\n"
+                continue
+            yield _sse(event, data)
+            if event in ('done', 'error'):
+                return
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/extraction_cache')
+@login_required
+def extraction_cache_stats():
+    """Report extraction cache hits, misses, evictions and size since the app started."""
+    cache = get_cache()
+    if cache is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(cache.stats(), enabled=True))
+
+@app.route('/llm_stats')
+@login_required
+def llm_stats():
+    """Report LLM retry, hedge, timeout and circuit breaker counters since the app started."""
+    return jsonify(llm_call_stats())
+
+@app.route('/llm_usage')
+@login_required
+def llm_usage():
+    """
+    Report LLM tokens, latency, retries, outcomes and cost per day (?days=7) and for the
+    most recent runs (?runs=20).
+    """
+    usage_log = get_usage_log()
+    if usage_log is None:
+        return jsonify({"enabled": False})
+    days = request.args.get('days', 7, type=int)
+    runs = request.args.get('runs', 20, type=int)
+    return jsonify({"enabled": True, "days": usage_log.daily(days), "runs": usage_log.recent_runs(runs)})
+
+@app.route('/api/records')
+@login_required
+def api_records():
+    """
+    Query the stored record history.
+    
+    Query parameters: shipment_id, origin, destination, carrier and sender (exact,
+    case-insensitive matches), date_from / date_to (ISO dates or datetimes), sort (one of
+    those columns, email_date or id), order (asc or desc), limit and cursor (the
+    next_cursor of the previous page).
+    """
+    try:
+        records, next_cursor = get_record_store().query(
+            filters={column: request.args.get(column) for column in FILTER_COLUMNS},
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'),
+            sort=request.args.get('sort', 'email_date'),
+            descending=request.args.get('order', 'desc') != 'asc',
+            limit=request.args.get('limit', 50, type=int),
+            cursor=request.args.get('cursor'),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"records": records, "next_cursor": next_cursor})
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -2,9 +2,11 @@ from flask import Blueprint, redirect, url_for, session, request, current_app
 from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
+from google.auth import jwt
 import os
 import traceback
-from config import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, SECRET_KEY, EMAIL_USERNAME
+import config
+from config import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, SECRET_KEY
 from datetime import timedelta
 import json
 
@@ -166,7 +168,8 @@ def oauth2callback():
             'token_uri': credentials.token_uri,
             'client_id': credentials.client_id,
             'client_secret': credentials.client_secret,
-            'scopes': credentials.scopes
+            'scopes': credentials.scopes,
+            'account': _account_email(credentials)
         }
         session.modified = True  # Ensure session is saved
         
@@ -182,6 +185,19 @@ def logout():
     session.clear()
     return redirect(url_for('index'))
 
+def _account_email(credentials):
+    """The signed-in Gmail address, read from the ID token the token endpoint returned."""
+    try:
+        # The token came straight from Google's token endpoint over TLS, so it is not re-verified
+        return jwt.decode(credentials.id_token, verify=False).get('email')
+    except Exception as e:
+        print(f"Could not read the account from the ID token: {str(e)}")
+        return None
+
+def get_account():
+    """Get the signed-in account's email address from the session."""
+    return session.get('credentials', {}).get('account')
+
 def get_credentials():
     """Get valid credentials from the session."""
     if 'credentials' not in session:
@@ -285,19 +301,18 @@ def debug_oauth():
             if credentials:
                 debug_info["get_credentials_succeeded"] = True
                 
-                # Try IMAP connection
-                import imaplib
-                
-                imap = imaplib.IMAP4_SSL("imap.gmail.com")
-                auth_string = f'user={EMAIL_USERNAME}\1auth=Bearer {credentials.token}\1\1'
+                # Try IMAP connection through the shared pool so a working one is kept for later runs
+                from imap_pool import imap_pool
                 
-                debug_info["email_username"] = EMAIL_USERNAME
-                debug_info["auth_string_length"] = len(auth_string)
+                account = get_account() or getattr(config, 'EMAIL_USERNAME', None)
+                debug_info["email_username"] = account
                 
                 try:
-                    imap.authenticate('XOAUTH2', lambda x: auth_string.encode())
+                    conn = imap_pool.acquire(account, credentials.token)
                     debug_info["imap_authentication"] = "Success"
-                    imap.logout()
+                    debug_info["imap_pool_connects"] = imap_pool.connects
+                    debug_info["imap_pool_reuses"] = imap_pool.reuses
+                    imap_pool.release(conn)
                 except Exception as e:
                     debug_info["imap_authentication"] = "Failed"
                     debug_info["imap_error"] = str(e)
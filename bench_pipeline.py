@@ -0,0 +1,94 @@
+"""
+Benchmark the whole pipeline offline: the fake IMAP server feeds process_emails and a stub
+LLM (in-process, or stub_llm_server.py over HTTP) answers the extraction calls.
+
+Each concurrency level runs over the same mailbox with a fresh sync state. The extraction
+cache and rule extractor are turned off so that every relevant email costs an LLM call.
+
+Usage:
+    python bench_pipeline.py [--messages 200] [--concurrency 1 4 16] [--latency 0.5]
+                             [--sigma 0.5] [--error-rate 0.02] [--http] [--batch-size 1]
+"""
+import os
+import io
+import time
+import argparse
+import tempfile
+import contextlib
+
+import sync_state
+import extraction_cache
+import extraction_executor
+import email_processor
+import llm_processor
+from llm_backends import StubBackend, HttpBackend
+from llm_resilience import ResilientCaller
+from stub_llm_server import StubLLMServer
+from fake_imap_server import FakeIMAPServer
+from imap_pool import IMAPConnectionPool
+from mail_transport import ImapTransport
+from bench_transports import _fill_mailbox
+
+class _Credentials:
+    token = "bench-token"
+    expired = False
+    expiry = None
+
+def _run(mailbox, concurrency, backend, batch_size, state_dir):
+    sync_state.SYNC_STATE_FILE = os.path.join(state_dir, f"sync_state_{concurrency}.json")
+    extraction_executor.LLM_CONCURRENCY = concurrency
+    extraction_executor.LLM_BATCH_SIZE = batch_size
+    llm_processor.set_backend(backend)
+    # A fresh caller so latencies and counters don't carry over between levels
+    llm_processor._caller = ResilientCaller(base_delay=0.1)
+
+    server = FakeIMAPServer(mailbox=mailbox).start()
+    pool = IMAPConnectionPool(host=server.host, port=server.port, use_ssl=False)
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            records = email_processor.process_emails(
+                credentials_provider=lambda: _Credentials(), transport=ImapTransport(pool=pool))
+        return time.perf_counter() - start, len(records), llm_processor.llm_call_stats()
+    finally:
+        pool.close_all()
+        server.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--latency', type=float, default=0.5, help="Median seconds per LLM call")
+    parser.add_argument('--sigma', type=float, default=0.5, help="Spread of the log-normal latency")
+    parser.add_argument('--error-rate', type=float, default=0.02, help="Share of calls failing with 429/503")
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--http', action='store_true', help="Call the stub over HTTP instead of in-process")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    extraction_cache.EXTRACTION_CACHE_FILE = None
+    email_processor.USE_RULE_EXTRACTOR = False
+    extraction_executor.LLM_REQUESTS_PER_MINUTE = None
+    extraction_executor.LLM_TOKENS_PER_MINUTE = None
+    mailbox = _fill_mailbox(args.messages, 0)
+
+    print(f"{args.messages} emails, stub latency {args.latency}s (sigma {args.sigma}), "
+          f"error rate {args.error_rate:.0%}, batch size {args.batch_size}, "
+          f"{'HTTP' if args.http else 'in-process'} stub")
+    print(f"{'concurrency':>11} {'seconds':>8} {'emails/s':>9} {'records':>8} {'calls':>6} {'retries':>8} {'failed':>7}")
+    with tempfile.TemporaryDirectory() as state_dir:
+        for concurrency in args.concurrency:
+            stub = StubBackend(latency=args.latency, latency_sigma=args.sigma,
+                               error_rate=args.error_rate, seed=args.seed)
+            server = StubLLMServer(backend=stub).start() if args.http else None
+            try:
+                backend = HttpBackend(server.url) if server else stub
+                elapsed, records, stats = _run(mailbox, concurrency, backend, args.batch_size, state_dir)
+            finally:
+                if server:
+                    server.stop()
+            print(f"{concurrency:>11} {elapsed:>8.2f} {args.messages / elapsed:>9.1f} {records:>8} "
+                  f"{stats['calls']:>6} {stats['retries']:>8} {stats['failures']:>7}")
+
+if __name__ == "__main__":
+    main()
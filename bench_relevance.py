@@ -0,0 +1,128 @@
+"""
+Benchmark the keyword relevance check and report how precise it is.
+
+The micro-benchmark scans large generated bodies with the old per-keyword substring check
+and with the compiled whole-word matcher. The precision report runs both over labelled
+examples: the records in the record store (rebuilt from their subject and context
+snippets) are the trucking emails, and a set of everyday emails that happen to contain
+words like "id", "load" or "eta" are the non-trucking ones.
+
+Usage:
+    python bench_relevance.py [--size-kb 1024] [--repeat 5] [--data records.json]
+                              [--negatives negatives.json]
+"""
+import json
+import time
+import random
+import argparse
+
+from email_processor import TRUCKING_KEYWORDS, _matcher
+from record_store import get_record_store
+
+# Everyday mail that the substring check lets through: "id" in "provided", "eta" in "details", ...
+NEGATIVE_SAMPLES = [
+    "Hi team, I've provided the slides for Thursday. Let me know if you'd like any changes.",
+    "Your password was changed. If you did not request this, please contact support immediately.",
+    "Download our new app and get 20% off your next order. Offer valid until Sunday.",
+    "Reminder: the quarterly budget review is on Monday. Please update the metadata in the shared sheet.",
+    "Thanks for your payment. Your customer ID is 88213 and your receipt is attached.",
+    "The beta release is ready for testing. Details are in the changelog.",
+    "Congratulations! You have been selected for our loyalty rewards program.",
+    "Please reload the dashboard to see the latest numbers from the marketing campaign.",
+    "Your subscription renews next week. No action is needed if you'd like to keep it.",
+    "Lunch menu for Friday: pasta, salad and a vegetarian option. RSVP by Wednesday.",
+    "The webinar recording is now available. Slides are provided below the video.",
+    "We noticed a new sign-in to your account from Chrome on Windows. Was this you?",
+    "Your order has been confirmed and will be handed over to the courier soon.",
+    "Meeting notes: we agreed to revisit the onboarding flow and theta parameters next sprint.",
+    "Happy birthday from all of us! Enjoy a free dessert with your next meal.",
+    "Your tax documents are ready to download from the portal.",
+]
+
+_FILLER = ("the quick brown fox jumps over a lazy dog while we provided identity download beta "
+           "metadata docket routine upload overload theta ideal video").split()
+
+def legacy_is_trucking_related(body_text):
+    """The original check: any keyword as a substring of the lowercased body."""
+    body_lower = body_text.lower()
+    return any(word in body_lower for word in TRUCKING_KEYWORDS)
+
+def _generate_body(size_kb, seed=0):
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < size_kb * 1024:
+        word = rng.choice(_FILLER)
+        if rng.random() < 0.002:
+            word = rng.choice(['Shipment', 'truck', 'pallets', 'ETA', 'carrier'])
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+def _time(func, body, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(body)
+    return (time.perf_counter() - start) / repeat
+
+def run_benchmark(size_kb, repeat):
+    body = _generate_body(size_kb)
+    legacy = _time(legacy_is_trucking_related, body, repeat)
+    compiled = _time(_matcher.match, body, repeat)
+    counts = _matcher.count(body)
+    print(f"Body of {len(body) // 1024} KiB, {repeat} runs each")
+    print(f"  substring check (presence only)  {legacy * 1000:8.2f} ms")
+    print(f"  compiled matcher (counts, score) {compiled * 1000:8.2f} ms")
+    print(f"  hits: {dict(sorted(counts.items()))}")
+
+def _report_line(name, predict, positives, negatives):
+    tp = sum(1 for text in positives if predict(text))
+    fp = sum(1 for text in negatives if predict(text))
+    fn = len(positives) - tp
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / len(positives) if positives else 0.0
+    print(f"  {name:<18} {tp:4d} {fp:4d} {fn:4d}   {precision:9.1%} {recall:7.1%}")
+
+def _record_text(record):
+    """A record's subject and context snippets, standing in for the email it came from."""
+    parts = [record.get('email_subject') or '']
+    parts.extend(value['context'] for value in record.values()
+                 if isinstance(value, dict) and value.get('context'))
+    return ' '.join(p for p in parts if p)
+
+def load_record_texts(filename=None):
+    """_record_text of every extracted record, from the record store or from a JSON export of it."""
+    if filename:
+        with open(filename, 'r') as f:
+            records = json.load(f)
+    else:
+        records = get_record_store().iter_records()
+    return [_record_text(record) for record in records]
+
+def run_precision_report(data_file=None, negatives_file=None):
+    positives = load_record_texts(data_file)
+    negatives = list(NEGATIVE_SAMPLES)
+    if negatives_file:
+        with open(negatives_file, 'r') as f:
+            negatives.extend(json.load(f))
+    print(f"\n{len(positives)} trucking emails from {data_file or 'the record store'}, "
+          f"{len(negatives)} non-trucking emails")
+    print(f"  {'matcher':<18} {'TP':>4} {'FP':>4} {'FN':>4}   {'precision':>9} {'recall':>7}")
+    _report_line('substring', legacy_is_trucking_related, positives, negatives)
+    _report_line(f'compiled >= {_matcher.threshold:g}', lambda text: _matcher.match(text).relevant,
+                 positives, negatives)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-kb', type=int, default=1024, help="Size of the generated body")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--data', help="JSON export of extracted records to use as trucking emails "
+                                       "instead of the record store")
+    parser.add_argument('--negatives', help="JSON list of extra non-trucking email bodies")
+    args = parser.parse_args()
+
+    run_benchmark(args.size_kb, args.repeat)
+    run_precision_report(args.data, args.negatives)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Measure how many LLM calls the rule-based extractor saves and how often it agrees with the labels.
+
+The samples are real emails with checked values: a JSON list of {"body", "from", "record"}
+objects, where record holds the correct {"value": ...} of each field (for example LLM answers
+reviewed by hand). The rules are run on each full body for the record's fields and every
+confident rule value is compared with the label.
+
+Stored records are no substitute: their context snippets are the spans the LLM already
+picked, so rules run on them would only confirm the LLM.
+
+Usage:
+    python bench_rule_extractor.py --samples samples.json [--threshold 0.8]
+"""
+import json
+import time
+import argparse
+from collections import Counter
+
+from rule_extractor import RuleExtractor, RULE_CONFIDENCE_THRESHOLD
+
+def _normalize(value):
+    return ' '.join(str(value).lower().split()).rstrip('.,;')
+
+def _fields(record):
+    return [key for key, value in record.items() if isinstance(value, dict) and 'value' in value]
+
+def load_samples(samples_file):
+    """Return (body, sender, record) triples."""
+    with open(samples_file, 'r') as f:
+        return [(s['body'], s.get('from', ''), s['record']) for s in json.load(f)]
+
+def run(samples, extractor):
+    filled = Counter()
+    agreed = Counter()
+    requested = Counter()
+    calls_avoided = 0
+    start = time.perf_counter()
+    for body, sender, record in samples:
+        fields = _fields(record)
+        ruled = extractor.confident(body, fields, sender)
+        if fields and len(ruled) == len(fields):
+            calls_avoided += 1
+        for field in fields:
+            requested[field] += 1
+            if field in ruled:
+                filled[field] += 1
+                if _normalize(ruled[field]['value']) == _normalize(record[field]['value']):
+                    agreed[field] += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(samples)} emails, threshold {extractor.threshold:g}, "
+          f"{elapsed / max(len(samples), 1) * 1000:.3f} ms per email\n")
+    print(f"  {'field':<16} {'requested':>9} {'by rules':>9} {'agree':>7}")
+    for field in sorted(requested):
+        agreement = f"{agreed[field] / filled[field]:.0%}" if filled[field] else '-'
+        print(f"  {field:<16} {requested[field]:9d} {filled[field]:9d} {agreement:>7}")
+    total_requested, total_filled, total_agreed = (sum(c.values()) for c in (requested, filled, agreed))
+    print()
+    print(f"Fields filled by rules:   {total_filled} of {total_requested} "
+          f"({total_filled / max(total_requested, 1):.0%})")
+    print(f"Agreement with labels:    {total_agreed / max(total_filled, 1):.0%} of rule-filled fields")
+    print(f"LLM calls avoided:        {calls_avoided} of {len(samples)} emails "
+          f"({calls_avoided / max(len(samples), 1):.0%}); the others only ask for the remaining fields")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samples', required=True,
+                        help="JSON list of {body, from, record} with real email bodies and checked values")
+    parser.add_argument('--threshold', type=float, default=RULE_CONFIDENCE_THRESHOLD)
+    args = parser.parse_args()
+
+    run(load_samples(args.samples), RuleExtractor.load(threshold=args.threshold))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark the IMAP and Gmail API transports against local fake servers holding the same mail.
+
+Both servers add the same artificial latency to every round trip, so the numbers show how
+the number of round trips drives wall-clock time. Each transport runs with and without the
+server-side keyword search so the number of downloaded emails can be compared.
+
+Usage:
+    python bench_transports.py [--messages 300] [--latency 0.02] [--noise 0.7]
+"""
+import os
+import time
+import argparse
+import tempfile
+
+import httplib2
+
+import sync_state
+from fake_imap_server import FakeIMAPServer, FakeMailbox
+from fake_gmail_api import FakeGmailApiServer
+from imap_client import RoundTripCounter
+from imap_pool import IMAPConnectionPool
+from mail_transport import ImapTransport, GmailApiTransport
+from email_processor import TRUCKING_KEYWORDS
+
+class _Credentials:
+    token = "bench-token"
+
+def _headers(i, sender, subject):
+    """Headers like real mail carries; Message-ID and Received alone contain "id" and "eta"."""
+    return (f"Received: from mta{i % 5}.example.net (mta{i % 5}.example.net [203.0.113.{i % 250}])\r\n"
+            f"\tby mx.example.com with ESMTPS id {i:08x}\r\n"
+            f"Message-ID: <{i}.{i * 7919:x}@mail.example.net>\r\n"
+            f"Date: Mon, 12 Oct 2026 09:{i % 60:02d}:00 +0000\r\n"
+            f"From: {sender}\r\nTo: ops@example.com\r\nSubject: {subject}\r\n"
+            f"MIME-Version: 1.0\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n")
+
+def _fill_mailbox(count, noise):
+    mailbox = FakeMailbox()
+    for i in range(count):
+        if i < count * noise:
+            # Newsletters and notifications without any trucking keyword
+            mailbox.add((_headers(i, "news@shop.example", f"Newsletter {i}")
+                         + "Hello friends, this week we have new recipes and a great sale on shoes.\r\n" * 200).encode())
+        else:
+            mailbox.add((_headers(i, f"broker{i % 7}@example.com", f"Load {i}")
+                         + f"Shipment SH{10000 + i} picked up in Dallas, TX. ETA Seattle, WA.\r\n" * 20).encode())
+    return mailbox
+
+def _run(transport, keywords=None):
+    stats = RoundTripCounter(transport.name)
+    start = time.perf_counter()
+    transport.connect(_Credentials(), stats)
+    email_ids = transport.find_new_messages(stats)
+    if keywords:
+        email_ids = transport.filter_by_keywords(email_ids, keywords, stats)
+    fetched = sum(1 for _ in transport.fetch(email_ids, stats))
+    transport.finish()
+    return time.perf_counter() - start, fetched, stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds added to every round trip")
+    parser.add_argument('--noise', type=float, default=0.7, help="Fraction of emails without trucking keywords")
+    args = parser.parse_args()
+
+    mailbox = _fill_mailbox(args.messages, args.noise)
+    imap_server = FakeIMAPServer(mailbox=mailbox, latency=args.latency).start()
+    gmail_server = FakeGmailApiServer(mailbox=mailbox, latency=args.latency).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sync_state.SYNC_STATE_FILE = os.path.join(tmp, 'sync_state.json')
+        pool = IMAPConnectionPool(host=imap_server.host, port=imap_server.port, use_ssl=False)
+
+        print(f"{args.messages} messages ({args.noise:.0%} without trucking keywords), "
+              f"{args.latency * 1000:.0f} ms per round trip\n")
+        transports = {
+            'imap': lambda: ImapTransport(pool=pool, account='bench@example.com'),
+            'gmail_api': lambda: GmailApiTransport(account='bench@example.com', api_endpoint=gmail_server.url,
+                                                   http=httplib2.Http()),
+        }
+        results = []
+        for name, make_transport in transports.items():
+            for keywords in (None, TRUCKING_KEYWORDS):
+                # Start every run from a full sync
+                if os.path.exists(sync_state.SYNC_STATE_FILE):
+                    os.remove(sync_state.SYNC_STATE_FILE)
+                elapsed, fetched, stats = _run(make_transport(), keywords)
+                label = f"{name}{' + keywords' if keywords else ''}"
+                results.append(f"{label:<22} {elapsed:7.3f}s  {fetched:4d} downloaded  {stats.summary()}")
+        print()
+        print('\n'.join(results))
+
+        pool.close_all()
+    imap_server.stop()
+    gmail_server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""
+Shrink email bodies before they go into the extraction prompt.
+
+The cleaner turns HTML into text, drops quoted reply history, signatures and legal
+boilerplate, and finally keeps the body within BODY_TOKEN_BUDGET estimated tokens,
+preferring the sentences that mention trucking keywords.
+
+Everything that is kept is a verbatim slice of the decoded text, and CleanedBody records
+where each slice came from. A context the LLM quotes from the cleaned text can therefore
+be located in the original email with CleanedBody.locate().
+"""
+import re
+from html import unescape
+from html.parser import HTMLParser
+
+import config
+
+# Estimated tokens (about four characters each) a cleaned body may use in the prompt
+BODY_TOKEN_BUDGET = getattr(config, 'BODY_TOKEN_BUDGET', 1500)
+
+_HTML_RE = re.compile(r'<(?:html|body|div|p|br|table|span|td)\b', re.IGNORECASE)
+_QUOTE_RE = re.compile(r'[ \t]*(?:>[ \t]?)+')
+# Where the quoted history of a reply starts
+_REPLY_HEADER_RE = re.compile(
+    r'^\s*(?:On .{5,200}wrote:|-{2,}\s*Original Message\s*-{2,}|_{10,})\s*$', re.IGNORECASE)
+# Outlook starts the history with a header block: a From: line naming a mailbox
+# ("a@b.com", "Name <a@b.com>", "Name [mailto:a@b.com]"), Sent: or Date:, and Subject:.
+# Templated tenders also have From:/Date:/To: lines, but with places and dates in them.
+_OUTLOOK_FROM_RE = re.compile(
+    r'^\s*From:\s*(?:[^<>\[\]]*(?:<[^<>@\s]+@[^<>@\s]+>|\[mailto:[^\]@\s]+@[^\]\s]+\])|'
+    r'"?[^\s<>@"]+@[^\s<>@"]+"?)\s*$', re.IGNORECASE)
+_OUTLOOK_SENT_RE = re.compile(r'^\s*(?:Sent|Date): ', re.IGNORECASE)
+_SUBJECT_RE = re.compile(r'^\s*Subject:', re.IGNORECASE)
+_FORWARD_MARKER_RE = re.compile(r'^\s*-{2,}\s*Forwarded message\s*-{2,}\s*$', re.IGNORECASE)
+_HEADER_LINE_RE = re.compile(r'^\s*(?:From|Sent|Date|To|Cc|Subject):', re.IGNORECASE)
+_SIGNATURE_RE = re.compile(
+    r'^\s*(?:--\s*|Sent from my .*|(?:Thanks|Thank you|Many thanks|Best|Best regards|Kind regards|'
+    r'Regards|Cheers|Sincerely)[,.!]?)\s*$', re.IGNORECASE)
+# Lines a signature block may have after the closing ("Thanks,", "-- "), and their length
+SIGNATURE_MAX_LINES = 8
+SIGNATURE_MAX_LINE_LENGTH = 80
+_BOILERPLATE_RE = re.compile(
+    r'confidential|intended recipient|privileged|unsubscribe|this e-?mail and any attachments|'
+    r'please consider the environment|disclaimer', re.IGNORECASE)
+_SENTENCE_RE = re.compile(r'[^.!?\n]+(?:[.!?]+|$)', re.MULTILINE)
+
+class _TextExtractor(HTMLParser):
+    """Collect the visible text of an HTML document, one line per block element."""
+
+    BLOCK_TAGS = {'p', 'div', 'br', 'tr', 'li', 'table', 'h1', 'h2', 'h3', 'h4', 'blockquote'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style', 'head'):
+            self.skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag == 'td':
+            self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style', 'head'):
+            self.skip = max(0, self.skip - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(data)
+
+def html_to_text(html):
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+        text = ''.join(parser.parts)
+    except Exception:
+        # Badly broken markup: fall back to dropping anything that looks like a tag
+        text = unescape(re.sub(r'<[^>]+>', ' ', html))
+    lines = (' '.join(line.split()) for line in text.splitlines())
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+def estimate_body_tokens(text):
+    return len(text or '') // 4
+
+class CleanedBody:
+    """
+    The cleaned text of an email plus the map back to the decoded text it was cut from.
+
+    Attributes:
+        text (str): What goes into the prompt.
+        source (str): The decoded body (after HTML to text) that offsets refer to.
+        segments (list): (text_start, source_start, length) for each verbatim slice.
+        tokens_before (int): Estimated tokens of the body as it was decoded (HTML included).
+    """
+
+    def __init__(self, text, source, segments, tokens_before=None):
+        self.text = text
+        self.source = source
+        self.segments = segments
+        self.tokens_before = estimate_body_tokens(source) if tokens_before is None else tokens_before
+
+    @property
+    def tokens_after(self):
+        return estimate_body_tokens(self.text)
+
+    def to_source(self, offset):
+        """Map an offset in text to the same character in source (None between slices)."""
+        for text_start, source_start, length in self.segments:
+            if text_start <= offset < text_start + length:
+                return source_start + offset - text_start
+        return None
+
+    def locate(self, context):
+        """Return (start, end) of a context snippet in source, or None if it can't be found."""
+        if not context:
+            return None
+        start = self.text.find(context)
+        if start >= 0:
+            source_start = self.to_source(start)
+            source_end = self.to_source(start + len(context) - 1)
+            if source_start is not None and source_end is not None:
+                return source_start, source_end + 1
+        # The snippet may span two slices (or come from a dropped part): look in the source
+        start = self.source.find(context)
+        return (start, start + len(context)) if start >= 0 else None
+
+def _lines(text):
+    """Yield (start, end) of every line, without the line break."""
+    start = 0
+    for line in text.splitlines(keepends=True):
+        yield start, start + len(line.rstrip('\r\n'))
+        start += len(line)
+
+def _unquote(text, span):
+    """Drop the '>' markers at the start of a quoted line."""
+    start, end = span
+    match = _QUOTE_RE.match(text, start, end)
+    return (match.end(), end) if match else span
+
+def _line(text, lines, index):
+    start, end = lines[index]
+    return text[start:end]
+
+def _skip_blank(text, lines, index):
+    while index < len(lines) and not _line(text, lines, index).strip():
+        index += 1
+    return index
+
+def _mail_header_end(text, lines, index, after_separator=False):
+    """
+    Return the index after the mail header block (From:, Sent:, To:, Subject: ...) that
+    starts at index, or index itself if there is none there. The block must start with a
+    From: line naming a mailbox and, unless it follows a separator, have a Subject: line.
+    """
+    if index >= len(lines) or not _OUTLOOK_FROM_RE.match(_line(text, lines, index)):
+        return index
+    end = index + 1
+    while end < len(lines) and _HEADER_LINE_RE.match(_line(text, lines, end)):
+        end += 1
+    if after_separator or any(_SUBJECT_RE.match(_line(text, lines, i)) for i in range(index, end)):
+        return end
+    return index
+
+def _starts_history(text, lines, index):
+    line = _line(text, lines, index)
+    if _REPLY_HEADER_RE.match(line) or _QUOTE_RE.match(line):
+        return True
+    return (index + 1 < len(lines) and bool(_OUTLOOK_SENT_RE.match(_line(text, lines, index + 1))) and
+            _mail_header_end(text, lines, index) > index)
+
+def _drop_quoted_history(text, lines, is_relevant):
+    """
+    Cut a reply at the start of its quoted history. If the new part alone says nothing
+    relevant (e.g. "see below"), the quoted part is kept, without its '>' markers and the
+    reply header, but with every other line as it was.
+    """
+    new_part = []
+    for index, (start, end) in enumerate(lines):
+        line = text[start:end]
+        if _FORWARD_MARKER_RE.match(line):
+            # A forward is usually the point of the email: keep it, minus its header block
+            rest = _skip_blank(text, lines, index + 1)
+            rest = _skip_blank(text, lines, _mail_header_end(text, lines, rest, after_separator=True))
+            return new_part + _drop_quoted_history(text, lines[rest:], is_relevant)
+        if _starts_history(text, lines, index):
+            if is_relevant(' '.join(text[s:e] for s, e in new_part)):
+                return new_part
+            if _REPLY_HEADER_RE.match(line):
+                quoted_start = _mail_header_end(text, lines, index + 1, after_separator=True)
+            else:
+                quoted_start = _mail_header_end(text, lines, index)
+            return new_part + [_unquote(text, span) for span in lines[quoted_start:]]
+        new_part.append((start, end))
+    return new_part
+
+def _drop_signature(text, lines):
+    """Cut a trailing signature block that starts with a closing or a '-- ' delimiter."""
+    for index in range(max(0, len(lines) - SIGNATURE_MAX_LINES - 1), len(lines)):
+        start, end = lines[index]
+        if _SIGNATURE_RE.match(text[start:end]) and all(
+                e - s <= SIGNATURE_MAX_LINE_LENGTH for s, e in lines[index + 1:]):
+            return lines[:index]
+    return lines
+
+def _drop_boilerplate(text, lines, is_keyword_sentence):
+    """
+    Drop legal footers and mailing-list boilerplate: each paragraph from its first line that
+    reads like a footer to its end. The lines before that line stay, so a footer that follows
+    the message without a blank line only takes itself out.
+    """
+    kept = []
+    paragraph = []
+    for span in lines + [None]:
+        if span is None or not text[span[0]:span[1]].strip():
+            cut = next((index for index, (s, e) in enumerate(paragraph)
+                        if _BOILERPLATE_RE.search(text[s:e])), len(paragraph))
+            footer = ' '.join(text[s:e] for s, e in paragraph[cut:])
+            # Footers rarely carry numbers or trucking terms; one with any is kept to be safe
+            if any(ch.isdigit() for ch in footer) or is_keyword_sentence(footer):
+                kept.extend(paragraph)
+            else:
+                kept.extend(paragraph[:cut])
+            paragraph = []
+            if span is not None:
+                kept.append(span)
+        else:
+            paragraph.append(span)
+    return kept
+
+def _enforce_budget(text, lines, token_budget, is_keyword_sentence):
+    """
+    Keep the body within the token budget: sentences with trucking keywords first, then
+    the others in order, everything back in its original order.
+    """
+    total = sum(end - start for start, end in lines)
+    if total // 4 <= token_budget:
+        return lines
+    sentences = []
+    for start, end in lines:
+        for match in _SENTENCE_RE.finditer(text, start, end):
+            if text[match.start():match.end()].strip():
+                sentences.append((match.start(), match.end()))
+    preferred = [s for s in sentences if is_keyword_sentence(text[s[0]:s[1]])]
+    preferred_set = set(preferred)
+    others = [s for s in sentences if s not in preferred_set]
+    kept, used = [], 0
+    for span in preferred + others:
+        length = span[1] - span[0]
+        if (used + length) // 4 > token_budget:
+            continue
+        kept.append(span)
+        used += length
+    return sorted(kept)
+
+def _assemble(text, spans):
+    """Join the kept slices, merging neighbours that only have whitespace between them."""
+    merged = []
+    for start, end in spans:
+        if end <= start:
+            continue
+        if merged and not text[merged[-1][1]:start].strip():
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    parts, segments, position = [], [], 0
+    for start, end in merged:
+        if parts:
+            parts.append('\n')
+            position += 1
+        parts.append(text[start:end])
+        segments.append((position, start, end - start))
+        position += end - start
+    return ''.join(parts), segments
+
+def clean_body(body, is_relevant=None, is_keyword_sentence=None, token_budget=None, html=None):
+    """
+    Reduce an email body to what the extraction prompt needs.
+
+    Args:
+        body (str): The decoded email body, text or HTML.
+        is_relevant (callable, optional): Tells whether a text alone is worth extracting from;
+            used to decide if quoted history can be dropped. Defaults to "has any text".
+        is_keyword_sentence (callable, optional): Tells whether a sentence mentions trucking
+            keywords; those are never taken for boilerplate and are kept first when the
+            budget is tight.
+        token_budget (int, optional): Defaults to BODY_TOKEN_BUDGET.
+        html (bool, optional): Whether body is HTML. Detected from the markup if None.
+
+    Returns:
+        CleanedBody
+    """
+    body = body or ''
+    if html is None:
+        html = bool(_HTML_RE.search(body))
+    source = html_to_text(body) if html else body
+    is_relevant = is_relevant or (lambda text: bool(text.strip()))
+    is_keyword_sentence = is_keyword_sentence or (lambda sentence: False)
+
+    lines = list(_lines(source))
+    lines = _drop_quoted_history(source, lines, is_relevant)
+    lines = _drop_boilerplate(source, lines, is_keyword_sentence)
+    # Trailing blank lines would count against the signature's line limit
+    while lines and not source[lines[-1][0]:lines[-1][1]].strip():
+        lines.pop()
+    lines = _drop_signature(source, lines)
+    lines = _enforce_budget(source, lines, token_budget or BODY_TOKEN_BUDGET, is_keyword_sentence)
+    text, segments = _assemble(source, lines)
+    return CleanedBody(text, source, segments, estimate_body_tokens(body))
@@ -0,0 +1,232 @@
+"""
+Columnar exports of the record store: Parquet or Arrow IPC, compressed with zstd.
+
+Every extracted field becomes two columns, <field>_value and <field>_context, next to the
+email metadata. Carrier, city and sender columns are dictionary encoded, so a value that
+repeats across thousands of records is stored once.
+
+Exports are built a segment of EXPORT_SEGMENT_SIZE record IDs at a time, and each segment is
+cached in EXPORT_CACHE_DIR. Records are only ever appended, so a full segment never changes
+and only the last one is rebuilt when new records arrive. The finished export file is
+cached too, so downloading unchanged data again is served straight from disk.
+
+Builds are serialized and written to unique temporary files, so concurrent downloads never
+see a half-written file. Cached files are not deleted when they are superseded (one may
+still be streaming); files unused for EXPORT_RETENTION seconds are pruned after a build.
+
+pyarrow is in requirements.txt; without it export_records() raises ExportUnavailableError
+and the dashboard leaves the download out.
+
+Usage:
+    python columnar_export.py [--format parquet|arrow] [--fields shipment_id origin ...] [--output out.parquet]
+"""
+import os
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+
+import config
+from record_store import get_record_store
+
+EXPORT_CACHE_DIR = getattr(config, 'EXPORT_CACHE_DIR', 'exports')
+EXPORT_SEGMENT_SIZE = getattr(config, 'EXPORT_SEGMENT_SIZE', 50000)
+EXPORT_COMPRESSION_LEVEL = getattr(config, 'EXPORT_COMPRESSION_LEVEL', 3)
+# Cached exports and segments not used for this many seconds are deleted
+EXPORT_RETENTION = getattr(config, 'EXPORT_RETENTION', 3600)
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+# Metadata columns, in front of the field columns
+METADATA_COLUMNS = ('record_id', 'email_key', 'email_date', 'sender', 'email_from', 'email_subject',
+                    'email_message_id')
+# Columns with few distinct values that are stored as dictionaries
+DICTIONARY_FIELDS = ('carrier', 'origin', 'destination', 'status')
+
+class ExportUnavailableError(Exception):
+    """Columnar exports need pyarrow, which is not installed."""
+
+# One export is built at a time
+_build_lock = threading.Lock()
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise ExportUnavailableError("Columnar exports need pyarrow: pip install -r requirements.txt")
+
+def exports_available():
+    """Whether pyarrow can be imported, i.e. whether the dashboard should offer the exports."""
+    try:
+        _pyarrow()
+        return True
+    except ExportUnavailableError:
+        return False
+
+def _schema(pa, fields):
+    columns = [
+        pa.field('record_id', pa.int64()),
+        pa.field('email_key', pa.string()),
+        pa.field('email_date', pa.timestamp('s', tz='UTC')),
+        pa.field('sender', pa.string()),
+        pa.field('email_from', pa.string()),
+        pa.field('email_subject', pa.string()),
+        pa.field('email_message_id', pa.string()),
+    ]
+    for field in fields:
+        columns.append(pa.field(f"{field}_value", pa.string()))
+        columns.append(pa.field(f"{field}_context", pa.string()))
+    return pa.schema(columns)
+
+def _dictionary_columns(fields):
+    return ['sender'] + [f"{field}_value" for field in fields if field in DICTIONARY_FIELDS]
+
+def _segment_table(pa, rows, fields):
+    """Build the Arrow table of one segment's records."""
+    columns = {name: [] for name in _schema(pa, fields).names}
+    for record_id, email_key, email_date, sender, record in rows:
+        columns['record_id'].append(record_id)
+        columns['email_key'].append(email_key)
+        columns['email_date'].append(int(email_date) if email_date else None)
+        columns['sender'].append(sender or None)
+        for name in ('email_from', 'email_subject', 'email_message_id'):
+            columns[name].append(record.get(name))
+        for field in fields:
+            value = record.get(field)
+            value = value if isinstance(value, dict) else {'value': value}
+            columns[f"{field}_value"].append(None if value.get('value') in (None, 'N/A') else str(value['value']))
+            columns[f"{field}_context"].append(value.get('context') or None)
+    return pa.table(columns, schema=_schema(pa, fields))
+
+def _fields_tag(fields):
+    return hashlib.sha256('\x1f'.join(fields).encode()).hexdigest()[:12]
+
+def _temp_path(directory, suffix):
+    handle, path = tempfile.mkstemp(dir=directory, suffix=suffix + '.tmp')
+    os.close(handle)
+    return path
+
+def _touch(path):
+    """Mark a cached file as used, so _prune keeps it."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def _cached_segment(pa, store, fields, segment, count, max_id, cache_dir):
+    """Return a segment's table, from the cache when its records have not changed."""
+    tag = _fields_tag(fields)
+    path = os.path.join(cache_dir, 'segments', f"{tag}-{segment:06d}-{count}-{max_id}.parquet")
+    if os.path.exists(path):
+        _touch(path)
+        return pa.parquet.read_table(path, schema=_schema(pa, fields))
+    table = _segment_table(pa, store.segment_rows(segment, EXPORT_SEGMENT_SIZE), fields)
+    tmp_path = _temp_path(os.path.dirname(path), '.parquet')
+    pa.parquet.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+    return table
+
+def _prune(cache_dir, keep):
+    """Delete cached exports and segments unused for EXPORT_RETENTION seconds, except keep."""
+    cutoff = time.time() - EXPORT_RETENTION
+    for directory in (cache_dir, os.path.join(cache_dir, 'segments')):
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if path != keep and os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                # Already removed by another process
+                pass
+
+def _write_export(pa, tables, fields, export_format, path):
+    """Write the segment tables as one file, dictionary encoding the low-cardinality columns."""
+    dictionary_columns = _dictionary_columns(fields)
+    if export_format == 'parquet':
+        schema = _schema(pa, fields)
+        with pa.parquet.ParquetWriter(path, schema, compression='zstd',
+                                      compression_level=EXPORT_COMPRESSION_LEVEL,
+                                      use_dictionary=dictionary_columns) as writer:
+            # One row group per segment
+            for table in tables:
+                writer.write_table(table)
+        return
+    # Arrow IPC files need the same dictionary in every batch, so the segments are
+    # combined first and encoded together
+    import pyarrow.compute as pc
+    table = pa.concat_tables(tables) if tables else _schema(pa, fields).empty_table()
+    for name in dictionary_columns:
+        index = table.schema.get_field_index(name)
+        table = table.set_column(index, name, pc.dictionary_encode(table.column(name)))
+    options = pa.ipc.IpcWriteOptions(compression=pa.Codec('zstd', EXPORT_COMPRESSION_LEVEL))
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table, max_chunksize=EXPORT_SEGMENT_SIZE)
+
+def export_records(fields, export_format='parquet', store=None, cache_dir=None):
+    """
+    Export every stored record with the given fields and return the path of the file.
+
+    Args:
+        fields (list): Extracted fields to export, each as a _value and a _context column.
+        export_format (str, optional): 'parquet' or 'arrow' (Arrow IPC file). Defaults to 'parquet'.
+        store (RecordStore, optional): Defaults to the shared record store.
+        cache_dir (str, optional): Defaults to EXPORT_CACHE_DIR.
+
+    Raises:
+        ExportUnavailableError: If pyarrow is not installed.
+        ValueError: For an unknown format.
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format '{export_format}', expected one of: {', '.join(FORMATS)}")
+    pa = _pyarrow()
+    store = store or get_record_store()
+    cache_dir = cache_dir or EXPORT_CACHE_DIR
+    os.makedirs(os.path.join(cache_dir, 'segments'), exist_ok=True)
+    fields = list(fields)
+
+    segments = store.segments(EXPORT_SEGMENT_SIZE)
+    # The export is named after the state of every segment, so unchanged data maps to the same file
+    state = hashlib.sha256(repr(segments).encode()).hexdigest()[:16]
+    path = os.path.join(cache_dir, f"records-{_fields_tag(fields)}-{state}{FORMATS[export_format]}")
+    if os.path.exists(path):
+        _touch(path)
+        return path
+
+    with _build_lock:
+        # Another request may have built it while this one waited
+        if os.path.exists(path):
+            _touch(path)
+            return path
+        tables = [_cached_segment(pa, store, fields, segment, count, max_id, cache_dir)
+                  for segment, count, max_id in segments]
+        tmp_path = _temp_path(cache_dir, FORMATS[export_format])
+        try:
+            _write_export(pa, tables, fields, export_format, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        _prune(cache_dir, path)
+    print(f"Exported {sum(count for _, count, _ in segments)} records to {path}")
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--format', choices=list(FORMATS), default='parquet')
+    parser.add_argument('--fields', nargs='+',
+                        default=['shipment_id', 'origin', 'destination', 'pickup_date', 'delivery_date', 'carrier', 'status'])
+    parser.add_argument('--output', help="Copy the export here (it stays cached in EXPORT_CACHE_DIR)")
+    args = parser.parse_args()
+
+    path = export_records(args.fields, args.format)
+    if args.output:
+        shutil.copyfile(path, args.output)
+        path = args.output
+    print(f"{path}: {os.path.getsize(path)} bytes")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 # Configuration settings
 EMAIL_ACCOUNT = "your_email@gmail.com"  # Replace with your Gmail address
+EMAIL_USERNAME = "your_email@gmail.com" # Mailbox of the ingest worker and scripts (the web app uses the signed-in account)
 EMAIL_PASSWORD = "your_app_password"     # Replace with your Gmail App Password
 IMAP_SERVER = "imap.gmail.com"          # Gmail IMAP server
 GOOGLE_CLIENT_ID = "your_client_id"      # Replace with your Google OAuth2 Client ID
@@ -10,4 +11,91 @@ LLM_API_KEY = "your_google_ai_key"      # Replace with your Google AI API key
 # Optional: Additional settings you might want to configure
 DEBUG = False                           # Set to True for debugging output
 LOG_LEVEL = "INFO"                      # Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-MAX_EMAILS = 100                        # Maximum number of emails to process in one batch 
\ No newline at end of file
+MAX_EMAILS = 100                        # Maximum number of emails to process in one batch 
+# IMAP fetch settings
+IMAP_FETCH_CHUNK_SIZE = 200             # Number of messages requested per UID FETCH command
+SYNC_STATE_FILE = "sync_state.json"     # Per-mailbox UIDVALIDITY / last UID / HIGHESTMODSEQ for incremental sync
+IMAP_POOL_IDLE_TIMEOUT = 300            # Seconds a pooled IMAP connection may sit idle before it is closed
+IMAP_POOL_MAX_IDLE = 4                  # Idle IMAP connections kept open per account
+
+# Ingestion worker settings (python ingest_worker.py)
+INGEST_IDLE_TIMEOUT = 1500              # Seconds to wait in IMAP IDLE before re-issuing it
+INGEST_POLL_INTERVAL = 30               # Seconds between NOOP polls on servers without IDLE
+INGEST_BACKOFF_MAX = 300                # Maximum seconds to wait before reconnecting after an error
+
+# Mail transport: "imap" (IMAP over a pooled connection) or "gmail_api" (Gmail REST API)
+MAIL_TRANSPORT = "imap"
+GMAIL_API_BATCH_SIZE = 100              # messages.get calls per HTTP batch request (Gmail allows at most 100)
+SERVER_KEYWORD_SEARCH = True            # Let the mail server drop emails without trucking keywords before download
+RELEVANCE_THRESHOLD = 1.0               # Weighted keyword score an email needs before it is sent to the LLM
+
+# Local relevance classifier (python relevance_classifier.py train)
+USE_RELEVANCE_CLASSIFIER = False        # Skip the LLM for emails the trained classifier rates as unpromising
+RELEVANCE_MODEL_FILE = "relevance_model.json"
+RELEVANCE_CLASSIFIER_THRESHOLD = 0.2    # Minimum predicted probability of useful data to call the LLM
+RELEVANCE_TRAINING_LOG = None           # e.g. "relevance_training.jsonl" to log LLM outcomes for training
+
+# LLM backend: "gemini" (Google Generative AI), "stub" (in-process fake) or "http" (python stub_llm_server.py)
+LLM_BACKEND = "gemini"
+LLM_MODEL = "gemini-2.0-flash"
+LLM_STUB_URL = "http://127.0.0.1:8765"  # Server used by the "http" backend
+LLM_STUB_LATENCY = 0.8                  # Median seconds per stub call (log-normal)
+LLM_STUB_LATENCY_SIGMA = 0.5            # Spread of the stub latency, 0 = fixed
+LLM_STUB_ERROR_RATE = 0.0               # Share of stub calls failing with 429 or 503
+
+# LLM usage accounting: tokens, latency, retries, outcome and cost of every call (GET /llm_usage)
+LLM_USAGE_FILE = "llm_usage.db"         # None = don't record usage
+LLM_USAGE_RETENTION_DAYS = 90
+LLM_PRICE_INPUT_PER_MILLION = 0.10      # US dollars per million prompt tokens
+LLM_PRICE_OUTPUT_PER_MILLION = 0.40     # US dollars per million response tokens
+
+# LLM extraction concurrency and rate limits (match them to your Gemini quota)
+LLM_CONCURRENCY = 4                     # Extraction calls in flight at once
+LLM_REQUESTS_PER_MINUTE = 60            # None = unlimited
+LLM_TOKENS_PER_MINUTE = 1000000         # Estimated prompt tokens per minute, None = unlimited
+LLM_BATCH_SIZE = 1                      # Emails packed into one extraction prompt (1 = one prompt per email)
+LLM_BATCH_TOKEN_BUDGET = 8000           # Most estimated tokens in one batched prompt
+
+# LLM call resilience
+LLM_TIMEOUT = 60                        # Seconds before an extraction call is given up on (and retried)
+LLM_MAX_RETRIES = 3                     # Retries for timeouts, connection errors, 429 and 5xx responses
+LLM_RETRY_BASE_DELAY = 1.0              # Backoff doubles from here per retry, with full jitter
+LLM_RETRY_MAX_DELAY = 30.0
+LLM_HEDGE_REQUESTS = False              # Send a duplicate request when a call is slower than the recent p95
+LLM_BREAKER_THRESHOLD = 5               # Consecutive transient failures that open the circuit breaker
+LLM_BREAKER_RESET = 60                  # Seconds the breaker stays open before a trial call
+
+# Extraction cache: emails (and forwarded copies) extracted before are not sent to the LLM again
+EXTRACTION_CACHE_FILE = "extraction_cache.db"  # SQLite file (None = no cache)
+EXTRACTION_CACHE_TTL = 30 * 24 * 3600   # Seconds a cached extraction stays valid
+EXTRACTION_CACHE_MAX_ENTRIES = 10000    # Least recently used entries beyond this are evicted
+
+# Prompt-size reduction: quoted replies, signatures, footers and HTML are removed before extraction
+CLEAN_EMAIL_BODIES = True
+BODY_TOKEN_BUDGET = 1500                # Estimated tokens a cleaned body may use; keyword sentences are kept first
+
+# Rule-based extraction for templated emails; the LLM only gets the fields the rules can't fill
+USE_RULE_EXTRACTOR = True
+RULE_CONFIDENCE_THRESHOLD = 0.8         # Minimum rule confidence to use a value without the LLM
+RULE_EXTRACTOR_RULES_FILE = "extraction_rules.json"  # Optional per-sender rules (see rule_extractor.py)
+
+# Extracted records are appended to this SQLite database (WAL mode)
+RECORD_STORE_FILE = "extracted_records.db"
+LEGACY_JSON_FILE = "extracted_data.json"  # Old JSON history, imported once on first use
+RECORD_STORE_BUSY_TIMEOUT = 30          # Seconds a writer waits for another one
+
+# Columnar exports (/download/parquet, /download/arrow; need pyarrow from requirements.txt)
+EXPORT_CACHE_DIR = "exports"            # Cached export segments and files
+EXPORT_SEGMENT_SIZE = 50000             # Records per cached segment
+EXPORT_COMPRESSION_LEVEL = 3            # zstd level
+EXPORT_RETENTION = 3600                 # Seconds an unused cached export or segment is kept
+
+# Background jobs for POST /process_emails and the dashboard stream (status at /jobs/<id>)
+JOB_WORKERS = 2                         # Jobs running at once (one per mailbox at most)
+JOB_RETENTION = 3600                    # Seconds a finished job stays queryable
+JOB_HISTORY = 100                       # Finished jobs kept at most
+
+# Per-run processing limits. A run that hits a budget stops and the next run continues where it left off.
+PROCESS_PAGE_SIZE = 50                  # Emails triaged, downloaded and held in memory at a time
+PROCESS_TIME_BUDGET = None              # Seconds a run may spend processing (None = unlimited)
+PROCESS_LLM_BUDGET = None               # LLM extraction calls per run (None = unlimited)
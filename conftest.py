@@ -0,0 +1,30 @@
+"""
+Shared test fixtures.
+"""
+import pytest
+
+@pytest.fixture
+def isolated_stores(tmp_path, monkeypatch):
+    """
+    Point the sync state, record store, extraction cache and usage log at files in tmp_path,
+    and reset their shared instances, so a test never touches the working directory's data.
+    """
+    pytest.importorskip("config")
+    import email_processor
+    import extraction_cache
+    import llm_usage
+    import record_store
+    import sync_state
+
+    monkeypatch.setattr(sync_state, 'SYNC_STATE_FILE', str(tmp_path / 'sync_state.json'))
+    monkeypatch.setattr(record_store, 'RECORD_STORE_FILE', str(tmp_path / 'records.db'))
+    monkeypatch.setattr(record_store, 'LEGACY_JSON_FILE', False)
+    monkeypatch.setattr(record_store, '_store', None)
+    monkeypatch.setattr(extraction_cache, 'EXTRACTION_CACHE_FILE', str(tmp_path / 'cache.db'))
+    monkeypatch.setattr(extraction_cache, '_cache', None)
+    monkeypatch.setattr(llm_usage, 'LLM_USAGE_FILE', str(tmp_path / 'usage.db'))
+    monkeypatch.setattr(llm_usage, '_usage_log', None)
+    monkeypatch.setattr(email_processor, '_classifier', None)
+    monkeypatch.setattr(email_processor, '_classifier_loaded', False)
+    monkeypatch.setattr(email_processor, '_rule_extractor', None)
+    return tmp_path
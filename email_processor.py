@@ -4,6 +4,7 @@ Email processor module for fetching and processing trucking-related emails.
 import imaplib
 import os
 import json
+import time
 from datetime import datetime, timedelta
 import traceback
 
@@ -13,9 +14,32 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 # Import our other modules
-from llm_processor import extract_data_with_llm
-from config import EMAIL_USERNAME, LLM_API_KEY
+from llm_processor import extract_data_with_llm, extract_batch_with_llm, cached_extraction, merge_results
+from llm_resilience import LLMUnavailableError
+from llm_usage import get_usage_log, current_run, describe_run
+import config
+from config import LLM_API_KEY
 from auth import get_credentials
+from imap_client import RoundTripCounter, AMBIGUOUS_SEARCH_KEYWORDS
+from mail_transport import MailAuthError, create_transport
+from relevance import KeywordMatcher, KEYWORD_WEIGHTS
+from extraction_executor import ExtractionExecutor, ExtractionJob
+from relevance_classifier import load_classifier, log_training_example, RELEVANCE_CLASSIFIER_THRESHOLD
+from rule_extractor import RuleExtractor, USE_RULE_EXTRACTOR
+from body_cleaner import clean_body
+from record_store import get_record_store, message_key, RECORD_STORE_FILE
+
+# Let the mail server drop emails without any trucking keyword before they are downloaded
+SERVER_KEYWORD_SEARCH = getattr(config, 'SERVER_KEYWORD_SEARCH', True)
+# Emails triaged, downloaded and held in memory at a time
+PROCESS_PAGE_SIZE = getattr(config, 'PROCESS_PAGE_SIZE', 50)
+# Per-run limits (None = unlimited); the next run resumes where this one stopped
+PROCESS_TIME_BUDGET = getattr(config, 'PROCESS_TIME_BUDGET', None)
+PROCESS_LLM_BUDGET = getattr(config, 'PROCESS_LLM_BUDGET', None)
+# Let the trained local classifier (relevance_classifier.py) skip unpromising LLM calls
+USE_RELEVANCE_CLASSIFIER = getattr(config, 'USE_RELEVANCE_CLASSIFIER', False)
+# Strip quoted history, signatures, boilerplate and HTML before extraction (body_cleaner.py)
+CLEAN_EMAIL_BODIES = getattr(config, 'CLEAN_EMAIL_BODIES', True)
 
 # Define trucking-related keywords
 TRUCKING_KEYWORDS = {
@@ -25,41 +49,343 @@ TRUCKING_KEYWORDS = {
     'tracking', 'id', 'eta', 'arrival', 'departure', 'weight', 'consignment'
 }
 
+# Compiled once: a single whole-word pass over each body with a weighted score
+_matcher = KeywordMatcher(TRUCKING_KEYWORDS, weights=KEYWORD_WEIGHTS)
+
+def server_search_is_safe():
+    """
+    Whether the server-side keyword search can be trusted to keep every email that
+    is_trucking_related would accept: the keywords it leaves out must not reach the
+    relevance threshold on their own.
+    """
+    return _matcher.score(TRUCKING_KEYWORDS & AMBIGUOUS_SEARCH_KEYWORDS) < _matcher.threshold
+
 def is_trucking_related(body_text):
     """
     Check if the email is related to trucking by looking for relevant keywords.
-    Returns True if at least one keyword is found, False otherwise.
+    Returns True if the weighted keyword score reaches RELEVANCE_THRESHOLD, False otherwise.
     """
     if not body_text:
         return False
     
-    # Convert email body to lowercase for case-insensitive matching
-    body_lower = body_text.lower()
-    
-    # Count how many keywords are found
-    found_keywords = [word for word in TRUCKING_KEYWORDS if word in body_lower]
+    # Count whole-word keyword hits in a single pass
+    result = _matcher.match(body_text)
     
-    # Return True if at least one keyword is found
-    if found_keywords:
-        print(f"Found trucking-related keywords: {', '.join(found_keywords)}")
+    if result.relevant:
+        found = ', '.join(f"{word} x{count}" for word, count in sorted(result.counts.items()))
+        print(f"Found trucking-related keywords: {found} (score {result.score:.2f})")
         return True
+    elif result.counts:
+        print(f"Trucking keyword score {result.score:.2f} is below the threshold "
+              f"({', '.join(sorted(result.counts))})")
+        return False
     else:
         print("No trucking-related keywords found in email")
         return False
 
-def process_emails(fields_to_extract=None):
+class RunBudget:
+    """
+    Per-run limits on wall-clock time and LLM calls. None means unlimited.
+    """
+
+    def __init__(self, time_budget=None, llm_budget=None):
+        self.time_budget = time_budget
+        self.llm_budget = llm_budget
+        self.started = time.monotonic()
+        self.llm_calls = 0
+        # LLM calls the relevance classifier avoided
+        self.llm_skips = 0
+        # Emails answered from the extraction cache or the extraction rules alone,
+        # which don't count as LLM calls
+        self.cache_hits = 0
+        self.rule_hits = 0
+        # Estimated prompt tokens of the email bodies before and after cleaning
+        self.body_tokens_before = 0
+        self.body_tokens_after = 0
+        # Emails skipped because their record is already stored
+        self.duplicates = 0
+        # Emails handed to the extraction stage, and whether a limit stopped the run early
+        self.emails = 0
+        self.stopped = False
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def exhausted(self):
+        if self.time_budget is not None and self.elapsed() >= self.time_budget:
+            return True
+        return self.llm_budget is not None and self.llm_calls >= self.llm_budget
+
+    def describe(self):
+        return f"{self.llm_calls} LLM calls in {self.elapsed():.1f}s"
+
+_classifier = None
+_classifier_loaded = False
+
+def get_classifier():
+    """Return the relevance classifier if it is enabled and trained, loading it once."""
+    global _classifier, _classifier_loaded
+    if USE_RELEVANCE_CLASSIFIER and not _classifier_loaded:
+        _classifier = load_classifier()
+        _classifier_loaded = True
+    return _classifier
+
+_rule_extractor = None
+
+def get_rule_extractor():
+    """Return the rule-based extractor if it is enabled, loading the sender rules once."""
+    global _rule_extractor
+    if not USE_RULE_EXTRACTOR:
+        return None
+    if _rule_extractor is None:
+        _rule_extractor = RuleExtractor.load()
+    return _rule_extractor
+
+def _pages(email_ids, page_size):
+    """Yield successive pages of at most page_size email IDs."""
+    for i in range(0, len(email_ids), page_size):
+        yield email_ids[i:i + page_size]
+
+def _passes_triage(transport, summary):
+    """Decide from the triage pass alone whether an email is worth downloading."""
+    email_utils = email_pkg.utils  # Use alias to avoid conflicts
+    msg_subject = summary.headers['subject'] or ""
+    
+    # Check if the email is unread (if we used ALL search)
+    if transport.needs_unread_check:
+        # Look for \Seen flag (fetched with the headers)
+        if '\\Seen' in summary.flags:
+            print(f"Skipping read email: {msg_subject}")
+            return False
+    
+    # Check date if necessary (if we didn't use SINCE in search)
+    if transport.needs_date_check:
+        # Parse the email date
+        try:
+            date_tuple = email_utils.parsedate_tz(summary.headers['date'])
+            if date_tuple:
+                parsed_datetime = datetime.fromtimestamp(email_utils.mktime_tz(date_tuple))
+                cutoff_date = datetime.now() - timedelta(days=1)
+                if parsed_datetime < cutoff_date:
+                    print(f"Skipping old email from {parsed_datetime}: {msg_subject}")
+                    return False
+        except Exception as e:
+            print(f"Error parsing date, processing anyway: {e}")
+    
+    if summary.text_part is None:
+        print(f"Skipping email without a text part: {msg_subject}")
+        return False
+    return True
+
+def _drop_stored(candidates, fields_to_extract):
+    """
+    Drop the emails whose Message-ID already has a stored record with every requested field,
+    before they are downloaded. Stored emails that lack some of the fields go on, and only
+    the missing fields are extracted (the extraction cache has the others).
+    """
+    keys = {summary.uid: message_key(summary.headers['message-id'])
+            for summary in candidates if (summary.headers['message-id'] or '').strip()}
+    stored = get_record_store().stored_fields(keys.values()) if keys else {}
+    return [summary for summary in candidates
+            if not stored.get(keys.get(summary.uid), set()).issuperset(fields_to_extract)]
+
+def _prepare_message(fetched, fields_to_extract, budget):
+    """
+    Decode one downloaded email and decide whether it needs an LLM call.
+
+    Returns:
+        ExtractionJob: With body=None when the email is skipped.
+    """
+    msg_id = fetched.uid
+    context = {}
+    try:
+        msg = fetched.message
+        
+        # Get email metadata
+        context = {
+            'email_subject': msg['subject'] or "",
+            'email_date': msg['date'],
+            'email_from': msg['from'] or "",
+            'email_message_id': (msg['message-id'] or "").strip(),
+        }
+        msg_subject = context['email_subject']
+        
+        print(f"Processing email: {msg_subject} from {context['email_from']} dated {context['email_date']}")
+        
+        # Get email content
+        body = ""
+        if msg.is_multipart():
+            for part in msg.walk():
+                if part.get_content_type() == "text/plain":
+                    try:
+                        body = part.get_payload(decode=True).decode()
+                        break
+                    except Exception:
+                        body = part.get_payload(decode=True).decode('latin-1', errors='ignore')
+                        break
+        else:
+            try:
+                body = msg.get_payload(decode=True).decode()
+            except Exception:
+                body = msg.get_payload(decode=True).decode('latin-1', errors='ignore')
+        
+        # Records are stored under this key; mail without a Message-ID could not be
+        # checked before download, so it is checked now, before any LLM work
+        context['email_key'] = message_key(context['email_message_id'], context['email_from'],
+                                           context['email_date'], body)
+        if not context['email_message_id'] and get_record_store().stored_fields(
+                [context['email_key']]).get(context['email_key'], set()).issuperset(fields_to_extract):
+            print(f"Skipping email that is already stored: {msg_subject}")
+            budget.duplicates += 1
+            return ExtractionJob(msg_id, None, fields_to_extract, dict(context, duplicate=True))
+        
+        # Check if email is trucking-related
+        if not is_trucking_related(body):
+            print(f"Skipping non-trucking email: {msg_subject}")
+            return ExtractionJob(msg_id, None, fields_to_extract, context)
+        
+        # Ask the local classifier whether the LLM is likely to find anything. It scores
+        # the body as decoded, and the training log gets that same text
+        scored_text = body
+        classifier = get_classifier()
+        if classifier is not None:
+            probability = classifier.predict_proba(scored_text)
+            if probability < RELEVANCE_CLASSIFIER_THRESHOLD:
+                print(f"Skipping email the relevance classifier rates {probability:.2f}: {msg_subject}")
+                budget.llm_skips += 1
+                return ExtractionJob(msg_id, None, fields_to_extract, context)
+        
+        # Only the new, relevant text goes into the prompt; what is kept are verbatim
+        # slices of the body, so _finish_record can map the contexts back to the email
+        cleaned = None
+        if CLEAN_EMAIL_BODIES:
+            cleaned = clean_body(body,
+                                 is_relevant=lambda text: _matcher.match(text).relevant,
+                                 is_keyword_sentence=lambda sentence: bool(_matcher.count(sentence)),
+                                 html=not msg.is_multipart() and msg.get_content_type() == 'text/html')
+            budget.body_tokens_before += cleaned.tokens_before
+            budget.body_tokens_after += cleaned.tokens_after
+            print(f"Cleaned body: {cleaned.tokens_before} -> {cleaned.tokens_after} estimated tokens")
+            body = cleaned.text
+        
+        # The same body (or a forwarded copy of it) may have been extracted before,
+        # possibly for some of these fields only
+        known, missing = cached_extraction(body, fields_to_extract)
+        if not missing:
+            print(f"Using cached extraction for email: {msg_subject}")
+            budget.cache_hits += 1
+            return ExtractionJob(msg_id, None, fields_to_extract, context,
+                                 merge_results(known, None, fields_to_extract), scored_text, cleaned)
+        
+        # Templated emails can often be read with the extraction rules alone
+        extractor = get_rule_extractor()
+        if extractor is not None:
+            ruled = extractor.confident(body, missing, context['email_from'])
+            known.update(ruled)
+            missing = [field for field in missing if field not in ruled]
+            if not missing:
+                print(f"Extracted every field with rules for email: {msg_subject}")
+                budget.rule_hits += 1
+                return ExtractionJob(msg_id, None, fields_to_extract, context,
+                                     merge_results(known, None, fields_to_extract), scored_text, cleaned)
+        
+        if known:
+            print(f"Extracting only {', '.join(missing)} (other fields cached or found by rules) for email: {msg_subject}")
+        
+        budget.llm_calls += 1
+        # The cached and rule-extracted fields ride along in result and are merged back in by _finish_record
+        return ExtractionJob(msg_id, body, missing, context, known, scored_text, cleaned)
+        
+    except Exception as e:
+        print(f"Error processing email {msg_id}: {str(e)}")
+        print(traceback.format_exc())
+        return ExtractionJob(msg_id, None, fields_to_extract, context)
+
+def _extraction_jobs(page, fetched_by_id, fields_to_extract, budget):
+    """
+    Yield an ExtractionJob for every email in the page, in order, until the run budget
+    is exhausted. At least one email is always handled so every run makes progress.
+    """
+    for msg_id in page:
+        if budget.emails and budget.exhausted():
+            budget.stopped = True
+            return
+        budget.emails += 1
+        fetched = fetched_by_id.pop(msg_id, None)
+        if fetched is None:
+            # Dropped by triage
+            yield ExtractionJob(msg_id, None, fields_to_extract, {})
+        else:
+            yield _prepare_message(fetched, fields_to_extract, budget)
+
+def _contexts_to_source(record, cleaned):
+    """
+    Replace each context quoted from the cleaned body with the same span of the email as
+    decoded, so a context that runs across a cut (two slices joined by a line break) is
+    still a verbatim piece of the email. Contexts that can't be located are left as they are.
+    """
+    for field, value in record.items():
+        if isinstance(value, dict) and value.get('context'):
+            span = cleaned.locate(value['context'])
+            if span is not None:
+                record[field] = dict(value, context=cleaned.source[span[0]:span[1]])
+    return record
+
+def _finish_record(job, extracted_info, fields_to_extract):
+    """Attach the email metadata to an LLM (or cached) result. Returns the record or None."""
+    msg_subject = job.context.get('email_subject', '')
+    if job.body is not None:
+        # Add back the fields that were already cached for this body
+        extracted_info = merge_results(job.result, extracted_info, fields_to_extract)
+        if not extracted_info:
+            print(f"No valid data found in email: {msg_subject}")
+    if job.scored_text is not None:
+        # Remember the outcome so the classifier can be retrained on it; fields found in
+        # the cache or by the rules count as much as the LLM's
+        log_training_example(job.scored_text, bool(extracted_info))
+    if not extracted_info:
+        return None
+    if job.cleaned is not None:
+        extracted_info = _contexts_to_source(extracted_info, job.cleaned)
+    # Add email metadata
+    extracted_info.update(job.context)
+    print(f"Successfully processed email: {msg_subject}")
+    return extracted_info
+
+def process_emails(fields_to_extract=None, credentials_provider=None, transport=None, on_record=None,
+                   on_progress=None, raise_errors=False, save=False):
     """
     Process unread emails and extract relevant information.
     
     Args:
         fields_to_extract (list, optional): List of fields to extract from emails.
                                            Defaults to standard fields if None.
+        credentials_provider (callable, optional): Returns OAuth2 credentials.
+                                                   Defaults to the logged-in session's credentials.
+        transport (optional): Mail transport to use for this run (see mail_transport).
+                              Defaults to the one configured with MAIL_TRANSPORT.
+        on_record (callable, optional): Called with each extracted record as soon as it is ready.
+        on_progress (callable, optional): Called as on_progress(stage, counts) whenever emails are
+                                          'found', 'filtered', 'duplicates' (already stored), 'fetched',
+                                          'extracted' or 'skipped';
+                                          counts holds the running totals of every stage.
+        raise_errors (bool, optional): Re-raise an error that stops the run (after the connection
+                                       and usage run are cleaned up) instead of returning [], so a
+                                       caller can tell a failed run from one that found nothing.
+        save (bool, optional): Append the records to the record store before the sync state is
+                               saved. If that fails the run fails and the state stays where it
+                               was, so the next run fetches the same mail again.
     
     Returns:
         list: Extracted data from emails.
     """
+    credentials_provider = credentials_provider or get_credentials
+    transport = transport or create_transport()
+    connected = False
+    # The usage log run that LLM calls are accounted to, once extraction starts
+    usage_log = usage_run = None
     try:
-        print("Attempting to connect to email server...")
+        print(f"Attempting to connect to email server ({transport.name})...")
         
         # Default fields if none provided
         if fields_to_extract is None:
@@ -68,231 +394,210 @@ def process_emails(fields_to_extract=None):
         print(f"Will extract the following fields: {', '.join(fields_to_extract)}")
         
         # Get OAuth2 credentials
-        credentials = get_credentials()
+        credentials = credentials_provider()
         if not credentials:
-            print("No valid credentials found. Please log in first.")
-            return []
+            raise MailAuthError("No valid credentials found. Please log in first.")
             
         print(f"Got credentials with token length: {len(credentials.token)}")
         print(f"Token expired: {credentials.expired}")
         if hasattr(credentials, 'expiry'):
             print(f"Token valid until: {credentials.expiry}")
             
-        # Create IMAP connection with retry logic
+        # Count server round trips per stage so we can see where they go
+        stats = RoundTripCounter(transport.name)
+        
+        # Connect (reusing a pooled connection when possible) with retry logic
         max_retries = 3
         retry_count = 0
-        mail = None
         
         while retry_count < max_retries:
             try:
-                # Create IMAP connection
-                mail = imaplib.IMAP4_SSL("imap.gmail.com")
-                
-                # Authenticate using OAuth2
-                auth_string = f'user={EMAIL_USERNAME}\1auth=Bearer {credentials.token}\1\1'
-                print(f"Using email: {EMAIL_USERNAME}")
-                print(f"Auth string length: {len(auth_string)}")
+                print(f"Using email: {transport.account}")
                 print(f"Token starts with: {credentials.token[:10]}...")
                 
-                # Debug IMAP connection
-                print("IMAP connection established, attempting authentication...")
-                mail.authenticate('XOAUTH2', lambda x: auth_string.encode())
+                transport.connect(credentials, stats)
+                connected = True
                 
                 print("Successfully connected to email server")
                 break  # If successful, break the retry loop
                 
-            except imaplib.IMAP4.error as e:
+            except MailAuthError as e:
                 retry_count += 1
                 print(f"Authentication attempt {retry_count} failed: {str(e)}")
                 
                 if retry_count == max_retries:
-                    print("Max retries reached. Please log in again.")
-                    return []
+                    raise MailAuthError(f"Authentication failed {max_retries} times. Please log in again.")
                     
                 # Try to refresh credentials before retrying
                 print("Attempting to refresh credentials...")
-                credentials = get_credentials()
+                credentials = credentials_provider()
                 if not credentials:
-                    print("Failed to refresh credentials")
-                    return []
+                    raise MailAuthError("Failed to refresh credentials. Please log in again.")
                     
                 print("Retrying with refreshed credentials...")
                 continue
                 
-        # Select the inbox
-        mail.select('INBOX')
+        # Running totals reported through on_progress
+        progress = {'found': 0, 'filtered': 0, 'duplicates': 0, 'fetched': 0, 'extracted': 0, 'skipped': 0}
         
-        # Get date 24 hours ago in the required format (DD-MMM-YYYY)
-        date_since = (datetime.now() - timedelta(days=1)).strftime("%d-%b-%Y")
-        print(f"Searching for emails since: {date_since}")
+        def report(stage, count=1):
+            progress[stage] += count
+            if on_progress and count:
+                on_progress(stage, dict(progress))
         
-        # Try multiple search approaches for compatibility
-        found_emails = False
-        message_numbers = None
-        search_criteria = ""
-        
-        # Approach 1: Try standard UNSEEN SINCE search
-        try:
-            print("Trying standard UNSEEN SINCE search...")
-            search_criteria = f'(UNSEEN SINCE "{date_since}")'
-            print(f"Using search criteria: {search_criteria}")
-            _, message_numbers = mail.search(None, search_criteria)
-            if message_numbers and message_numbers[0]:
-                found_emails = True
-                print(f"Found {len(message_numbers[0].split())} unread emails since {date_since}")
-        except Exception as e:
-            print(f"Standard search failed: {e}")
+        # Find mail that arrived since the state saved by the previous run
+        email_ids = transport.find_new_messages(stats)
+        report('found', len(email_ids))
         
-        # Approach 2: If no emails found, try just UNSEEN
-        if not found_emails:
-            try:
-                print("Trying simple UNSEEN search...")
-                search_criteria = 'UNSEEN'
-                _, message_numbers = mail.search(None, search_criteria)
-                if message_numbers and message_numbers[0]:
-                    found_emails = True
-                    print(f"Found {len(message_numbers[0].split())} unread emails")
-            except Exception as e:
-                print(f"UNSEEN search failed: {e}")
-        
-        # Approach 3: Last resort, try ALL and filter later
-        if not found_emails:
-            try:
-                print("Trying to search for ALL emails as last resort...")
-                search_criteria = 'ALL'
-                _, message_numbers = mail.search(None, search_criteria)
-                if message_numbers and message_numbers[0]:
-                    found_emails = True
-                    print(f"Found {len(message_numbers[0].split())} total emails, will filter later")
-            except Exception as e:
-                print(f"ALL search failed: {e}")
-                return []  # If we can't even search, exit
-        
-        if not message_numbers or not message_numbers[0]:
+        if not email_ids:
             print("No emails found with any search method")
+            transport.finish()
+            print(stats.summary())
             return []
         
-        email_ids = message_numbers[0].split()
-        print(f"Processing {len(email_ids)} emails")
+        # Only download emails the server says contain a trucking keyword;
+        # is_trucking_related still verifies each one after download
+        if SERVER_KEYWORD_SEARCH and not server_search_is_safe():
+            print("Server-side keyword search skipped: the keywords it leaves out can reach "
+                  "RELEVANCE_THRESHOLD on their own")
+        elif SERVER_KEYWORD_SEARCH:
+            candidate_count = len(email_ids)
+            email_ids = transport.filter_by_keywords(email_ids, TRUCKING_KEYWORDS, stats)
+            print(f"Server-side keyword search: downloading {len(email_ids)} of {candidate_count} candidate emails "
+                  f"({candidate_count - len(email_ids)} downloads avoided)")
+            report('filtered', candidate_count - len(email_ids))
+            if not email_ids:
+                transport.finish()
+                print(stats.summary())
+                return []
         
-        # Limit to processing at most 10 emails to avoid overload
-        if len(email_ids) > 10:
-            print(f"Limiting to processing 10 emails out of {len(email_ids)} found")
-            email_ids = email_ids[:10]
+        print(f"Processing {len(email_ids)} emails in pages of {PROCESS_PAGE_SIZE}")
         
         extracted_data = []
-        email_utils = email_pkg.utils  # Use alias to avoid conflicts
+        budget = RunBudget(PROCESS_TIME_BUDGET, PROCESS_LLM_BUDGET)
+        # Keeps LLM_CONCURRENCY extraction calls in flight, rate limited,
+        # packing up to LLM_BATCH_SIZE emails into each prompt
+        executor = ExtractionExecutor(extract_data_with_llm, batch_extract=extract_batch_with_llm,
+                                      stop_on=(LLMUnavailableError,))
+        triaged = downloaded = 0
+        # Last email handled (processed or skipped) in order; everything before it is done
+        last_handled_id = None
+        usage_log = get_usage_log()
+        usage_run = usage_log.start_run() if usage_log else None
+        current_run.set(usage_run)
         
-        # Process each email
-        for msg_id in email_ids:
+        for page in _pages(email_ids, PROCESS_PAGE_SIZE):
+            # First pass: flags, dates, size, a few headers and the MIME structure, no bodies
+            candidates = [summary for summary in transport.triage(page, stats)
+                          if _passes_triage(transport, summary)]
+            triaged += len(page)
+            report('filtered', len(page) - len(candidates))
+            # Mail stored by an earlier run is neither downloaded nor extracted again
+            new_candidates = _drop_stored(candidates, fields_to_extract)
+            budget.duplicates += len(candidates) - len(new_candidates)
+            report('duplicates', len(candidates) - len(new_candidates))
+            candidates = new_candidates
+            downloaded += len(candidates)
+            
+            # Download only the text part of the remaining messages in this page.
+            # At most one page of messages is held in memory at a time.
+            fetched_by_id = {fetched.uid: fetched for fetched in transport.fetch_text(candidates, stats)}
+            fetched_ids = set(fetched_by_id)
+            report('fetched', len(fetched_ids))
+            
+            # Results come back in page order, so the resume point stays exact
+            jobs = _extraction_jobs(page, fetched_by_id, fields_to_extract, budget)
             try:
-                # Fetch the email message
-                _, msg_data = mail.fetch(msg_id, '(RFC822)')
-                raw_email = msg_data[0][1]
-                msg = email_pkg.message_from_bytes(raw_email)
-                
-                # Get email metadata
-                msg_date = msg['date']
-                msg_subject = msg['subject'] or ""
-                msg_from = msg['from'] or ""
-                
-                # Check if the email is unread (if we used ALL search)
-                if search_criteria == 'ALL':
-                    # Look for \Seen flag
-                    _, flags_data = mail.fetch(msg_id, '(FLAGS)')
-                    if '\\Seen' in str(flags_data[0]):
-                        print(f"Skipping read email: {msg_subject}")
-                        continue
-                
-                # Check date if necessary (if we didn't use SINCE in search)
-                if 'SINCE' not in search_criteria:
-                    # Parse the email date
-                    try:
-                        date_tuple = email_utils.parsedate_tz(msg_date)
-                        if date_tuple:
-                            parsed_datetime = datetime.fromtimestamp(email_utils.mktime_tz(date_tuple))
-                            cutoff_date = datetime.now() - timedelta(days=1)
-                            if parsed_datetime < cutoff_date:
-                                print(f"Skipping old email from {parsed_datetime}: {msg_subject}")
-                                continue
-                    except Exception as e:
-                        print(f"Error parsing date, processing anyway: {e}")
-                
-                print(f"Processing email: {msg_subject} from {msg_from} dated {msg_date}")
-                
-                # Get email content
-                body = ""
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        if part.get_content_type() == "text/plain":
-                            try:
-                                body = part.get_payload(decode=True).decode()
-                                break
-                            except Exception:
-                                body = part.get_payload(decode=True).decode('latin-1', errors='ignore')
-                                break
-                else:
-                    try:
-                        body = msg.get_payload(decode=True).decode()
-                    except Exception:
-                        body = msg.get_payload(decode=True).decode('latin-1', errors='ignore')
-                
-                # Check if email is trucking-related
-                if not is_trucking_related(body):
-                    print(f"Skipping non-trucking email: {msg_subject}")
-                    continue
-                
-                # Extract data using LLM with the provided fields
-                extracted_info = extract_data_with_llm(body, fields_to_extract)
-                
-                if extracted_info:
-                    # Add email metadata
-                    extracted_info['email_subject'] = msg_subject
-                    extracted_info['email_date'] = msg_date
-                    extracted_info['email_from'] = msg_from
-                    extracted_data.append(extracted_info)
-                    print(f"Successfully processed email: {msg_subject}")
-                else:
-                    print(f"No valid data found in email: {msg_subject}")
-                
-            except Exception as e:
-                print(f"Error processing email {msg_id}: {str(e)}")
-                print(traceback.format_exc())
-                continue
+                for job, extracted_info in executor.run(jobs):
+                    record = _finish_record(job, extracted_info, fields_to_extract)
+                    if record:
+                        extracted_data.append(record)
+                        if on_record:
+                            on_record(record)
+                        report('extracted')
+                    elif job.context.get('duplicate'):
+                        report('duplicates')
+                    elif job.key in fetched_ids:
+                        # Emails dropped before download were already reported as filtered
+                        report('skipped')
+                    last_handled_id = job.key
+            except LLMUnavailableError as e:
+                # Stop at the first email the LLM could not handle; the next run retries it
+                print(f"Stopping early, the LLM is unavailable: {str(e)}")
+                budget.stopped = True
+            if budget.stopped:
+                break
+        
+        print(f"Triage: downloaded the text of {downloaded} of {triaged} emails")
+        if budget.llm_calls:
+            print(f"LLM: {executor.requests} requests for {budget.llm_calls} emails")
+        if budget.body_tokens_before:
+            saved = 1 - budget.body_tokens_after / budget.body_tokens_before
+            print(f"Prompt bodies: {budget.body_tokens_before} -> {budget.body_tokens_after} "
+                  f"estimated tokens ({saved:.0%} smaller)")
+        if budget.duplicates:
+            print(f"Skipped {budget.duplicates} emails already in the record store")
+        if budget.cache_hits:
+            print(f"Extraction cache answered {budget.cache_hits} emails without an LLM call")
+        if budget.rule_hits:
+            print(f"Extraction rules answered {budget.rule_hits} emails without an LLM call")
+        if budget.llm_skips:
+            print(f"Relevance classifier skipped {budget.llm_skips} of "
+                  f"{budget.llm_skips + budget.llm_calls} LLM calls")
+        if usage_run is not None:
+            current_run.set(None)
+            usage_log.finish_run(usage_run)
+            print(describe_run(usage_log.run_summary(usage_run)))
+        if budget.stopped:
+            # Leave the rest for the next run
+            print(f"Stopped after {budget.describe()}; "
+                  f"the next run continues after email {last_handled_id}")
         
-        # Close the connection
-        mail.close()
-        mail.logout()
+        # The records must be stored before the sync state moves past their emails
+        if save and extracted_data:
+            save_records(extracted_data)
+        
+        # Save the sync state (or the resume point) and return the connection to the pool
+        if budget.stopped and last_handled_id is None:
+            # Nothing was handled, so the saved state must not move
+            transport.abort()
+        else:
+            transport.finish(last_handled_id if budget.stopped else None)
+        print(stats.summary())
         
         return extracted_data
         
     except Exception as e:
+        # The connection may be in an unknown state, so don't reuse it
+        if connected:
+            transport.abort()
+        if usage_run is not None:
+            current_run.set(None)
+            usage_log.finish_run(usage_run)
         print(f"An error occurred: {str(e)}")
         print(traceback.format_exc())
+        if raise_errors:
+            raise
         return []
 
-def save_to_json(data, filename='extracted_data.json'):
-    """Save extracted data to a JSON file."""
+def save_records(data):
+    """
+    Append extracted records to the record store.
+
+    Errors are raised, not swallowed: a caller that can't store the records must not let
+    the sync state move past their emails.
+    """
     try:
-        # Load existing data if file exists
-        existing_data = []
-        if os.path.exists(filename):
-            with open(filename, 'r') as f:
-                existing_data = json.load(f)
-        
-        # Append new data
-        existing_data.extend(data)
-        
-        # Save updated data
-        with open(filename, 'w') as f:
-            json.dump(existing_data, f, indent=2)
-            
-        print(f"Data saved to {filename}")
+        count = get_record_store().append(data)
     except Exception as e:
         print(f"Error saving data: {str(e)}")
+        raise
+    print(f"Saved {count} records to {RECORD_STORE_FILE}"
+          + (f" ({len(data) - count} already stored)" if len(data) > count else ""))
+
+# Earlier name; records are no longer written to a JSON file
+save_to_json = save_records
 
 if __name__ == "__main__":
     # Test the email processing
-    extracted_data = process_emails()
-    if extracted_data:
-        save_to_json(extracted_data)
\ No newline at end of file
+    process_emails(save=True)
\ No newline at end of file
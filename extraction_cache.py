@@ -0,0 +1,170 @@
+"""
+Persistent, content-addressed cache of LLM extraction results.
+
+Entries are keyed by a hash of the normalized email body, the model name and the prompt
+version, so the same email (or a forwarded or re-quoted copy of it) is only sent to the LLM
+once. Each entry holds the {value, context} of every field extracted from that body so far:
+when fields are added only the missing ones need the LLM, and removed fields are simply not
+returned. N/A answers are cached too; failed calls are not.
+
+Entries live in a small SQLite database and are evicted when they are older than
+EXTRACTION_CACHE_TTL or, least recently used first, when there are more than
+EXTRACTION_CACHE_MAX_ENTRIES.
+"""
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import config
+
+EXTRACTION_CACHE_FILE = getattr(config, 'EXTRACTION_CACHE_FILE', 'extraction_cache.db')
+EXTRACTION_CACHE_TTL = getattr(config, 'EXTRACTION_CACHE_TTL', 30 * 24 * 3600)
+EXTRACTION_CACHE_MAX_ENTRIES = getattr(config, 'EXTRACTION_CACHE_MAX_ENTRIES', 10000)
+
+# Gmail / Outlook style "forwarded message" separators and the header block that follows them
+_FORWARD_MARKER_RE = re.compile(r'^-{2,}\s*(forwarded message|original message)\s*-{2,}$', re.IGNORECASE)
+_FORWARD_HEADER_RE = re.compile(r'^(from|sent|date|to|cc|subject):', re.IGNORECASE)
+_QUOTE_RE = re.compile(r'^(\s*>)+\s?')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def normalize_body(body):
+    """
+    Reduce an email body to the text that matters for extraction: quote markers,
+    forwarded-message headers and whitespace differences are removed.
+    """
+    lines = []
+    in_forward_header = False
+    for line in (body or '').splitlines():
+        line = _QUOTE_RE.sub('', line).strip()
+        if _FORWARD_MARKER_RE.match(line):
+            in_forward_header = True
+            continue
+        if in_forward_header:
+            if _FORWARD_HEADER_RE.match(line):
+                continue
+            if not line:
+                continue
+            in_forward_header = False
+        lines.append(line)
+    return _WHITESPACE_RE.sub(' ', ' '.join(lines)).strip()
+
+def cache_key(body, model, prompt_version):
+    digest = hashlib.sha256()
+    for part in (normalize_body(body), model, str(prompt_version)):
+        digest.update(part.encode('utf-8', errors='surrogatepass'))
+        digest.update(b'\x1f')
+    return digest.hexdigest()
+
+class ExtractionCache:
+    """
+    SQLite-backed extraction cache, safe to share between threads.
+
+    Args:
+        filename (str, optional): Database file. Defaults to EXTRACTION_CACHE_FILE.
+        ttl (int, optional): Seconds an entry stays valid. Defaults to EXTRACTION_CACHE_TTL.
+        max_entries (int, optional): Entries kept before LRU eviction. Defaults to EXTRACTION_CACHE_MAX_ENTRIES.
+    """
+
+    def __init__(self, filename=None, ttl=None, max_entries=None):
+        self.filename = filename or EXTRACTION_CACHE_FILE
+        self.ttl = ttl or EXTRACTION_CACHE_TTL
+        self.max_entries = max_entries or EXTRACTION_CACHE_MAX_ENTRIES
+        # Lookups that found every requested field, some of them, or none
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.filename, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS extractions_last_used ON extractions (last_used)")
+        self.db.commit()
+
+    def _load(self, key, now):
+        """Return (fields, created) for a live entry, or ({}, now) if there is none."""
+        row = self.db.execute("SELECT value, created FROM extractions WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < now - self.ttl:
+            return {}, now
+        return json.loads(row[0]), row[1]
+
+    def get(self, key, fields):
+        """
+        Look up the requested fields of one email.
+
+        Returns:
+            tuple: (known, missing). known maps each cached field to its {value, context};
+                   missing lists the requested fields that still need the LLM.
+        """
+        now = time.time()
+        with self.lock:
+            stored, _ = self._load(key, now)
+            known = {field: stored[field] for field in fields if field in stored}
+            missing = [field for field in fields if field not in stored]
+            if known:
+                self.db.execute("UPDATE extractions SET last_used = ? WHERE key = ?", (now, key))
+                self.db.commit()
+            if not missing:
+                self.hits += 1
+            elif known:
+                self.partial_hits += 1
+            else:
+                self.misses += 1
+        return known, missing
+
+    def put(self, key, fields):
+        """Merge newly extracted fields ({field: {value, context}}) into an email's entry."""
+        now = time.time()
+        with self.lock:
+            stored, created = self._load(key, now)
+            stored.update(fields)
+            self.db.execute(
+                "INSERT OR REPLACE INTO extractions (key, value, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(stored), created, now)
+            )
+            self._evict(now)
+            self.db.commit()
+
+    def _evict(self, now):
+        """Drop expired entries, then the least recently used ones beyond max_entries."""
+        expired = self.db.execute("DELETE FROM extractions WHERE created < ?", (now - self.ttl,)).rowcount
+        count = self.db.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.db.execute(
+                "DELETE FROM extractions WHERE key IN (SELECT key FROM extractions ORDER BY last_used LIMIT ?)",
+                (excess,)
+            )
+        self.evictions += expired + max(excess, 0)
+
+    def stats(self):
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+        return {'hits': self.hits, 'partial_hits': self.partial_hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': entries}
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM extractions")
+            self.db.commit()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Return the shared cache, or None if caching is disabled (EXTRACTION_CACHE_FILE = None)."""
+    global _cache
+    if not EXTRACTION_CACHE_FILE:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = ExtractionCache()
+            except sqlite3.Error as e:
+                print(f"Extraction cache unavailable: {str(e)}")
+                return None
+        return _cache
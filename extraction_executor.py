@@ -0,0 +1,213 @@
+"""
+Concurrent LLM extraction with rate limiting.
+
+ExtractionExecutor keeps up to LLM_CONCURRENCY extraction calls in flight on a thread pool,
+paced by token buckets for requests per minute and (estimated) tokens per minute. Results
+come back in the order the jobs went in, and one failing email does not affect the others.
+
+With a batch_extract function and LLM_BATCH_SIZE > 1, consecutive emails are packed into
+one prompt (up to LLM_BATCH_TOKEN_BUDGET estimated tokens), so the instructions are sent
+once per batch instead of once per email. Emails the batched reply gets wrong are retried
+one prompt each.
+
+    executor = ExtractionExecutor(extract_data_with_llm)
+    for job, result in executor.run(jobs):
+        ...
+"""
+import time
+import threading
+import contextvars
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+LLM_CONCURRENCY = getattr(config, 'LLM_CONCURRENCY', 4)
+LLM_REQUESTS_PER_MINUTE = getattr(config, 'LLM_REQUESTS_PER_MINUTE', 60)
+LLM_TOKENS_PER_MINUTE = getattr(config, 'LLM_TOKENS_PER_MINUTE', 1000000)
+# Emails packed into one prompt (1 = one prompt per email) and the prompt size they may add up to
+LLM_BATCH_SIZE = getattr(config, 'LLM_BATCH_SIZE', 1)
+LLM_BATCH_TOKEN_BUDGET = getattr(config, 'LLM_BATCH_TOKEN_BUDGET', 8000)
+
+# Rough size of the extraction instructions wrapped around each email, in tokens
+PROMPT_OVERHEAD_TOKENS = 250
+
+# body=None marks an email that needs no LLM call; it still comes back in order, with
+# result (e.g. an answer from the extraction cache) as its result. The executor ignores
+# result for jobs with a body, so callers may use it to carry along partial results.
+# scored_text is the text the relevance classifier scored, kept for its training log, and
+# cleaned the CleanedBody that body was cut from, used to map contexts back to the email.
+ExtractionJob = namedtuple('ExtractionJob', ['key', 'body', 'fields', 'context', 'result', 'scored_text', 'cleaned'],
+                           defaults=(None, None, None))
+
+def estimate_tokens(text):
+    """Approximate prompt tokens for a text (about four characters per token)."""
+    return PROMPT_OVERHEAD_TOKENS + len(text or '') // 4
+
+def _batch_tag(job, used):
+    """The ID an email is tagged with in a batched prompt: its Message-ID, made unique if needed."""
+    key = job.key.decode() if isinstance(job.key, bytes) else str(job.key)
+    tag = (job.context or {}).get('email_message_id') or key
+    if tag in used:
+        tag = f"{tag}#{key}"
+    used.add(tag)
+    return tag
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_minute, holding at most one
+    minute's worth. A rate of None or 0 disables the limit.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute
+        self.capacity = rate_per_minute or 0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate / 60.0)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """
+        Block until amount tokens are available and take them. Requests larger than the
+        bucket wait for a full bucket and leave it in debt, which later callers wait out.
+        """
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                self._refill()
+                needed = min(amount, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                wait = (needed - self.tokens) * 60.0 / self.rate
+            time.sleep(wait)
+
+class ExtractionExecutor:
+    """
+    Run extraction calls concurrently, rate limited, yielding results in job order.
+
+    Args:
+        extract (callable): Called as extract(body, fields); usually extract_data_with_llm.
+        concurrency (int, optional): Calls in flight at once. Defaults to LLM_CONCURRENCY.
+        requests_per_minute (int, optional): 0 = unlimited. Defaults to LLM_REQUESTS_PER_MINUTE,
+            where None = unlimited.
+        tokens_per_minute (int, optional): 0 = unlimited. Defaults to LLM_TOKENS_PER_MINUTE,
+            where None = unlimited.
+        batch_extract (callable, optional): Called as batch_extract([(tag, body), ...], fields) and
+            returning {tag: result}; usually extract_batch_with_llm. Enables batching.
+        batch_size (int, optional): Most emails per batched prompt. Defaults to LLM_BATCH_SIZE.
+        batch_token_budget (int, optional): Most estimated tokens per batched prompt.
+            Defaults to LLM_BATCH_TOKEN_BUDGET.
+        stop_on (tuple, optional): Exception types that are not isolated to one email but
+            raised from run(), e.g. when the LLM is unavailable.
+    """
+
+    def __init__(self, extract, concurrency=None, requests_per_minute=None, tokens_per_minute=None,
+                 batch_extract=None, batch_size=None, batch_token_budget=None, stop_on=()):
+        self.extract = extract
+        self.concurrency = max(1, concurrency or LLM_CONCURRENCY)
+        # None means "not given" here, so 0 is how a caller asks for no limit
+        self.request_bucket = TokenBucket(
+            LLM_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute)
+        self.token_bucket = TokenBucket(
+            LLM_TOKENS_PER_MINUTE if tokens_per_minute is None else tokens_per_minute)
+        self.batch_extract = batch_extract
+        self.batch_size = max(1, batch_size or LLM_BATCH_SIZE) if batch_extract else 1
+        self.batch_token_budget = batch_token_budget or LLM_BATCH_TOKEN_BUDGET
+        self.stop_on = tuple(stop_on)
+        # LLM requests sent, to compare batched and unbatched runs
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def _count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def _call(self, job):
+        self.request_bucket.acquire()
+        self.token_bucket.acquire(estimate_tokens(job.body))
+        self._count_request()
+        try:
+            return self.extract(job.body, job.fields)
+        except self.stop_on:
+            raise
+        except Exception as e:
+            # One failing email must not take down the rest of the run
+            print(f"Error extracting data for email {job.key}: {str(e)}")
+            return None
+
+    def _call_batch(self, jobs):
+        """Extract a batch with one prompt, retrying emails the reply got wrong one at a time."""
+        if len(jobs) == 1:
+            return [self._call(jobs[0])]
+        used = set()
+        tags = [_batch_tag(job, used) for job in jobs]
+        self.request_bucket.acquire()
+        # The instructions are only sent once for the whole batch
+        self.token_bucket.acquire(PROMPT_OVERHEAD_TOKENS + sum(len(job.body) // 4 for job in jobs))
+        self._count_request()
+        try:
+            results = self.batch_extract(list(zip(tags, (job.body for job in jobs))), jobs[0].fields) or {}
+        except self.stop_on:
+            raise
+        except Exception as e:
+            print(f"Error extracting batch of {len(jobs)} emails: {str(e)}")
+            results = {}
+        return [results[tag] if tag in results else self._call(job) for tag, job in zip(tags, jobs)]
+
+    def run(self, jobs):
+        """
+        Pull jobs lazily from an iterable and yield (job, result) pairs in the same order.
+
+        Only a bounded number of jobs is taken from the iterable ahead of what has been
+        yielded, so a slow call does not stall the others and the caller can stop
+        producing jobs (e.g. when a budget runs out) without much work in flight.
+        """
+        # Each entry is [job, future, index in the batch]; the future is None for jobs without a body
+        pending = deque()
+        batch = []
+        batch_tokens = 0
+        window = self.concurrency * 2 * self.batch_size
+        jobs = iter(jobs)
+        exhausted = False
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='llm') as pool:
+
+            def flush():
+                nonlocal batch, batch_tokens
+                if batch:
+                    # Run in a copy of the caller's context so calls are accounted to its run
+                    future = pool.submit(contextvars.copy_context().run, self._call_batch,
+                                         [entry[0] for entry in batch])
+                    for index, entry in enumerate(batch):
+                        entry[1], entry[2] = future, index
+                    batch, batch_tokens = [], 0
+
+            while True:
+                while not exhausted and len(pending) < window:
+                    job = next(jobs, None)
+                    if job is None:
+                        exhausted = True
+                        break
+                    entry = [job, None, 0]
+                    pending.append(entry)
+                    if job.body is None:
+                        continue
+                    tokens = len(job.body) // 4
+                    # A batched prompt asks every email for the same fields
+                    if batch and (len(batch) >= self.batch_size or job.fields != batch[0][0].fields or
+                                  batch_tokens + tokens > self.batch_token_budget - PROMPT_OVERHEAD_TOKENS):
+                        flush()
+                    batch.append(entry)
+                    batch_tokens += tokens
+                if not pending:
+                    return
+                if exhausted or len(batch) >= self.batch_size or any(entry is pending[0] for entry in batch):
+                    flush()
+                job, future, index = pending.popleft()
+                yield job, future.result()[index] if future is not None else job.result
@@ -0,0 +1,208 @@
+"""
+Minimal local stand-in for the Gmail REST API, for exercising GmailApiTransport offline.
+
+Serves users.getProfile, users.messages.list (q= with is:unread / after: / words) and
+users.messages.get (format=raw, metadata or full), plus the multipart batch endpoint.
+It shares FakeMailbox with fake_imap_server so both transports can be run over the same mail.
+
+    server = FakeGmailApiServer(mailbox).start()
+    transport = GmailApiTransport(api_endpoint=server.url, http=httplib2.Http())
+"""
+import re
+import json
+import time
+import base64
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from fake_imap_server import FakeMailbox
+
+_MESSAGE_PATH = re.compile(r'^/gmail/v1/users/me/messages/([0-9a-f]+)$')
+
+def message_id(uid):
+    return f"{uid:016x}"
+
+def _matches_query(message, query):
+    """Evaluate the subset of Gmail search syntax the app uses."""
+    # {a b c} is an OR group of words, matched whole like Gmail does; everything else is ANDed together
+    text_words = set(re.findall(r'[a-z0-9]+', message.text()))
+    for group in re.findall(r'\{([^}]*)\}', query):
+        words = [_unquote(w) for w in re.findall(r'"[^"]*"|\S+', group)]
+        if not any(word.lower() in text_words for word in words):
+            return False
+    query = re.sub(r'\{[^}]*\}', ' ', query)
+    for term in re.findall(r'"[^"]*"|\S+', query):
+        lower = term.lower()
+        if lower == 'is:unread':
+            if '\\Seen' in message.flags:
+                return False
+        elif lower.startswith('after:'):
+            if message.internaldate.timestamp() <= int(lower[6:]):
+                return False
+        elif lower.startswith('in:') or lower.startswith('label:'):
+            continue
+        elif _unquote(term).lower() not in message.text():
+            return False
+    return True
+
+def _unquote(term):
+    return term[1:-1] if term.startswith('"') and term.endswith('"') else term
+
+def _headers(message):
+    return [{'name': name, 'value': str(value)} for name, value in message.message.items()]
+
+def _part_to_json(part, part_id):
+    body = {'size': 0}
+    payload = part.get_payload(decode=True) if not part.is_multipart() else None
+    if payload is not None:
+        body = {'size': len(payload), 'data': base64.urlsafe_b64encode(payload).decode()}
+        if part.get_filename():
+            # Attachments are only referenced, like the real API does
+            body = {'size': len(payload), 'attachmentId': f"att-{part_id}"}
+    resource = {
+        'partId': part_id,
+        'mimeType': part.get_content_type(),
+        'filename': part.get_filename() or '',
+        'headers': [{'name': k, 'value': str(v)} for k, v in part.items()],
+        'body': body,
+    }
+    if part.is_multipart():
+        resource['parts'] = [_part_to_json(sub, f"{part_id}.{i}" if part_id else str(i))
+                             for i, sub in enumerate(part.get_payload())]
+    return resource
+
+def message_resource(message, message_format='full'):
+    labels = ['INBOX'] + ([] if '\\Seen' in message.flags else ['UNREAD'])
+    resource = {
+        'id': message_id(message.uid),
+        'threadId': message_id(message.uid),
+        'labelIds': labels,
+        'internalDate': str(int(message.internaldate.timestamp() * 1000)),
+        'sizeEstimate': len(message.raw),
+    }
+    if message_format == 'raw':
+        resource['raw'] = base64.urlsafe_b64encode(message.raw).decode()
+    elif message_format == 'metadata':
+        resource['payload'] = {'mimeType': message.message.get_content_type(), 'headers': _headers(message)}
+    else:
+        resource['payload'] = _part_to_json(message.message, '')
+    return resource
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, method, url):
+        """Return (status, json) for a single API call."""
+        parts = urlsplit(url)
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        mailbox = self.server.mailbox
+        if method == 'GET' and parts.path == '/gmail/v1/users/me/profile':
+            return 200, {'emailAddress': 'me@example.com', 'messagesTotal': len(mailbox.messages),
+                         'historyId': str(mailbox.highestmodseq)}
+        if method == 'GET' and parts.path == '/gmail/v1/users/me/messages':
+            query = params.get('q', '')
+            with mailbox.lock:
+                matches = [m for m in reversed(mailbox.messages) if _matches_query(m, query)]
+            start = int(params.get('pageToken') or 0)
+            size = int(params.get('maxResults') or 100)
+            page = matches[start:start + size]
+            self.server.list_count += 1
+            response = {'messages': [{'id': message_id(m.uid), 'threadId': message_id(m.uid)} for m in page],
+                        'resultSizeEstimate': len(matches)}
+            if start + size < len(matches):
+                response['nextPageToken'] = str(start + size)
+            if not page:
+                del response['messages']
+            return 200, response
+        match = _MESSAGE_PATH.match(parts.path)
+        if method == 'GET' and match:
+            uid = int(match.group(1), 16)
+            message = next((m for m in mailbox.messages if m.uid == uid), None)
+            if message is None:
+                return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+            self.server.get_count += 1
+            resource = message_resource(message, params.get('format', 'full'))
+            self.server.fetched_bytes += len(json.dumps(resource))
+            return 200, resource
+        return 404, {'error': {'code': 404, 'message': f'No route for {method} {parts.path}'}}
+
+    def do_GET(self):
+        self.server.request_count += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        status, data = self._route('GET', self.path)
+        self._send_json(status, data)
+
+    def do_POST(self):
+        self.server.request_count += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if not self.path.startswith('/batch/'):
+            self._send_json(404, {'error': {'code': 404, 'message': 'Not Found'}})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        envelope = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        self.server.batch_count += 1
+
+        boundary = 'batch_fake_boundary'
+        chunks = []
+        for part in envelope.iter_parts():
+            request_line = part.get_payload(decode=True).decode().split('\r\n', 1)[0]
+            method, url, _ = request_line.split(' ', 2)
+            status, data = self._route(method, url)
+            content_id = part.get('Content-ID', '').strip('<>')
+            payload = json.dumps(data)
+            chunks.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n{payload}\r\n"
+            )
+        response = (''.join(chunks) + f"--{boundary}--\r\n").encode()
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/mixed; boundary={boundary}')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+class FakeGmailApiServer(ThreadingHTTPServer):
+    """Threaded fake Gmail API server on localhost, optionally adding latency to every HTTP request."""
+
+    daemon_threads = True
+
+    def __init__(self, mailbox=None, host='127.0.0.1', port=0, latency=0.0):
+        super().__init__((host, port), _Handler)
+        self.mailbox = mailbox or FakeMailbox()
+        self.latency = latency
+        self.request_count = 0
+        self.list_count = 0
+        self.get_count = 0
+        self.batch_count = 0
+        self.fetched_bytes = 0
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fake-gmail-api', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
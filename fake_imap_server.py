@@ -0,0 +1,405 @@
+"""
+Minimal in-process IMAP server for exercising the ingestion pipeline locally.
+
+It implements just enough of IMAP4rev1 for this app: CAPABILITY, AUTHENTICATE XOAUTH2, LOGIN,
+ENABLE, SELECT, NOOP, IDLE, UID SEARCH, UID FETCH, CLOSE and LOGOUT, over plain TCP. UID FETCH
+understands UID, FLAGS, INTERNALDATE, RFC822.SIZE, BODYSTRUCTURE, BODY[] and BODY[section]
+(part numbers, HEADER and HEADER.FIELDS).
+
+    server = FakeIMAPServer()
+    server.start()
+    server.add_message(b"Subject: Load update\\r\\n\\r\\nShipment SH1 picked up")
+    pool = IMAPConnectionPool(host=server.host, port=server.port, use_ssl=False)
+    ...
+    server.stop()
+"""
+import re
+import time
+import select
+import threading
+import socketserver
+from datetime import datetime, timezone
+
+# Import email module with an alias to avoid name conflicts
+import email as email_pkg
+
+CAPABILITIES = 'IMAP4rev1 AUTH=XOAUTH2 IDLE ENABLE CONDSTORE UIDPLUS'
+
+_TOKEN_RE = re.compile(r'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()]+')
+_FETCH_ITEM_RE = re.compile(r'BODY(?:\.PEEK)?\[[^\]]*\]|[^\s()]+', re.IGNORECASE)
+
+class FakeMessage:
+    def __init__(self, uid, raw, flags=None, internaldate=None, modseq=1):
+        self.uid = uid
+        self.raw = raw
+        self.flags = set(flags or [])
+        self.internaldate = internaldate or datetime.now(timezone.utc)
+        self.modseq = modseq
+        self.message = email_pkg.message_from_bytes(raw)
+
+    def text(self):
+        return self.raw.decode('utf-8', errors='ignore').lower()
+
+    def body_text(self):
+        """The message without its header block, as IMAP SEARCH BODY sees it."""
+        head, _, body = self.raw.partition(b'\r\n\r\n')
+        return (body if body else head).decode('utf-8', errors='ignore').lower()
+
+class FakeMailbox:
+    """Thread-safe message store shared by all connections to the fake server."""
+
+    def __init__(self, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.messages = []
+        self.next_uid = 1
+        self.highestmodseq = 1
+        self.lock = threading.Lock()
+
+    def add(self, raw, flags=None, internaldate=None):
+        with self.lock:
+            self.highestmodseq += 1
+            message = FakeMessage(self.next_uid, raw, flags, internaldate, self.highestmodseq)
+            self.messages.append(message)
+            self.next_uid += 1
+            return message.uid
+
+def _tokenize(text):
+    return _TOKEN_RE.findall(text)
+
+def _parse_set(spec, max_value):
+    values = set()
+    for part in spec.split(','):
+        start, _, end = part.partition(':')
+        start = max_value if start == '*' else int(start)
+        end = start if not end else (max_value if end == '*' else int(end))
+        if start > end:
+            start, end = end, start
+        values.update(range(start, end + 1))
+    return values
+
+def _quote(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _part_bytes(part):
+    """The body of a leaf MIME part as it appears on the wire (still transfer-encoded)."""
+    payload = part.get_payload()
+    if isinstance(payload, str):
+        return payload.encode('utf-8', errors='surrogateescape')
+    return b''
+
+def _bodystructure(part):
+    """Render the BODYSTRUCTURE of a parsed message (RFC 3501 section 7.4.2, without envelopes)."""
+    if part.is_multipart():
+        subparts = ''.join(_bodystructure(sub) for sub in part.get_payload())
+        return f'({subparts} {_quote(part.get_content_subtype())})'
+    params = ' '.join(f'{_quote(k)} {_quote(v)}' for k, v in (part.get_params() or [])[1:])
+    body = _part_bytes(part)
+    fields = [_quote(part.get_content_maintype()), _quote(part.get_content_subtype()),
+              f'({params})' if params else 'NIL', 'NIL', 'NIL',
+              _quote(part.get('Content-Transfer-Encoding', '7bit')), str(len(body))]
+    if part.get_content_maintype() == 'text':
+        fields.append(str(body.count(b'\n')))
+    # Extension data: MD5, then the disposition
+    fields.append('NIL')
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        filename = f'("filename" {_quote(filename)})' if filename else 'NIL'
+        fields.append(f'({_quote(disposition)} {filename})')
+    else:
+        fields.append('NIL')
+    return '(' + ' '.join(fields) + ')'
+
+def _section(message, section):
+    """Return the bytes of BODY[section] for a message."""
+    raw = message.raw
+    if not section:
+        return raw
+    head, _, _ = raw.partition(b'\r\n\r\n')
+    if section.startswith('HEADER.FIELDS'):
+        wanted = {name.lower() for name in re.findall(r'[\w-]+', section[len('HEADER.FIELDS'):])}
+        lines = []
+        for name, value in message.message.items():
+            if name.lower() in wanted:
+                lines.append(f'{name}: {value}')
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode()
+    if section == 'HEADER':
+        return head + b'\r\n\r\n'
+    part = message.message
+    for number in section.split('.'):
+        if part.is_multipart():
+            part = part.get_payload()[int(number) - 1]
+        elif number != '1':
+            return b''
+    return _part_bytes(part)
+
+def _unquote(token):
+    if token.startswith('"') and token.endswith('"'):
+        return token[1:-1].replace('\\"', '"')
+    return token
+
+class _SearchParser:
+    """Evaluate the subset of SEARCH keys the app uses against one message."""
+
+    def __init__(self, tokens, mailbox):
+        self.tokens = tokens
+        self.mailbox = mailbox
+
+    def matches(self, message):
+        self.pos = 0
+        result = True
+        while self.pos < len(self.tokens):
+            result = self._key(message) and result
+        return result
+
+    def _next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def _key(self, message):
+        token = self._next()
+        upper = token.upper()
+        if token == '(':
+            result = True
+            while self.tokens[self.pos] != ')':
+                result = self._key(message) and result
+            self.pos += 1
+            return result
+        if upper == 'ALL':
+            return True
+        if upper == 'UNSEEN':
+            return '\\Seen' not in message.flags
+        if upper == 'SEEN':
+            return '\\Seen' in message.flags
+        if upper == 'NOT':
+            return not self._key(message)
+        if upper == 'OR':
+            left = self._key(message)
+            right = self._key(message)
+            return left or right
+        if upper == 'SINCE':
+            since = datetime.strptime(_unquote(self._next()), '%d-%b-%Y').date()
+            return message.internaldate.date() >= since
+        if upper == 'UID':
+            max_uid = self.mailbox.messages[-1].uid if self.mailbox.messages else 0
+            return message.uid in _parse_set(self._next(), max_uid)
+        if upper == 'TEXT':
+            return _unquote(self._next()).lower() in message.text()
+        if upper == 'BODY':
+            return _unquote(self._next()).lower() in message.body_text()
+        if upper == 'X-GM-RAW':
+            # {a b c} groups are ORed and match whole words, everything else is ANDed
+            query = _unquote(self._next()).lower()
+            text = message.text()
+            text_words = set(re.findall(r'[a-z0-9]+', text))
+            for group in re.findall(r'\{([^}]*)\}', query):
+                if not any(word in text_words for word in group.split()):
+                    return False
+            return all(word in text for word in re.sub(r'\{[^}]*\}', ' ', query).split())
+        if upper in ('SUBJECT', 'FROM'):
+            header = message.message.get(upper.lower(), '') or ''
+            return _unquote(self._next()).lower() in header.lower()
+        raise ValueError(f"Unsupported search key {token}")
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.selected = False
+
+    @property
+    def capabilities(self):
+        if self.server.gmail_extensions:
+            return CAPABILITIES + ' X-GM-EXT-1'
+        return CAPABILITIES
+
+    def send(self, line):
+        if isinstance(line, str):
+            line = line.encode()
+        self.wfile.write(line + b'\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        self.send('* OK [CAPABILITY ' + self.capabilities + '] Fake IMAP server ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.decode().rstrip('\r\n').split(' ', 2)
+            if len(parts) < 2:
+                self.send('* BAD Missing command')
+                continue
+            tag, command = parts[0], parts[1].upper()
+            args = parts[2] if len(parts) > 2 else ''
+            if command == 'UID':
+                sub, _, args = args.partition(' ')
+                command = 'UID ' + sub.upper()
+            if self.server.latency:
+                # Simulate the network round trip to a real server
+                time.sleep(self.server.latency)
+            handler = getattr(self, 'cmd_' + command.replace(' ', '_'), None)
+            if handler is None:
+                self.send(f'{tag} BAD Unsupported command {command}')
+                continue
+            try:
+                if handler(tag, args) == 'LOGOUT':
+                    return
+            except Exception as e:
+                self.send(f'{tag} BAD {e}')
+
+    @property
+    def mailbox(self):
+        return self.server.mailbox
+
+    def cmd_CAPABILITY(self, tag, args):
+        self.send('* CAPABILITY ' + self.capabilities)
+        self.send(f'{tag} OK CAPABILITY completed')
+
+    def cmd_AUTHENTICATE(self, tag, args):
+        self.send('+ ')
+        self.rfile.readline()
+        if self.server.reject_auth:
+            self.send(f'{tag} NO [AUTHENTICATIONFAILED] Invalid credentials')
+        else:
+            self.send(f'{tag} OK Success')
+
+    def cmd_LOGIN(self, tag, args):
+        self.send(f'{tag} OK LOGIN completed')
+
+    def cmd_ENABLE(self, tag, args):
+        self.send('* ENABLED ' + args)
+        self.send(f'{tag} OK ENABLE completed')
+
+    def cmd_SELECT(self, tag, args):
+        mailbox = self.mailbox
+        with mailbox.lock:
+            self.send(f'* {len(mailbox.messages)} EXISTS')
+            self.send('* 0 RECENT')
+            self.send(f'* OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid')
+            self.send(f'* OK [UIDNEXT {mailbox.next_uid}] Predicted next UID')
+            self.send(f'* OK [HIGHESTMODSEQ {mailbox.highestmodseq}] Highest')
+        self.selected = True
+        self.send(f'{tag} OK [READ-WRITE] SELECT completed')
+
+    def cmd_NOOP(self, tag, args):
+        if self.selected:
+            self.send(f'* {len(self.mailbox.messages)} EXISTS')
+        self.send(f'{tag} OK NOOP completed')
+
+    def cmd_CLOSE(self, tag, args):
+        self.selected = False
+        self.send(f'{tag} OK CLOSE completed')
+
+    def cmd_LOGOUT(self, tag, args):
+        self.send('* BYE Logging out')
+        self.send(f'{tag} OK LOGOUT completed')
+        return 'LOGOUT'
+
+    def cmd_IDLE(self, tag, args):
+        self.send('+ idling')
+        known = len(self.mailbox.messages)
+        while True:
+            readable, _, _ = select.select([self.connection], [], [], 0.05)
+            if readable:
+                line = self.rfile.readline()
+                if not line or line.strip().upper() == b'DONE':
+                    break
+            count = len(self.mailbox.messages)
+            if count != known:
+                known = count
+                self.send(f'* {count} EXISTS')
+        self.send(f'{tag} OK IDLE terminated')
+
+    def cmd_UID_SEARCH(self, tag, args):
+        tokens = _tokenize(args)
+        if tokens and tokens[0].upper() == 'CHARSET':
+            tokens = tokens[2:]
+        parser = _SearchParser(tokens, self.mailbox)
+        with self.mailbox.lock:
+            uids = [str(m.uid) for m in self.mailbox.messages if parser.matches(m)]
+        self.server.search_count += 1
+        self.send('* SEARCH' + ''.join(' ' + uid for uid in uids))
+        self.send(f'{tag} OK SEARCH completed')
+
+    def cmd_UID_FETCH(self, tag, args):
+        message_set, _, items = args.partition(' ')
+        items = [item.upper() for item in _FETCH_ITEM_RE.findall(items)]
+        with self.mailbox.lock:
+            messages = list(enumerate(self.mailbox.messages, 1))
+            max_uid = messages[-1][1].uid if messages else 0
+        wanted = _parse_set(message_set, max_uid)
+        self.server.fetch_count += 1
+        for seq, message in messages:
+            if message.uid not in wanted:
+                continue
+            response = f'* {seq} FETCH (UID {message.uid}'.encode()
+            for item in items:
+                if item == 'UID':
+                    continue
+                if item == 'FLAGS':
+                    response += f' FLAGS ({" ".join(sorted(message.flags))})'.encode()
+                elif item == 'INTERNALDATE':
+                    response += f' INTERNALDATE "{message.internaldate.strftime("%d-%b-%Y %H:%M:%S +0000")}"'.encode()
+                elif item == 'RFC822.SIZE':
+                    response += f' RFC822.SIZE {len(message.raw)}'.encode()
+                elif item == 'BODYSTRUCTURE':
+                    response += f' BODYSTRUCTURE {_bodystructure(message.message)}'.encode()
+                elif item.startswith('BODY') or item == 'RFC822':
+                    section = item[item.index('[') + 1:-1] if '[' in item else ''
+                    data = _section(message, section)
+                    self.server.fetched_bytes += len(data)
+                    response += f' BODY[{section}] {{{len(data)}}}\r\n'.encode() + data
+            self.wfile.write(response + b')\r\n')
+            self.wfile.flush()
+        self.send(f'{tag} OK FETCH completed')
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    """Threaded fake IMAP server listening on localhost (an ephemeral port by default)."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, mailbox=None, latency=0.0, gmail_extensions=False):
+        super().__init__((host, port), _Handler)
+        self.mailbox = mailbox or FakeMailbox()
+        self.latency = latency
+        # Advertise X-GM-EXT-1 and accept X-GM-RAW searches like Gmail does
+        self.gmail_extensions = gmail_extensions
+        self.reject_auth = False
+        self.search_count = 0
+        self.fetch_count = 0
+        self.fetched_bytes = 0
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def add_message(self, raw, flags=None, internaldate=None):
+        """Deliver a message; idling clients are told about it within ~50ms."""
+        return self.mailbox.add(raw, flags, internaldate)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-imap', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+if __name__ == "__main__":
+    server = FakeIMAPServer(port=1143).start()
+    server.add_message(b"Subject: Shipment update\r\nFrom: dispatch@example.com\r\n\r\n"
+                       b"Shipment SH98765 will depart from Dallas, TX.")
+    print(f"Fake IMAP server listening on {server.host}:{server.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
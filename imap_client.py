@@ -0,0 +1,488 @@
+"""
+IMAP helpers for searching and fetching messages in as few round trips as possible.
+"""
+import re
+import time
+import select
+import imaplib
+from collections import Counter, namedtuple
+from datetime import datetime
+
+# Import email module with an alias to avoid name conflicts
+import email as email_pkg
+from email.message import Message
+
+import config
+from relevance import word_forms
+
+# Number of UIDs requested per FETCH command
+IMAP_FETCH_CHUNK_SIZE = getattr(config, 'IMAP_FETCH_CHUNK_SIZE', 200)
+
+# Everything we need for a message in a single FETCH. BODY.PEEK[] leaves the \Seen flag alone.
+FETCH_ITEMS = '(UID FLAGS INTERNALDATE BODY.PEEK[])'
+
+# Cheap first pass: flags, dates, size, a few headers and the MIME structure, but no bodies
+TRIAGE_HEADERS = ('SUBJECT', 'FROM', 'DATE', 'MESSAGE-ID')
+TRIAGE_ITEMS = f"(UID FLAGS INTERNALDATE RFC822.SIZE BODY.PEEK[HEADER.FIELDS ({' '.join(TRIAGE_HEADERS)})] BODYSTRUCTURE)"
+
+FetchedMessage = namedtuple('FetchedMessage', ['uid', 'flags', 'internaldate', 'message'])
+MailboxStatus = namedtuple('MailboxStatus', ['name', 'uidvalidity', 'uidnext', 'highestmodseq'])
+# Result of the triage pass; headers is an email Message holding only TRIAGE_HEADERS
+MessageSummary = namedtuple('MessageSummary', ['uid', 'flags', 'internaldate', 'size', 'headers', 'text_part'])
+# The MIME part worth downloading: its section number ("1", "1.2", ...), type and encoding
+TextPart = namedtuple('TextPart', ['section', 'content_type', 'charset', 'encoding', 'size'])
+
+_UID_RE = re.compile(rb'UID (\d+)')
+_FLAGS_RE = re.compile(rb'FLAGS \(([^)]*)\)')
+_INTERNALDATE_RE = re.compile(rb'INTERNALDATE "[^"]+"')
+_EXISTS_RE = re.compile(rb'\* (\d+) EXISTS')
+_SIZE_RE = re.compile(rb'RFC822\.SIZE (\d+)')
+_FETCH_START_RE = re.compile(rb'^\d+ \(')
+_LITERAL_RE = re.compile(rb'\{\d+\}$')
+_STRUCTURE_TOKEN_RE = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()]+')
+
+class RoundTripCounter:
+    """Count the server round trips (IMAP commands or HTTP calls) issued by each stage of a run."""
+
+    def __init__(self, label='imap'):
+        self.label = label
+        self.counts = Counter()
+
+    def record(self, stage, count=1):
+        self.counts[stage] += count
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def summary(self):
+        stages = ', '.join(f"{stage}: {count}" for stage, count in self.counts.items())
+        return f"{self.label} round trips - {stages or 'none'} (total {self.total()})"
+
+def _response_int(mail, code):
+    """Pop an untagged response code such as UIDVALIDITY and return it as an int, or None."""
+    _, data = mail.response(code)
+    if not data or data[0] is None:
+        return None
+    try:
+        return int(data[-1])
+    except (TypeError, ValueError):
+        return None
+
+def select_mailbox(mail, mailbox='INBOX', stats=None, enable_condstore=True):
+    """
+    SELECT a mailbox and return its UIDVALIDITY, UIDNEXT and (on CONDSTORE servers) HIGHESTMODSEQ.
+
+    ENABLE is only allowed before the first SELECT, so pass enable_condstore=False
+    when re-selecting on a connection that already has a mailbox selected.
+
+    Raises imaplib.IMAP4.error if the mailbox cannot be selected.
+    """
+    if enable_condstore and 'CONDSTORE' in mail.capabilities:
+        # Ask the server to report HIGHESTMODSEQ in the SELECT response
+        try:
+            if stats is not None:
+                stats.record('enable')
+            mail.enable('CONDSTORE')
+        except Exception as e:
+            print(f"Could not enable CONDSTORE: {e}")
+
+    if stats is not None:
+        stats.record('select')
+    status, data = mail.select(mailbox)
+    if status != 'OK':
+        raise imaplib.IMAP4.error(f"SELECT {mailbox} failed: {data}")
+
+    return MailboxStatus(
+        name=mailbox,
+        uidvalidity=_response_int(mail, 'UIDVALIDITY'),
+        uidnext=_response_int(mail, 'UIDNEXT'),
+        highestmodseq=_response_int(mail, 'HIGHESTMODSEQ')
+    )
+
+def uid_search(mail, criteria, stats=None):
+    """
+    Run a UID SEARCH and return the matching UIDs as a list of bytes.
+
+    Raises imaplib.IMAP4.error if the server rejects the search.
+    """
+    if stats is not None:
+        stats.record('search')
+    status, data = mail.uid('SEARCH', None, criteria)
+    if status != 'OK':
+        raise imaplib.IMAP4.error(f"UID SEARCH {criteria} failed: {data}")
+    if not data or not data[0]:
+        return []
+    return data[0].split()
+
+def supports_gmail_extensions(mail):
+    return 'X-GM-EXT-1' in mail.capabilities
+
+def _quote(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+# Keywords that match nearly every message body as a substring ("id" in "did", "provided");
+# the server-side search leaves them out and is_trucking_related still scores them after
+# download. A caller must not filter on the search when these alone can make mail relevant.
+AMBIGUOUS_SEARCH_KEYWORDS = frozenset({'id'})
+
+def server_search_keywords(keywords, word_search=False):
+    """
+    The keywords worth sending to a server-side search, sorted. IMAP SUBJECT and BODY match
+    substrings, so "load" also finds "loads"; a word search (Gmail) gets every plural form
+    the local keyword matcher counts as well.
+    """
+    keywords = {keyword for keyword in keywords if keyword not in AMBIGUOUS_SEARCH_KEYWORDS}
+    if word_search:
+        keywords = {form for keyword in keywords for form in word_forms(keyword)}
+    return sorted(keywords)
+
+def keyword_search_criteria(keywords, gmail=False):
+    """
+    Build search criteria matching messages whose subject or body contains any of the
+    keywords (see server_search_keywords), or None when no keyword is left to search for.
+
+    Gmail gets a single X-GM-RAW search with an OR group ({a b c}) of the keywords and
+    their plural forms, other servers a nested OR chain of SUBJECT and BODY keys. TEXT is
+    not used because it also searches every header, Message-ID and Received included.
+    """
+    keywords = server_search_keywords(keywords, word_search=gmail)
+    if not keywords:
+        return None
+    if gmail:
+        return 'X-GM-RAW ' + _quote('{' + ' '.join(keywords) + '}')
+    terms = [f'OR SUBJECT {_quote(keyword)} BODY {_quote(keyword)}' for keyword in keywords]
+    criteria = terms[-1]
+    for term in reversed(terms[:-1]):
+        criteria = f'OR {term} {criteria}'
+    return criteria
+
+def build_message_set(uids):
+    """
+    Collapse a list of UIDs into a compact IMAP message set, e.g. 1:200,205,210:212.
+    """
+    numbers = sorted({int(uid) for uid in uids})
+    ranges = []
+    start = prev = None
+    for number in numbers:
+        if start is None:
+            start = prev = number
+        elif number == prev + 1:
+            prev = number
+        else:
+            ranges.append((start, prev))
+            start = prev = number
+    if start is not None:
+        ranges.append((start, prev))
+    return ','.join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+def chunk_uids(uids, chunk_size):
+    """Yield successive chunks of at most chunk_size UIDs."""
+    for i in range(0, len(uids), chunk_size):
+        yield uids[i:i + chunk_size]
+
+def parse_fetch_response(data):
+    """
+    Turn the raw data returned by imaplib for a multi-message FETCH into
+    (metadata, body) pairs, one per message.
+
+    Each message arrives as a (b'N (UID .. BODY[] {size}', literal) tuple, followed by
+    a bytes item with the closing parenthesis and any data items sent after the literal.
+    Any further literal in the same message (e.g. a file name inside BODYSTRUCTURE) is
+    folded back into the metadata as a quoted string.
+    """
+    current = None
+    for item in data:
+        if isinstance(item, tuple):
+            if current is None or _FETCH_START_RE.match(item[0]):
+                if current is not None:
+                    yield current[0], current[1]
+                current = [item[0], item[1]]
+            else:
+                literal = item[1].replace(b'\\', b'\\\\').replace(b'"', b'\\"')
+                current[0] += b' ' + _LITERAL_RE.sub(b'', item[0]) + b'"' + literal + b'"'
+        elif isinstance(item, bytes) and current is not None:
+            # Items such as FLAGS can be sent after the body literal
+            current[0] += b' ' + item
+    if current is not None:
+        yield current[0], current[1]
+
+def parse_bodystructure(metadata):
+    """
+    Parse the BODYSTRUCTURE item of a FETCH response into nested lists.
+
+    Strings become str, NIL becomes None. Returns None if there is no BODYSTRUCTURE.
+    """
+    start = metadata.find(b'BODYSTRUCTURE (')
+    if start < 0:
+        return None
+    stack = []
+    for token in _STRUCTURE_TOKEN_RE.findall(metadata, start + len(b'BODYSTRUCTURE ')):
+        if token == b'(':
+            stack.append([])
+            continue
+        if token == b')':
+            node = stack.pop()
+            if not stack:
+                return node
+            stack[-1].append(node)
+            continue
+        if token.startswith(b'"'):
+            value = re.sub(rb'\\(.)', rb'\1', token[1:-1]).decode('utf-8', errors='replace')
+        elif token.upper() == b'NIL':
+            value = None
+        else:
+            value = token.decode('utf-8', errors='replace')
+        stack[-1].append(value)
+    return None
+
+def _leaf_parts(structure, section=''):
+    """Yield (section, structure) for every non-multipart part, numbered as in BODY[section]."""
+    if structure and isinstance(structure[0], list):
+        number = 0
+        for sub in structure:
+            if not isinstance(sub, list):
+                break
+            number += 1
+            yield from _leaf_parts(sub, f"{section}.{number}" if section else str(number))
+    else:
+        yield section or '1', structure
+
+def _params(value):
+    if not isinstance(value, list):
+        return {}
+    return {str(k).lower(): v for k, v in zip(value[::2], value[1::2])}
+
+def find_text_part(structure):
+    """
+    Pick the part to read from a parsed BODYSTRUCTURE: the first inline text/plain part,
+    falling back to text/html. Returns a TextPart, or None if the message has no text.
+    """
+    candidates = {}
+    for section, part in _leaf_parts(structure or []):
+        if len(part) < 7 or not isinstance(part[0], str) or part[0].lower() != 'text':
+            continue
+        subtype = (part[1] or '').lower()
+        # Text parts have the line count at index 7, so the disposition is at index 9
+        disposition = part[9] if len(part) > 9 else None
+        if isinstance(disposition, list) and disposition and str(disposition[0]).lower() == 'attachment':
+            continue
+        if subtype in ('plain', 'html') and subtype not in candidates:
+            candidates[subtype] = TextPart(
+                section=section,
+                content_type=f"text/{subtype}",
+                charset=_params(part[2]).get('charset'),
+                encoding=(part[5] or '7bit').lower(),
+                size=int(part[6]) if str(part[6]).isdigit() else 0
+            )
+    return candidates.get('plain') or candidates.get('html')
+
+def text_message(headers, payload, content_type='text/plain', charset=None, encoding=None):
+    """
+    Build a single-part email Message from triage headers and one downloaded text part,
+    so callers can read it exactly like a fully downloaded message.
+
+    payload is the part as it came off the wire; get_payload(decode=True) undoes the
+    transfer encoding.
+    """
+    msg = Message()
+    for name, value in headers.items():
+        msg[name] = value
+    msg['Content-Type'] = f'{content_type}; charset="{charset}"' if charset else content_type
+    if encoding and encoding not in ('7bit', '8bit', 'binary'):
+        msg['Content-Transfer-Encoding'] = encoding
+    msg.set_payload(payload.decode('ascii', errors='surrogateescape'))
+    return msg
+
+def _parse_internaldate(metadata):
+    match = _INTERNALDATE_RE.search(metadata)
+    if not match:
+        return None
+    time_tuple = imaplib.Internaldate2tuple(match.group(0))
+    if not time_tuple:
+        return None
+    return datetime.fromtimestamp(time.mktime(time_tuple))
+
+def fetch_messages(mail, uids, chunk_size=None, stats=None):
+    """
+    Fetch FLAGS, INTERNALDATE and the full body for the given UIDs, one FETCH per chunk.
+
+    Args:
+        mail: An authenticated IMAP connection with a mailbox selected.
+        uids (list): UIDs to fetch.
+        chunk_size (int, optional): UIDs per FETCH. Defaults to IMAP_FETCH_CHUNK_SIZE.
+        stats (RoundTripCounter, optional): Counter to record FETCH commands in.
+
+    Yields:
+        FetchedMessage: One parsed message at a time, in the order the server returns them.
+    """
+    chunk_size = chunk_size or IMAP_FETCH_CHUNK_SIZE
+    for chunk in chunk_uids(list(uids), chunk_size):
+        message_set = build_message_set(chunk)
+        if stats is not None:
+            stats.record('fetch')
+        status, data = mail.uid('FETCH', message_set, FETCH_ITEMS)
+        if status != 'OK':
+            print(f"UID FETCH {message_set} failed: {data}")
+            continue
+
+        for metadata, raw_email in parse_fetch_response(data):
+            uid_match = _UID_RE.search(metadata)
+            flags_match = _FLAGS_RE.search(metadata)
+            yield FetchedMessage(
+                uid=uid_match.group(1) if uid_match else None,
+                flags=flags_match.group(1).decode().split() if flags_match else [],
+                internaldate=_parse_internaldate(metadata),
+                message=email_pkg.message_from_bytes(raw_email)
+            )
+
+def fetch_summaries(mail, uids, chunk_size=None, stats=None):
+    """
+    Fetch flags, dates, size, the triage headers and the BODYSTRUCTURE for the given UIDs,
+    one FETCH per chunk, without downloading any body.
+
+    Yields:
+        MessageSummary: One per message, in the order the server returns them.
+    """
+    chunk_size = chunk_size or IMAP_FETCH_CHUNK_SIZE
+    for chunk in chunk_uids(list(uids), chunk_size):
+        message_set = build_message_set(chunk)
+        if stats is not None:
+            stats.record('triage')
+        status, data = mail.uid('FETCH', message_set, TRIAGE_ITEMS)
+        if status != 'OK':
+            print(f"UID FETCH {message_set} failed: {data}")
+            continue
+
+        for metadata, header_bytes in parse_fetch_response(data):
+            uid_match = _UID_RE.search(metadata)
+            flags_match = _FLAGS_RE.search(metadata)
+            size_match = _SIZE_RE.search(metadata)
+            yield MessageSummary(
+                uid=uid_match.group(1) if uid_match else None,
+                flags=flags_match.group(1).decode().split() if flags_match else [],
+                internaldate=_parse_internaldate(metadata),
+                size=int(size_match.group(1)) if size_match else 0,
+                headers=email_pkg.message_from_bytes(header_bytes or b''),
+                text_part=find_text_part(parse_bodystructure(metadata))
+            )
+
+def fetch_text_parts(mail, summaries, chunk_size=None, stats=None):
+    """
+    Download only the text part picked by the triage pass (BODY.PEEK[n]) for each summary.
+
+    A FETCH asks for the same section from every message, so messages are grouped by
+    section number; most mail has its text at 1 or 1.1, so this stays a command or two per chunk.
+
+    Yields:
+        FetchedMessage: The triage headers plus the text part as a single-part message.
+    """
+    chunk_size = chunk_size or IMAP_FETCH_CHUNK_SIZE
+    by_section = {}
+    for summary in summaries:
+        if summary.text_part is not None:
+            by_section.setdefault(summary.text_part.section, []).append(summary)
+
+    for section, group in by_section.items():
+        lookup = {summary.uid: summary for summary in group}
+        for chunk in chunk_uids(group, chunk_size):
+            message_set = build_message_set([summary.uid for summary in chunk])
+            if stats is not None:
+                stats.record('fetch')
+            status, data = mail.uid('FETCH', message_set, f'(UID BODY.PEEK[{section}])')
+            if status != 'OK':
+                print(f"UID FETCH {message_set} failed: {data}")
+                continue
+
+            for metadata, payload in parse_fetch_response(data):
+                uid_match = _UID_RE.search(metadata)
+                summary = lookup.get(uid_match.group(1) if uid_match else None)
+                if summary is None:
+                    continue
+                part = summary.text_part
+                yield FetchedMessage(
+                    uid=summary.uid,
+                    flags=summary.flags,
+                    internaldate=summary.internaldate,
+                    message=text_message(summary.headers, payload or b'', part.content_type,
+                                         part.charset, part.encoding)
+                )
+
+def supports_idle(mail):
+    return 'IDLE' in mail.capabilities
+
+def idle_wait(mail, timeout, stats=None):
+    """
+    Issue IDLE and block until the server reports a mailbox change or the timeout expires.
+
+    Any untagged response while idling (new mail, expunge, flag change) counts as a change;
+    the incremental sync makes a spurious wake-up cheap.
+
+    Returns:
+        bool: True if the server reported a change, False on timeout.
+
+    Raises imaplib.IMAP4.abort if the connection drops while idling.
+    """
+    if stats is not None:
+        stats.record('idle')
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    line = mail.readline()
+    if not line.startswith(b'+'):
+        raise imaplib.IMAP4.error(f"IDLE rejected: {line.strip()}")
+
+    changed = False
+    sock = mail.socket()
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # TLS can hold decrypted bytes that select() does not see
+        pending = getattr(sock, 'pending', lambda: 0)()
+        if not pending:
+            readable, _, _ = select.select([sock], [], [], remaining)
+            if not readable:
+                break
+        line = mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("Connection closed while idling")
+        if line.startswith(b'*'):
+            changed = True
+            break
+
+    # Leave IDLE and read up to the tagged completion
+    mail.send(b'DONE\r\n')
+    while True:
+        line = mail.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("Connection closed while leaving IDLE")
+        if line.startswith(tag):
+            if not line[len(tag):].strip().upper().startswith(b'OK'):
+                raise imaplib.IMAP4.error(f"IDLE failed: {line.strip()}")
+            break
+        if _EXISTS_RE.match(line):
+            changed = True
+    return changed
+
+def noop_wait(mail, timeout, poll_interval, stats=None):
+    """
+    Poll with NOOP until the server reports new messages or the timeout expires.
+    Used for servers that do not support IDLE.
+
+    Returns:
+        bool: True if the message count went up, False on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    _, data = mail.response('EXISTS')
+    baseline = int(data[-1]) if data and data[-1] else None
+    while time.monotonic() < deadline:
+        time.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+        if stats is not None:
+            stats.record('noop')
+        mail.noop()
+        _, data = mail.response('EXISTS')
+        if data and data[-1] is not None:
+            count = int(data[-1])
+            if baseline is None or count > baseline:
+                return True
+    return False
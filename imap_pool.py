@@ -0,0 +1,189 @@
+"""
+Pool of authenticated IMAP connections, kept open with the mailbox selected and reused across requests.
+
+The TLS handshake and XOAUTH2 authentication are paid once per connection instead of once per run.
+A pooled connection is health-checked with NOOP before reuse, replaced when the account's access
+token rotates, and closed after sitting idle for IMAP_POOL_IDLE_TIMEOUT seconds.
+"""
+import time
+import imaplib
+import threading
+
+import config
+from imap_client import select_mailbox
+
+IMAP_SERVER = getattr(config, 'IMAP_SERVER', 'imap.gmail.com')
+IMAP_POOL_IDLE_TIMEOUT = getattr(config, 'IMAP_POOL_IDLE_TIMEOUT', 300)
+IMAP_POOL_MAX_IDLE = getattr(config, 'IMAP_POOL_MAX_IDLE', 4)
+
+def connect_imap(account, token, host=None, port=None, use_ssl=True):
+    """
+    Open an IMAP connection and authenticate it with XOAUTH2.
+
+    Plain (non-TLS) connections are only meant for a local stand-in server such as fake_imap_server.
+
+    Raises imaplib.IMAP4.error if authentication fails.
+    """
+    host = host or IMAP_SERVER
+    if use_ssl:
+        mail = imaplib.IMAP4_SSL(host, port or imaplib.IMAP4_SSL_PORT)
+    else:
+        mail = imaplib.IMAP4(host, port or imaplib.IMAP4_PORT)
+    auth_string = f'user={account}\1auth=Bearer {token}\1\1'
+    try:
+        mail.authenticate('XOAUTH2', lambda x: auth_string.encode())
+    except Exception:
+        _safe_logout(mail)
+        raise
+    return mail
+
+def _safe_logout(mail):
+    try:
+        mail.logout()
+    except Exception:
+        pass
+
+class PooledConnection:
+    """An authenticated connection plus the token it was opened with and the selected mailbox."""
+
+    def __init__(self, account, token, mail):
+        self.account = account
+        self.token = token
+        self.mail = mail
+        self.mailbox = None
+        self.last_used = time.monotonic()
+
+class IMAPConnectionPool:
+    """Thread-safe pool of idle IMAP connections keyed by account."""
+
+    def __init__(self, host=None, port=None, use_ssl=True, idle_timeout=None, max_idle=None):
+        self.host = host or IMAP_SERVER
+        self.port = port
+        self.use_ssl = use_ssl
+        self.idle_timeout = idle_timeout if idle_timeout is not None else IMAP_POOL_IDLE_TIMEOUT
+        self.max_idle = max_idle if max_idle is not None else IMAP_POOL_MAX_IDLE
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self.connects = 0
+        self.reuses = 0
+
+    def acquire(self, account, token, mailbox='INBOX', stats=None):
+        """
+        Get a healthy connection for the account with the mailbox selected.
+
+        Args:
+            account (str): Email address the connection authenticates as.
+            token (str): Current OAuth2 access token for the account.
+            mailbox (str): Mailbox to have selected.
+            stats (RoundTripCounter, optional): Counter to record IMAP commands in.
+
+        Returns:
+            PooledConnection: Call release() when done, or discard() if it broke.
+
+        Raises imaplib.IMAP4.error if a new connection cannot be authenticated.
+        """
+        while True:
+            conn = self._pop_idle(account)
+            if conn is None:
+                break
+
+            if conn.token != token:
+                # The token rotated since this connection authenticated, open a fresh one
+                print(f"Access token for {account} changed, replacing pooled IMAP connection")
+                self._close(conn)
+                continue
+
+            try:
+                if stats is not None:
+                    stats.record('noop')
+                conn.mail.noop()
+                conn.mailbox = select_mailbox(conn.mail, mailbox, stats, enable_condstore=False)
+                self.reuses += 1
+                print(f"Reusing pooled IMAP connection for {account}")
+                return conn
+            except Exception as e:
+                print(f"Pooled IMAP connection failed health check, dropping it: {e}")
+                self._close(conn)
+
+        if stats is not None:
+            stats.record('connect')
+        print(f"Opening new IMAP connection to {self.host} for {account}")
+        conn = PooledConnection(account, token, connect_imap(account, token, self.host, self.port, self.use_ssl))
+        self.connects += 1
+        try:
+            conn.mailbox = select_mailbox(conn.mail, mailbox, stats)
+        except Exception:
+            self._close(conn)
+            raise
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, leaving its mailbox selected."""
+        if conn is None:
+            return
+        conn.last_used = time.monotonic()
+        with self._lock:
+            idle = self._idle.setdefault(conn.account, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                conn = None
+        if conn is not None:
+            self._close(conn)
+        self._start_reaper()
+
+    def discard(self, conn):
+        """Close a connection that is in an unknown state instead of returning it to the pool."""
+        if conn is not None:
+            self._close(conn)
+
+    def close_idle(self):
+        """Close connections that have been idle longer than the idle timeout."""
+        cutoff = time.monotonic() - self.idle_timeout
+        expired = []
+        with self._lock:
+            for account, idle in self._idle.items():
+                expired.extend(conn for conn in idle if conn.last_used < cutoff)
+                idle[:] = [conn for conn in idle if conn.last_used >= cutoff]
+        for conn in expired:
+            self._close(conn)
+        return len(expired)
+
+    def close_all(self):
+        """Close every idle connection in the pool."""
+        with self._lock:
+            conns = [conn for idle in self._idle.values() for conn in idle]
+            self._idle.clear()
+        for conn in conns:
+            self._close(conn)
+
+    def _pop_idle(self, account):
+        # Expire stale connections first so we never hand out one the server already dropped
+        self.close_idle()
+        with self._lock:
+            idle = self._idle.get(account)
+            if idle:
+                return idle.pop()
+        return None
+
+    def _close(self, conn):
+        _safe_logout(conn.mail)
+
+    def _start_reaper(self):
+        with self._lock:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name='imap-pool-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(self.idle_timeout / 2, 1))
+            self.close_idle()
+            with self._lock:
+                if not any(self._idle.values()):
+                    self._reaper = None
+                    return
+
+# Shared pool used by every request in this process
+imap_pool = IMAPConnectionPool()
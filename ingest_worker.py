@@ -0,0 +1,186 @@
+"""
+Long-running ingestion worker that extracts trucking data as new mail arrives.
+
+The worker keeps a pooled IMAP connection open and waits on it with IDLE (or NOOP polling when
+the server has no IDLE). Whenever the mailbox changes it runs process_emails, which only fetches
+mail newer than the saved sync state, and saves every extracted record as soon as it is ready.
+
+Usage:
+    python ingest_worker.py --credentials worker_credentials.json
+
+The credentials file holds the same keys the web app keeps in the session after login
+(token, refresh_token, token_uri, client_id, client_secret, scopes).
+"""
+import json
+import random
+import imaplib
+import argparse
+import threading
+import traceback
+
+import config
+from email_processor import process_emails, save_records
+from imap_client import RoundTripCounter, supports_idle, idle_wait, noop_wait
+from imap_pool import imap_pool
+from mail_transport import EMAIL_USERNAME, ImapTransport
+from sync_state import load_sync_state
+
+# Gmail drops IDLE after ~30 minutes, so re-issue it a little before that
+INGEST_IDLE_TIMEOUT = getattr(config, 'INGEST_IDLE_TIMEOUT', 25 * 60)
+INGEST_POLL_INTERVAL = getattr(config, 'INGEST_POLL_INTERVAL', 30)
+INGEST_BACKOFF_MAX = getattr(config, 'INGEST_BACKOFF_MAX', 300)
+
+class FileCredentialsProvider:
+    """Load OAuth2 credentials from a JSON file and refresh them when they expire."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __call__(self):
+        from google.oauth2.credentials import Credentials
+        from google.auth.transport.requests import Request
+
+        try:
+            with open(self.filename, 'r') as f:
+                info = json.load(f)
+            credentials = Credentials(
+                token=info['token'],
+                refresh_token=info['refresh_token'],
+                token_uri=info['token_uri'],
+                client_id=info['client_id'],
+                client_secret=info['client_secret'],
+                scopes=info['scopes']
+            )
+            if credentials.expired or not credentials.token:
+                print("Worker token expired, refreshing...")
+                credentials.refresh(Request())
+                info['token'] = credentials.token
+                with open(self.filename, 'w') as f:
+                    json.dump(info, f, indent=2)
+            return credentials
+        except Exception as e:
+            print(f"Error loading worker credentials: {str(e)}")
+            return None
+
+class IngestWorker:
+    """
+    Wait for mailbox changes and run them through process_emails as they happen.
+
+    Args:
+        credentials_provider (callable): Returns OAuth2 credentials with a .token attribute.
+        fields_to_extract (list, optional): Fields to extract. Defaults to process_emails' defaults.
+        pool (IMAPConnectionPool, optional): Pool to use. Defaults to the shared pool.
+        on_record (callable, optional): Persists one record. Defaults to appending it to the record
+            store. It runs before the sync state is saved; if it raises, the run fails and the
+            same mail is fetched again on the next one.
+        account (str, optional): Mailbox account. Defaults to EMAIL_USERNAME.
+    """
+
+    def __init__(self, credentials_provider, fields_to_extract=None, pool=None, on_record=None,
+                 account=None, idle_timeout=None, poll_interval=None, backoff_max=None):
+        self.credentials_provider = credentials_provider
+        self.fields_to_extract = fields_to_extract
+        self.pool = pool or imap_pool
+        self.on_record = on_record or (lambda record: save_records([record]))
+        self.account = account or EMAIL_USERNAME
+        self.idle_timeout = idle_timeout or INGEST_IDLE_TIMEOUT
+        self.poll_interval = poll_interval or INGEST_POLL_INTERVAL
+        self.backoff_max = backoff_max or INGEST_BACKOFF_MAX
+        self.stop_event = threading.Event()
+        self.runs = 0
+        self.records = 0
+        self.failures = 0
+        self._pending_position = None
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run_once(self):
+        """Process whatever is new in the mailbox and return the extracted records."""
+        self.runs += 1
+        records = process_emails(
+            fields_to_extract=self.fields_to_extract,
+            credentials_provider=self.credentials_provider,
+            transport=ImapTransport(pool=self.pool, account=self.account),
+            on_record=self.on_record,
+            raise_errors=True,
+        )
+        self.records += len(records)
+        return records
+
+    def wait_for_changes(self):
+        """
+        Block on a pooled connection until the mailbox changes or the idle timeout expires.
+
+        Raises imaplib errors or OSError if the connection fails, so the caller can back off.
+        """
+        credentials = self.credentials_provider()
+        if not credentials:
+            raise imaplib.IMAP4.error("No valid credentials for the ingestion worker")
+
+        stats = RoundTripCounter()
+        conn = self.pool.acquire(self.account, credentials.token, 'INBOX', stats)
+        try:
+            # Mail that arrived between the last run and this SELECT would not trigger IDLE.
+            # Only trust this once per (UIDNEXT, last UID) so a failing run cannot spin.
+            state = load_sync_state(f"{self.account}/{conn.mailbox.name}") or {}
+            position = (conn.mailbox.uidnext, state.get('last_uid', 0))
+            if conn.mailbox.uidnext and conn.mailbox.uidnext - 1 > position[1] and position != self._pending_position:
+                self._pending_position = position
+                changed = True
+            elif supports_idle(conn.mail):
+                changed = idle_wait(conn.mail, self.idle_timeout, stats)
+            else:
+                changed = noop_wait(conn.mail, self.idle_timeout, self.poll_interval, stats)
+        except Exception:
+            self.pool.discard(conn)
+            raise
+        self.pool.release(conn)
+        return changed
+
+    def _backoff_delay(self):
+        # Exponential backoff with full jitter, capped at backoff_max
+        return random.uniform(0, min(self.backoff_max, 2 ** min(self.failures, 16)))
+
+    def run(self):
+        """Run until stop() is called, reconnecting with backoff after failures."""
+        print(f"Ingestion worker started for {self.account}")
+        changed = True  # Catch up on anything that arrived while we were not running
+        while not self.stop_event.is_set():
+            try:
+                if changed:
+                    records = self.run_once()
+                    print(f"Ingestion run {self.runs}: {len(records)} new records")
+                changed = self.wait_for_changes()
+                self.failures = 0
+            except (imaplib.IMAP4.error, OSError) as e:
+                self.failures += 1
+                delay = self._backoff_delay()
+                print(f"Ingestion worker connection error ({self.failures} in a row): {e}. Retrying in {delay:.1f}s")
+                changed = True
+                self.stop_event.wait(delay)
+            except Exception as e:
+                self.failures += 1
+                print(f"Ingestion worker error: {str(e)}")
+                print(traceback.format_exc())
+                changed = True
+                self.stop_event.wait(self._backoff_delay())
+        print("Ingestion worker stopped")
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract trucking data from new emails as they arrive.")
+    parser.add_argument('--credentials', default='worker_credentials.json',
+                        help="JSON file with OAuth2 credentials (same keys as the web session)")
+    parser.add_argument('--fields', help="Comma-separated fields to extract")
+    args = parser.parse_args()
+
+    fields = [f.strip() for f in args.fields.split(',')] if args.fields else None
+    worker = IngestWorker(FileCredentialsProvider(args.credentials), fields_to_extract=fields)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+        imap_pool.close_all()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+In-process background job queue for long-running work such as a process_emails run.
+
+Jobs run on a local thread pool of JOB_WORKERS threads; nothing outside the process is
+needed. Each job has a key (the mailbox, for extraction runs), and submitting a job while
+another one with the same key is queued or running returns that job instead of starting a
+second run over the same mail.
+
+A job records its progress counts, timings and the records it produced, and any number of
+listeners can follow it: subscribe() returns a queue that first replays what happened so
+far and then receives the job's events as they occur.
+
+    jobs = get_job_queue()
+    job, coalesced = jobs.submit(mailbox, run_extraction)
+    jobs.get(job.id).to_dict()
+"""
+import time
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+JOB_WORKERS = getattr(config, 'JOB_WORKERS', 2)
+# Finished jobs stay queryable this many seconds, and at most JOB_HISTORY of them are kept
+JOB_RETENTION = getattr(config, 'JOB_RETENTION', 3600)
+JOB_HISTORY = getattr(config, 'JOB_HISTORY', 100)
+
+class Job:
+    """
+    One unit of background work and everything reported about it.
+
+    The function a job runs is called as func(job) and may call job.add_record() and
+    job.set_progress() while it works; its return value becomes job.message.
+    """
+
+    def __init__(self, key, func):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.func = func
+        self.status = 'queued'
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.progress = {}
+        self.records = []
+        self.message = None
+        self.error = None
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.status in ('queued', 'running')
+
+    def _emit(self, event, data):
+        for listener in self.listeners:
+            listener.put((event, data))
+
+    def add_record(self, record):
+        with self.lock:
+            self.records.append(record)
+            self._emit('record', record)
+
+    def set_progress(self, stage, counts):
+        with self.lock:
+            self.progress = dict(counts)
+            self._emit('progress', dict(counts, stage=stage))
+
+    def _final_event(self):
+        if self.status == 'done':
+            return 'done', {'job_id': self.id, 'message': self.message}
+        return 'error', {'job_id': self.id, 'error': self.error}
+
+    def subscribe(self):
+        """
+        Return a queue.Queue of (event, data) pairs: a 'record' event for every record so
+        far, the latest 'progress', then live events until a final 'done' or 'error'.
+        """
+        events = queue.Queue()
+        with self.lock:
+            for record in self.records:
+                events.put(('record', record))
+            if self.progress:
+                events.put(('progress', dict(self.progress)))
+            if self.active:
+                self.listeners.append(events)
+            else:
+                events.put(self._final_event())
+        return events
+
+    def run(self):
+        with self.lock:
+            self.status = 'running'
+            self.started = time.time()
+        status, message, error = 'done', None, None
+        try:
+            message = self.func(self)
+        except Exception as e:
+            print(f"Job {self.id} failed: {str(e)}")
+            status, error = 'failed', str(e)
+        with self.lock:
+            self.status, self.message, self.error = status, message, error
+            self.finished = time.time()
+            self._emit(*self._final_event())
+            self.listeners = []
+
+    def to_dict(self, include_records=True):
+        with self.lock:
+            now = time.time()
+            data = {
+                'id': self.id,
+                'key': self.key,
+                'status': self.status,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished,
+                'queued_seconds': round((self.started or now) - self.created, 3),
+                'run_seconds': round((self.finished or now) - self.started, 3) if self.started else None,
+                'progress': dict(self.progress),
+                'record_count': len(self.records),
+                'message': self.message,
+                'error': self.error,
+            }
+            if include_records:
+                data['records'] = list(self.records)
+        return data
+
+class JobQueue:
+    """
+    Run jobs on a local thread pool, at most one active job per key.
+
+    Args:
+        workers (int, optional): Jobs running at once. Defaults to JOB_WORKERS.
+    """
+
+    def __init__(self, workers=None):
+        self.pool = ThreadPoolExecutor(max_workers=workers or JOB_WORKERS, thread_name_prefix='job')
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, key, func):
+        """
+        Queue func to run as a job, unless a job with the same key is still queued or running.
+
+        Returns:
+            tuple: (job, coalesced); coalesced is True when an existing job was returned.
+        """
+        with self.lock:
+            self._prune()
+            for job in self.jobs.values():
+                if job.key == key and job.active:
+                    return job, True
+            job = Job(key, func)
+            self.jobs[job.id] = job
+        self.pool.submit(job.run)
+        return job, False
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def _prune(self):
+        """Forget finished jobs older than JOB_RETENTION, and the oldest beyond JOB_HISTORY."""
+        now = time.time()
+        finished = [job for job in self.jobs.values() if not job.active]
+        for index, job in enumerate(finished):
+            if now - job.finished > JOB_RETENTION or len(finished) - index > JOB_HISTORY:
+                del self.jobs[job.id]
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+    """Return the shared job queue, starting it on first use."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
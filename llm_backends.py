@@ -0,0 +1,169 @@
+"""
+LLM backends that turn a prompt into a Completion: the response text and, when the backend
+reports them, the prompt and response token counts.
+
+    gemini  Google Generative AI (the default)
+    stub    In-process fake with configurable latency, error rate and canned responses
+    http    Client for stub_llm_server.py (or anything speaking its protocol)
+
+The stub backends make it possible to benchmark and regression-test the whole pipeline
+offline at realistic concurrency, without quota or network access. Unless given canned
+responses, the stub answers every prompt with well-formed JSON for the requested fields.
+
+    backend = create_backend()   # the one configured with LLM_BACKEND
+    completion = backend.generate(prompt)
+"""
+import re
+import json
+import time
+import random
+import threading
+from collections import namedtuple
+
+import requests
+
+import config
+
+LLM_BACKEND = getattr(config, 'LLM_BACKEND', 'gemini')
+LLM_MODEL = getattr(config, 'LLM_MODEL', 'gemini-2.0-flash')
+LLM_STUB_URL = getattr(config, 'LLM_STUB_URL', 'http://127.0.0.1:8765')
+# Median latency and spread (sigma of a log-normal) of the stub, and its share of failed calls
+LLM_STUB_LATENCY = getattr(config, 'LLM_STUB_LATENCY', 0.8)
+LLM_STUB_LATENCY_SIGMA = getattr(config, 'LLM_STUB_LATENCY_SIGMA', 0.5)
+LLM_STUB_ERROR_RATE = getattr(config, 'LLM_STUB_ERROR_RATE', 0.0)
+
+_FIELDS_RE = re.compile(r'extract the following fields: (.*?)\. For each')
+_EMAIL_ID_RE = re.compile(r'^=== Email ID: (.+) ===$', re.MULTILINE)
+
+# Token counts are None when the backend does not report them
+Completion = namedtuple('Completion', ['text', 'prompt_tokens', 'response_tokens'], defaults=(None, None))
+
+class BackendError(Exception):
+    """An error response from a backend; code is the HTTP status, as with google.api_core errors."""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+class GeminiBackend:
+    """Google Generative AI."""
+
+    name = 'gemini'
+
+    def __init__(self, model=None, api_key=None):
+        # Imported here so the stub backends work without the Google client installed
+        import google.generativeai as genai
+        self.genai = genai
+        self.model_name = model or LLM_MODEL
+        self.genai.configure(api_key=api_key or config.LLM_API_KEY)
+        self.model = self.genai.GenerativeModel(self.model_name)
+
+    def generate(self, prompt):
+        response = self.model.generate_content(
+            prompt,
+            generation_config={
+                "temperature": 0.2,  # Lower temperature for more factual responses
+                "top_p": 0.8,
+                "response_mime_type": "application/json",  # Hint that we want JSON
+            }
+        )
+        # Older google-generativeai releases don't report usage
+        usage = getattr(response, 'usage_metadata', None)
+        return Completion(response.text, getattr(usage, 'prompt_token_count', None),
+                          getattr(usage, 'candidates_token_count', None))
+
+def stub_answer(prompt):
+    """Well-formed JSON for the fields and (for batched prompts) the email IDs in a prompt."""
+    match = _FIELDS_RE.search(prompt)
+    fields = match.group(1).split(', ') if match else []
+    email_ids = _EMAIL_ID_RE.findall(prompt)
+
+    def answer(index):
+        return {field: {"value": f"{field}-{index}", "context": f"stub {field}"} for field in fields}
+
+    if email_ids:
+        return json.dumps([{"email_id": email_id, "fields": answer(i)} for i, email_id in enumerate(email_ids)])
+    return json.dumps(answer(0))
+
+class StubBackend:
+    """
+    In-process stand-in for an LLM.
+
+    Args:
+        latency (float, optional): Median seconds per call. Defaults to LLM_STUB_LATENCY.
+        latency_sigma (float, optional): Log-normal spread, 0 for a fixed latency.
+            Defaults to LLM_STUB_LATENCY_SIGMA.
+        error_rate (float, optional): Share of calls that fail with a 503 or 429.
+            Defaults to LLM_STUB_ERROR_RATE.
+        responses (list, optional): Canned response texts, returned in turn. Defaults to
+            JSON generated from each prompt.
+        seed (int, optional): Seed for repeatable latencies and errors.
+    """
+
+    name = 'stub'
+    model_name = 'stub'
+
+    def __init__(self, latency=None, latency_sigma=None, error_rate=None, responses=None, seed=None):
+        self.latency = LLM_STUB_LATENCY if latency is None else latency
+        self.latency_sigma = LLM_STUB_LATENCY_SIGMA if latency_sigma is None else latency_sigma
+        self.error_rate = LLM_STUB_ERROR_RATE if error_rate is None else error_rate
+        self.responses = list(responses or [])
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def generate(self, prompt):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+            delay = self.random.lognormvariate(0, self.latency_sigma) * self.latency if self.latency else 0
+            failed = self.random.random() < self.error_rate
+            code = self.random.choice([429, 503])
+        time.sleep(delay)
+        if failed:
+            raise BackendError("Stub LLM error", code=code)
+        text = self.responses[(call - 1) % len(self.responses)] if self.responses else stub_answer(prompt)
+        # Reported like a real backend would, at about four characters per token
+        return Completion(text, len(prompt) // 4, len(text) // 4)
+
+class HttpBackend:
+    """
+    Client for an LLM served over HTTP: POST {"prompt": ...} to <url>/generate and get
+    back {"text": ..., "usage": {"prompt_tokens": ..., "response_tokens": ...}}, usage being
+    optional. Error statuses are raised as BackendError with their code.
+    """
+
+    name = 'http'
+
+    def __init__(self, url=None, timeout=None):
+        self.url = (url or LLM_STUB_URL).rstrip('/')
+        self.timeout = timeout or 120
+        self.model_name = f'http:{self.url}'
+        self.session = requests.Session()
+
+    def generate(self, prompt):
+        # Raised as the builtin exceptions so llm_resilience treats them as transient
+        try:
+            response = self.session.post(f"{self.url}/generate", json={"prompt": prompt}, timeout=self.timeout)
+        except requests.exceptions.Timeout as e:
+            raise TimeoutError(str(e)) from e
+        except requests.exceptions.ConnectionError as e:
+            raise ConnectionError(str(e)) from e
+        if response.status_code != 200:
+            raise BackendError(f"LLM server returned {response.status_code}", code=response.status_code)
+        data = response.json()
+        usage = data.get('usage') or {}
+        return Completion(data['text'], usage.get('prompt_tokens'), usage.get('response_tokens'))
+
+BACKENDS = {
+    GeminiBackend.name: GeminiBackend,
+    StubBackend.name: StubBackend,
+    HttpBackend.name: HttpBackend,
+}
+
+def create_backend(name=None, **kwargs):
+    """Create the backend named in config (LLM_BACKEND) or by the name argument."""
+    name = name or LLM_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{name}', expected one of: {', '.join(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
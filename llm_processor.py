@@ -1,75 +1,230 @@
 import requests
 import json
-from config import LLM_API_KEY
-import google.generativeai as genai
+import threading
+from extraction_cache import get_cache, cache_key
+from llm_resilience import ResilientCaller, LLMUnavailableError
+from llm_backends import create_backend
+from llm_usage import track_call
 
+# Part of every extraction cache key, together with the backend's model name: bump
+# PROMPT_VERSION whenever the prompt wording changes so results extracted with the old
+# prompt are not reused
+PROMPT_VERSION = 1
 
+_backend = None
+_backend_lock = threading.Lock()
 
+def get_backend():
+    """The LLM backend configured with LLM_BACKEND, created on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
 
-def extract_data_with_llm(email_body, fields_to_extract):
-    """Use Google's Generative AI to extract logistics data with context."""
-    # Configure the generative AI
-    genai.configure(api_key=LLM_API_KEY)
-    
-    # Create the prompt with dynamic fields
+def set_backend(backend):
+    """Use another backend (e.g. a StubBackend for offline runs) from now on."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+def cached_extraction(email_body, fields_to_extract):
+    """
+    Look an email up in the extraction cache.
+
+    Returns:
+        tuple: (known, missing). known maps the fields already extracted from this body
+               to their {value, context}; missing lists the fields that still need the LLM.
+    """
+    cache = get_cache()
+    if cache is None:
+        return {}, list(fields_to_extract)
+    return cache.get(cache_key(email_body, get_backend().model_name, PROMPT_VERSION), fields_to_extract)
+
+def _cache_result(email_body, fields_to_extract, result):
+    """Remember an answer the LLM actually gave (failed calls are never cached)."""
+    cache = get_cache()
+    if cache is None:
+        return
+    # None means every requested field came back N/A, which is worth remembering too
+    result = result or {}
+    cache.put(cache_key(email_body, get_backend().model_name, PROMPT_VERSION), {
+        field: result.get(field) or {"value": "N/A", "context": ""} for field in fields_to_extract
+    })
+
+def merge_results(known, extracted, fields_to_extract):
+    """
+    Combine cached fields with a fresh LLM result into one record with exactly the
+    requested fields. Returns None if every field is N/A.
+    """
+    known = known or {}
+    extracted = extracted or {}
+    data = {}
+    for field in fields_to_extract:
+        data[field] = extracted.get(field) or known.get(field) or {"value": "N/A", "context": ""}
+    if all(isinstance(value, dict) and value.get('value') == 'N/A' for value in data.values()):
+        return None
+    return data
+
+def _instructions(fields_to_extract):
+    """The extraction instructions shared by the single and batched prompts."""
     fields_str = ", ".join(fields_to_extract)
-    prompt = (
-        "From the following email, extract the following fields: " + fields_str + ". "
+    return (
+        "extract the following fields: " + fields_str + ". "
         "For each piece of information, also provide the exact phrase or sentence from the email that contains this information. "
         "Format the output as a JSON object where each key (e.g., 'shipment_id', 'origin') has a sub-object with 'value' (the extracted information) "
         "and 'context' (the relevant phrase or sentence from the email).\n\n"
         "If you cannot find the information for a specific field, respond with 'N/A' for the value and the context should be empty. "
+    )
+
+# Deadlines, retries, hedging and the circuit breaker shared by every extraction call
+_caller = ResilientCaller()
+
+def llm_call_stats():
+    """Retry, hedge, timeout and circuit breaker counters since startup."""
+    return _caller.stats()
+
+def _generate(prompt, call):
+    """
+    Send a prompt to the LLM backend and return the response text with any code fences removed, or None.
+    Raises LLMUnavailableError when transient errors outlast the retries or the circuit is open.
+    Retries and token counts are noted on call (a llm_usage.CallRecord).
+    """
+    try:
+        completion = _caller.call(_send, prompt)
+    finally:
+        call.retries = _caller.last_retries()
+    call.set_tokens(completion.prompt_tokens, completion.response_tokens, completion.text)
+    if not completion.text:
+        return None
+    return completion.text.replace("```json", "").replace("```", "").strip()
+
+def _send(prompt):
+    """One backend request, without retries."""
+    return get_backend().generate(prompt)
+
+def _clean_result(json_data, fields_to_extract):
+    """Return None if every field is N/A, otherwise the data with any missing fields added as N/A."""
+    # Check if all fields are N/A
+    all_na = True
+    for field_data in json_data.values():
+        if isinstance(field_data, dict) and field_data.get('value') != 'N/A':
+            all_na = False
+            break
+    
+    # Skip this entry entirely if all fields are N/A
+    if all_na:
+        print("Skipping email - no valid data found")
+        return None
+    
+    # Ensure all requested fields exist in the response
+    for field in fields_to_extract:
+        if field not in json_data:
+            json_data[field] = {"value": "N/A", "context": ""}
+    
+    return json_data
+
+def extract_data_with_llm(email_body, fields_to_extract):
+    """Use the configured LLM backend (Google's Generative AI by default) to extract logistics data with context."""
+    # Create the prompt with dynamic fields
+    prompt = (
+        "From the following email, " + _instructions(fields_to_extract) +
         "You must respond with ONLY valid JSON, no other text. Do not include any other text or comments in your response. ONLY respond with valid JSON."
         f"\n\nEmail:\n{email_body}"
     )
 
-    try:
-        # Generate content using Gemini model
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        response = model.generate_content(
-            prompt,
-            generation_config={
-                "temperature": 0.2,  # Lower temperature for more factual responses
-                "top_p": 0.8,
-                "response_mime_type": "application/json",  # Hint that we want JSON
-            }
-        )
-        
-        # Parse the response
-        if response.text:
-            try:
-                textResponse = response.text.replace("```json", "").replace("```", "").strip()
-                json_data = json.loads(textResponse)
-                
-                # Check if all fields are N/A
-                all_na = True
-                for field_data in json_data.values():
-                    if isinstance(field_data, dict) and field_data.get('value') != 'N/A':
-                        all_na = False
-                        break
-                
-                # Skip this entry entirely if all fields are N/A
-                if all_na:
-                    print("Skipping email - no valid data found")
+    with track_call(prompt, model=get_backend().model_name) as call:
+        try:
+            textResponse = _generate(prompt, call)
+            
+            # Parse the response
+            if textResponse:
+                try:
+                    result = _clean_result(json.loads(textResponse), fields_to_extract)
+                except json.JSONDecodeError:
+                    call.outcome = 'invalid_json'
+                    print("LLM response is not valid JSON:", textResponse)
                     return None
-                
-                # Ensure all requested fields exist in the response
-                for field in fields_to_extract:
-                    if field not in json_data:
-                        json_data[field] = {"value": "N/A", "context": ""}
-                
-                return json_data
-                
-            except json.JSONDecodeError:
-                print("LLM response is not valid JSON:", response.text)
+                call.outcome = 'parsed' if result else 'all_na'
+                _cache_result(email_body, fields_to_extract, result)
+                return result
+            else:
+                call.outcome = 'no_response'
+                print("No response from LLM")
                 return None
-        else:
-            print("No response from LLM")
+                
+        except LLMUnavailableError:
+            # Let the caller stop and retry this email on a later run instead of losing it
+            call.outcome = 'unavailable'
+            raise
+        except Exception as e:
+            call.outcome = 'error'
+            print(f"Error calling LLM API: {str(e)}")
             return None
-            
-    except Exception as e:
-        print(f"Error calling LLM API: {str(e)}")
-        return None
+
+def _valid_fields(fields):
+    return isinstance(fields, dict) and all(
+        isinstance(value, dict) and 'value' in value for value in fields.values())
+
+def extract_batch_with_llm(emails, fields_to_extract):
+    """
+    Extract the same fields from several emails with a single prompt.
+
+    Args:
+        emails (list): (email_id, body) pairs. IDs must be unique within the batch.
+        fields_to_extract (list): Fields to extract from every email.
+
+    Returns:
+        dict: email_id -> extracted data (None when every field was N/A) for each email
+              the reply covered correctly. Emails missing from the dict got a malformed or
+              no answer and should be re-requested on their own.
+    """
+    parts = [f"=== Email ID: {email_id} ===\n{body}" for email_id, body in emails]
+    prompt = (
+        "From each of the following emails, " + _instructions(fields_to_extract) +
+        "Each email starts with a line '=== Email ID: <id> ==='. "
+        "Respond with a JSON array containing one object per email, in the form "
+        '{"email_id": "<id>", "fields": {<the JSON object described above>}}. '
+        "You must respond with ONLY valid JSON, no other text. Do not include any other text or comments in your response. ONLY respond with valid JSON."
+        "\n\n" + "\n\n".join(parts)
+    )
+
+    with track_call(prompt, emails=len(emails), model=get_backend().model_name) as call:
+        try:
+            textResponse = _generate(prompt, call)
+            items = json.loads(textResponse) if textResponse else []
+        except json.JSONDecodeError:
+            call.outcome = 'invalid_json'
+            print("Batched LLM response is not valid JSON, falling back to one prompt per email")
+            return {}
+        except LLMUnavailableError:
+            call.outcome = 'unavailable'
+            raise
+        except Exception as e:
+            call.outcome = 'error'
+            print(f"Error calling LLM API: {str(e)}")
+            return {}
+
+        bodies = dict(emails)
+        expected = set(bodies)
+        results = {}
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            email_id = str(item.get('email_id', ''))
+            if email_id in expected and email_id not in results and _valid_fields(item.get('fields')):
+                results[email_id] = _clean_result(item['fields'], fields_to_extract)
+                _cache_result(bodies[email_id], fields_to_extract, results[email_id])
+        if not textResponse:
+            call.outcome = 'no_response'
+        elif not results:
+            # Nothing usable: every email is re-requested on its own
+            call.outcome = 'invalid_json'
+        else:
+            call.outcome = 'parsed' if any(results.values()) else 'all_na'
+    if len(results) < len(expected):
+        print(f"Batched LLM reply covered {len(results)} of {len(expected)} emails")
+    return results
 
 if __name__ == "__main__":
     email_body = "test"
@@ -0,0 +1,219 @@
+"""
+Deadlines, retries, hedged requests and a circuit breaker around LLM calls.
+
+    caller = ResilientCaller()
+    text = caller.call(send_prompt, prompt)
+
+- Every attempt has a deadline of LLM_TIMEOUT seconds. The installed Gemini client has no
+  request timeout, so attempts run on a worker thread that is abandoned when it runs late.
+- Transient failures (timeouts, connection errors, HTTP 408/429/5xx) are retried up to
+  LLM_MAX_RETRIES times with exponential backoff and full jitter. Other errors are raised
+  at once.
+- With LLM_HEDGE_REQUESTS, an attempt still running after the 95th percentile of recent
+  latencies gets a duplicate; whichever answers first is used.
+- After LLM_BREAKER_THRESHOLD transient failures in a row the circuit opens and calls
+  fail fast with LLMUnavailableError for LLM_BREAKER_RESET seconds, after which a single
+  trial call decides whether it closes again.
+"""
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import config
+
+LLM_TIMEOUT = getattr(config, 'LLM_TIMEOUT', 60)
+LLM_MAX_RETRIES = getattr(config, 'LLM_MAX_RETRIES', 3)
+LLM_RETRY_BASE_DELAY = getattr(config, 'LLM_RETRY_BASE_DELAY', 1.0)
+LLM_RETRY_MAX_DELAY = getattr(config, 'LLM_RETRY_MAX_DELAY', 30.0)
+# Hedging costs a second request for every slow call, so it is opt-in
+LLM_HEDGE_REQUESTS = getattr(config, 'LLM_HEDGE_REQUESTS', False)
+LLM_BREAKER_THRESHOLD = getattr(config, 'LLM_BREAKER_THRESHOLD', 5)
+LLM_BREAKER_RESET = getattr(config, 'LLM_BREAKER_RESET', 60)
+
+HEDGE_PERCENTILE = 95
+# Latencies needed before hedging starts, and how many recent ones are kept
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+class LLMUnavailableError(Exception):
+    """The LLM could not be reached: retries ran out on transient errors or the circuit is open."""
+
+def is_transient(error):
+    """Whether an error is worth retrying: timeouts, connection problems, throttling and 5xx."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # google.api_core exceptions carry the HTTP status as .code
+    code = getattr(error, 'code', None)
+    return isinstance(code, int) and code in TRANSIENT_STATUS_CODES
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker: closed -> open after threshold failures,
+    open -> half-open after reset_timeout seconds, half-open -> closed on one success.
+    """
+
+    def __init__(self, threshold=None, reset_timeout=None):
+        self.threshold = threshold or LLM_BREAKER_THRESHOLD
+        self.reset_timeout = reset_timeout or LLM_BREAKER_RESET
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may go ahead now."""
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half-open'
+            if self.state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.state == 'half-open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    self.opens += 1
+                    print(f"LLM circuit breaker open after {self.failures} failures; "
+                          f"pausing calls for {self.reset_timeout}s")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+class ResilientCaller:
+    """
+    Call a function with deadlines, classified retries, optional hedging and a circuit breaker.
+
+    Args:
+        timeout (float, optional): Seconds per attempt. Defaults to LLM_TIMEOUT.
+        max_retries (int, optional): Retries after the first attempt. Defaults to LLM_MAX_RETRIES.
+        hedge (bool, optional): Send a duplicate for slow attempts. Defaults to LLM_HEDGE_REQUESTS.
+        breaker (CircuitBreaker, optional): Defaults to a new one with the configured limits.
+    """
+
+    def __init__(self, timeout=None, max_retries=None, hedge=None, breaker=None,
+                 base_delay=None, max_delay=None):
+        self.timeout = timeout or LLM_TIMEOUT
+        self.max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.hedge = LLM_HEDGE_REQUESTS if hedge is None else hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.base_delay = LLM_RETRY_BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = LLM_RETRY_MAX_DELAY if max_delay is None else max_delay
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {'calls': 0, 'attempts': 0, 'retries': 0, 'timeouts': 0, 'hedges': 0,
+                         'hedge_wins': 0, 'failures': 0, 'short_circuited': 0}
+        self.lock = threading.Lock()
+        # Retries of the latest call on each thread, for usage accounting
+        self.local = threading.local()
+        # Attempts run here so a hung call can be abandoned at its deadline
+        self.pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix='llm-attempt')
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def hedge_delay(self):
+        """The p95 of recent latencies, or None while there are too few samples."""
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE / 100))]
+
+    def _timed(self, func, args):
+        start = time.monotonic()
+        result = func(*args)
+        with self.lock:
+            self.latencies.append(time.monotonic() - start)
+        return result
+
+    def _attempt(self, func, args):
+        """One attempt, possibly hedged, within the deadline."""
+        deadline = time.monotonic() + self.timeout
+        self._count('attempts')
+        futures = [self.pool.submit(self._timed, func, args)]
+        delay = self.hedge_delay() if self.hedge else None
+        if delay is not None and delay < self.timeout:
+            done, _ = wait(futures, timeout=delay)
+            if not done:
+                self._count('hedges')
+                futures.append(self.pool.submit(self._timed, func, args))
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        self._count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        self._count('timeouts')
+        raise TimeoutError(f"LLM call did not finish within {self.timeout}s")
+
+    def _backoff(self, retry):
+        """Full jitter: a random wait up to the exponential backoff for this retry."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    def call(self, func, *args):
+        """
+        Call func(*args) with retries. Raises LLMUnavailableError when the circuit is open
+        or transient errors outlast the retries; other errors are raised unchanged.
+        """
+        self._count('calls')
+        for retry in range(self.max_retries + 1):
+            self.local.retries = retry
+            if not self.breaker.allow():
+                self._count('short_circuited')
+                raise LLMUnavailableError("LLM circuit breaker is open")
+            try:
+                result = self._attempt(func, args)
+            except Exception as e:
+                if not is_transient(e):
+                    # The API answered; the request itself is the problem
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if retry == self.max_retries:
+                    self._count('failures')
+                    raise LLMUnavailableError(f"LLM call failed after {retry + 1} attempts: {str(e)}") from e
+                delay = self._backoff(retry)
+                print(f"Transient LLM error ({str(e)}), retrying in {delay:.1f}s")
+                self._count('retries')
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def last_retries(self):
+        """Retries used by the latest call made on this thread."""
+        return getattr(self.local, 'retries', 0)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        delay = self.hedge_delay()
+        stats.update(breaker_state=self.breaker.state, breaker_opens=self.breaker.opens,
+                     hedge_delay=round(delay, 3) if delay is not None else None)
+        return stats
@@ -0,0 +1,234 @@
+"""
+Token, latency and cost accounting for LLM extraction calls.
+
+Every call records its prompt and response tokens (as reported by the backend, or estimated
+at about four characters per token when it reports none), latency, retries and outcome:
+
+    parsed        JSON with at least one field found
+    all_na        JSON in which every field was N/A
+    invalid_json  a reply that was not the JSON asked for
+    no_response   an empty reply
+    error         the call failed with a non-transient error
+    unavailable   retries ran out or the circuit breaker was open
+
+Calls are stored in a small SQLite database together with the run they belong to, and are
+aggregated per run and per day. process_emails opens a run with start_run() and sets it as
+current_run; calls made while it is set (including on executor threads, which copy the
+context) are attributed to it.
+"""
+import time
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import config
+
+LLM_USAGE_FILE = getattr(config, 'LLM_USAGE_FILE', 'llm_usage.db')
+LLM_USAGE_RETENTION_DAYS = getattr(config, 'LLM_USAGE_RETENTION_DAYS', 90)
+# US dollars per million tokens; the defaults are Gemini 2.0 Flash list prices
+LLM_PRICE_INPUT_PER_MILLION = getattr(config, 'LLM_PRICE_INPUT_PER_MILLION', 0.10)
+LLM_PRICE_OUTPUT_PER_MILLION = getattr(config, 'LLM_PRICE_OUTPUT_PER_MILLION', 0.40)
+
+OUTCOMES = ('parsed', 'all_na', 'invalid_json', 'no_response', 'error', 'unavailable')
+
+# The run that calls are attributed to, set by process_emails
+current_run = contextvars.ContextVar('llm_usage_run', default=None)
+
+def estimate_text_tokens(text):
+    return len(text or '') // 4
+
+def call_cost(prompt_tokens, response_tokens):
+    """Cost of one call in US dollars."""
+    return ((prompt_tokens or 0) * LLM_PRICE_INPUT_PER_MILLION +
+            (response_tokens or 0) * LLM_PRICE_OUTPUT_PER_MILLION) / 1e6
+
+class CallRecord:
+    """
+    What one LLM call used. The caller fills in tokens, retries and outcome; the latency
+    is measured by track_call().
+    """
+
+    def __init__(self, prompt, emails=1, model=None):
+        self.prompt = prompt
+        self.emails = emails
+        self.model = model
+        self.prompt_tokens = None
+        self.response_tokens = None
+        self.estimated = False
+        self.retries = 0
+        self.latency = 0.0
+        self.outcome = None
+
+    def set_tokens(self, prompt_tokens, response_tokens, response_text=None):
+        """Use the backend's token counts, estimating the ones it did not report."""
+        if prompt_tokens is None:
+            prompt_tokens = estimate_text_tokens(self.prompt)
+            self.estimated = True
+        if response_tokens is None:
+            response_tokens = estimate_text_tokens(response_text)
+            self.estimated = True
+        self.prompt_tokens, self.response_tokens = prompt_tokens, response_tokens
+
+    def finish(self):
+        # Failed calls still sent their prompt
+        if self.prompt_tokens is None:
+            self.set_tokens(None, 0)
+        self.outcome = self.outcome or 'error'
+
+class UsageLog:
+    """
+    SQLite-backed log of LLM calls and runs, safe to share between threads.
+
+    Args:
+        filename (str, optional): Database file. Defaults to LLM_USAGE_FILE.
+        retention_days (int, optional): Days calls are kept. Defaults to LLM_USAGE_RETENTION_DAYS.
+    """
+
+    def __init__(self, filename=None, retention_days=None):
+        self.filename = filename or LLM_USAGE_FILE
+        self.retention_days = retention_days or LLM_USAGE_RETENTION_DAYS
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.filename, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, started REAL NOT NULL, finished REAL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS calls ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, run_id INTEGER, created REAL NOT NULL, day TEXT NOT NULL,"
+            " model TEXT, emails INTEGER NOT NULL, prompt_tokens INTEGER NOT NULL,"
+            " response_tokens INTEGER NOT NULL, estimated INTEGER NOT NULL, latency REAL NOT NULL,"
+            " retries INTEGER NOT NULL, outcome TEXT NOT NULL, cost REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS calls_day ON calls (day)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS calls_run ON calls (run_id)")
+        self._prune()
+        self.db.commit()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_days * 24 * 3600
+        self.db.execute("DELETE FROM calls WHERE created < ?", (cutoff,))
+        self.db.execute("DELETE FROM runs WHERE started < ?", (cutoff,))
+
+    def start_run(self):
+        """Open a run and return its ID."""
+        with self.lock:
+            run_id = self.db.execute("INSERT INTO runs (started) VALUES (?)", (time.time(),)).lastrowid
+            self.db.commit()
+        return run_id
+
+    def finish_run(self, run_id):
+        with self.lock:
+            self.db.execute("UPDATE runs SET finished = ? WHERE id = ?", (time.time(), run_id))
+            self.db.commit()
+
+    def record(self, call, run_id=None):
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO calls (run_id, created, day, model, emails, prompt_tokens, response_tokens,"
+                " estimated, latency, retries, outcome, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, now, datetime.fromtimestamp(now).strftime('%Y-%m-%d'), call.model, call.emails,
+                 call.prompt_tokens, call.response_tokens, int(call.estimated), call.latency, call.retries,
+                 call.outcome, call_cost(call.prompt_tokens, call.response_tokens))
+            )
+            self.db.commit()
+
+    def _aggregate(self, where, params):
+        """Totals, latency percentiles and outcome counts of the calls matching where."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(emails), 0), COALESCE(SUM(prompt_tokens), 0),"
+                " COALESCE(SUM(response_tokens), 0), COALESCE(SUM(estimated), 0), COALESCE(SUM(retries), 0),"
+                " COALESCE(SUM(latency), 0), COALESCE(SUM(cost), 0) FROM calls WHERE " + where, params
+            ).fetchone()
+            latencies = [r[0] for r in self.db.execute(
+                "SELECT latency FROM calls WHERE " + where + " ORDER BY latency", params)]
+            outcomes = dict(self.db.execute(
+                "SELECT outcome, COUNT(*) FROM calls WHERE " + where + " GROUP BY outcome", params).fetchall())
+        calls, emails, prompt_tokens, response_tokens, estimated, retries, latency, cost = row
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))], 3) if latencies else None
+
+        return {
+            'calls': calls, 'emails': emails, 'prompt_tokens': prompt_tokens,
+            'response_tokens': response_tokens, 'estimated_calls': estimated, 'retries': retries,
+            'latency_total': round(latency, 3), 'latency_p50': percentile(50), 'latency_p95': percentile(95),
+            'cost_usd': round(cost, 6), 'outcomes': {outcome: outcomes.get(outcome, 0) for outcome in OUTCOMES},
+        }
+
+    def run_summary(self, run_id):
+        with self.lock:
+            row = self.db.execute("SELECT started, finished FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        started, finished = row
+        summary = self._aggregate("run_id = ?", (run_id,))
+        summary.update(run_id=run_id, started=datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+                       duration=round((finished or time.time()) - started, 3))
+        return summary
+
+    def recent_runs(self, limit=20):
+        with self.lock:
+            run_ids = [r[0] for r in self.db.execute("SELECT id FROM runs ORDER BY id DESC LIMIT ?", (limit,))]
+        return [self.run_summary(run_id) for run_id in run_ids]
+
+    def daily(self, days=7):
+        """Per-day totals for the last days days, most recent first (days without calls omitted)."""
+        first = (datetime.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        with self.lock:
+            dates = [r[0] for r in self.db.execute(
+                "SELECT DISTINCT day FROM calls WHERE day >= ? ORDER BY day DESC", (first,))]
+        return [dict(self._aggregate("day = ?", (day,)), day=day) for day in dates]
+
+_usage_log = None
+_usage_log_lock = threading.Lock()
+
+def get_usage_log():
+    """Return the shared usage log, or None if accounting is disabled (LLM_USAGE_FILE = None)."""
+    global _usage_log
+    if not LLM_USAGE_FILE:
+        return None
+    with _usage_log_lock:
+        if _usage_log is None:
+            try:
+                _usage_log = UsageLog()
+            except sqlite3.Error as e:
+                print(f"LLM usage log unavailable: {str(e)}")
+                return None
+        return _usage_log
+
+@contextmanager
+def track_call(prompt, emails=1, model=None):
+    """
+    Time one LLM call and log it to the current run when the block ends.
+
+        with track_call(prompt) as call:
+            ...
+            call.set_tokens(prompt_tokens, response_tokens)
+            call.outcome = 'parsed'
+    """
+    call = CallRecord(prompt, emails, model)
+    start = time.monotonic()
+    try:
+        yield call
+    finally:
+        call.latency = time.monotonic() - start
+        call.finish()
+        usage_log = get_usage_log()
+        if usage_log is not None:
+            try:
+                usage_log.record(call, current_run.get())
+            except sqlite3.Error as e:
+                print(f"Could not record LLM usage: {str(e)}")
+
+def describe_run(summary):
+    """One line for the end of a run."""
+    if not summary or not summary['calls']:
+        return "LLM usage: no calls"
+    return (f"LLM usage: {summary['calls']} calls, {summary['prompt_tokens']} prompt + "
+            f"{summary['response_tokens']} response tokens, p50 {summary['latency_p50']}s / "
+            f"p95 {summary['latency_p95']}s, {summary['retries']} retries, ${summary['cost_usd']:.4f}")
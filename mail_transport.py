@@ -0,0 +1,521 @@
+"""
+Mail transports used by process_emails to find and download candidate emails.
+
+Two backends are available, selected with MAIL_TRANSPORT in config.py:
+    'imap'       IMAP over a pooled connection (UID SEARCH + chunked UID FETCH)
+    'gmail_api'  Gmail REST API (users.messages.list with q= + batched users.messages.get)
+
+A transport is used for a single run:
+
+    transport = create_transport()
+    transport.connect(credentials, stats)
+    email_ids = transport.find_new_messages(stats)
+    summaries = transport.triage(email_ids, stats)      # headers, flags, size, MIME structure
+    for fetched in transport.fetch_text(summaries, stats):
+        ...
+    transport.finish()        # saves the sync state and releases the connection
+
+fetch(email_ids) downloads whole messages instead of only their text part.
+"""
+import base64
+import imaplib
+from datetime import datetime, timedelta
+
+# Import email module with an alias to avoid name conflicts
+import email as email_pkg
+from email.message import Message
+
+import config
+
+# Mailbox used when no account is given (the ingest worker and command-line runs)
+EMAIL_USERNAME = getattr(config, 'EMAIL_USERNAME', None)
+from imap_client import (FetchedMessage, MessageSummary, TextPart, TRIAGE_HEADERS, uid_search,
+                         fetch_messages, fetch_summaries, fetch_text_parts, text_message,
+                         build_message_set, keyword_search_criteria, server_search_keywords,
+                         supports_gmail_extensions)
+from imap_pool import imap_pool
+from sync_state import load_sync_state, save_sync_state
+
+MAIL_TRANSPORT = getattr(config, 'MAIL_TRANSPORT', 'imap')
+GMAIL_API_BATCH_SIZE = min(getattr(config, 'GMAIL_API_BATCH_SIZE', 100), 100)
+GMAIL_API_ENDPOINT = getattr(config, 'GMAIL_API_ENDPOINT', None)
+GMAIL_BATCH_PATH = 'batch/gmail/v1'
+
+class MailAuthError(Exception):
+    """Raised when the mail server rejects the OAuth2 credentials."""
+
+def _date_since():
+    # 24 hours ago, the window the app has always looked at for unread mail
+    return datetime.now() - timedelta(days=1)
+
+class ImapTransport:
+    """Find and fetch emails over IMAP, syncing incrementally by UID."""
+
+    name = 'imap'
+
+    def __init__(self, pool=None, account=None, mailbox='INBOX'):
+        self.pool = pool or imap_pool
+        self.account = account or EMAIL_USERNAME
+        self.mailbox_name = mailbox
+        self.conn = None
+        self.new_state = None
+        self.sync_key = None
+        # Whether the local read / date checks are still needed for what the search returned
+        self.needs_unread_check = False
+        self.needs_date_check = False
+
+    def connect(self, credentials, stats=None):
+        """Borrow an authenticated connection with the mailbox selected."""
+        try:
+            self.conn = self.pool.acquire(self.account, credentials.token, self.mailbox_name, stats)
+        except imaplib.IMAP4.error as e:
+            raise MailAuthError(str(e)) from e
+
+    def _search_unread(self, date_since, stats=None):
+        """
+        Find candidate emails, falling back to broader searches if the first one finds nothing.
+
+        Returns:
+            tuple: (list of UIDs, search criteria that produced them)
+        """
+        mail = self.conn.mail
+        # Try multiple search approaches for compatibility
+        email_ids = []
+        search_criteria = ""
+
+        # Approach 1: Try standard UNSEEN SINCE search
+        try:
+            print("Trying standard UNSEEN SINCE search...")
+            search_criteria = f'(UNSEEN SINCE "{date_since}")'
+            print(f"Using search criteria: {search_criteria}")
+            email_ids = uid_search(mail, search_criteria, stats)
+            if email_ids:
+                print(f"Found {len(email_ids)} unread emails since {date_since}")
+        except Exception as e:
+            print(f"Standard search failed: {e}")
+
+        # Approach 2: If no emails found, try just UNSEEN
+        if not email_ids:
+            try:
+                print("Trying simple UNSEEN search...")
+                search_criteria = 'UNSEEN'
+                email_ids = uid_search(mail, search_criteria, stats)
+                if email_ids:
+                    print(f"Found {len(email_ids)} unread emails")
+            except Exception as e:
+                print(f"UNSEEN search failed: {e}")
+
+        # Approach 3: Last resort, try ALL and filter later
+        if not email_ids:
+            try:
+                print("Trying to search for ALL emails as last resort...")
+                search_criteria = 'ALL'
+                email_ids = uid_search(mail, search_criteria, stats)
+                if email_ids:
+                    print(f"Found {len(email_ids)} total emails, will filter later")
+            except Exception as e:
+                print(f"ALL search failed: {e}")
+
+        return email_ids, search_criteria
+
+    def find_new_messages(self, stats=None):
+        """
+        Return the UIDs of unread emails that arrived since the last run, oldest first.
+
+        Without saved state (or after UIDVALIDITY changed) this falls back to the
+        UNSEEN SINCE -> UNSEEN -> ALL search ladder.
+        """
+        mailbox = self.conn.mailbox
+        self.sync_key = f"{self.account}/{mailbox.name}"
+        sync_state = load_sync_state(self.sync_key)
+
+        if sync_state and sync_state.get('uidvalidity') != mailbox.uidvalidity:
+            print(f"UIDVALIDITY changed ({sync_state.get('uidvalidity')} -> {mailbox.uidvalidity}), doing a full resync")
+            sync_state = None
+
+        if sync_state:
+            last_uid = sync_state.get('last_uid', 0)
+            if mailbox.highestmodseq and sync_state.get('highestmodseq') == mailbox.highestmodseq:
+                # Nothing in the mailbox has changed since the last run
+                print(f"Mailbox unchanged since last sync (HIGHESTMODSEQ {mailbox.highestmodseq})")
+                email_ids = []
+            else:
+                # Only look at mail that arrived after the last UID we handled
+                search_criteria = f'(UID {last_uid + 1}:* UNSEEN)'
+                print(f"Incremental sync, using search criteria: {search_criteria}")
+                # "n:*" always matches the highest UID, even when it is below n
+                email_ids = [uid for uid in uid_search(self.conn.mail, search_criteria, stats) if int(uid) > last_uid]
+                print(f"Found {len(email_ids)} new unread emails since UID {last_uid}")
+                self.needs_date_check = True
+        else:
+            last_uid = 0
+            # Get date 24 hours ago in the required format (DD-MMM-YYYY)
+            date_since = _date_since().strftime("%d-%b-%Y")
+            print(f"Searching for emails since: {date_since}")
+            email_ids, search_criteria = self._search_unread(date_since, stats)
+            self.needs_unread_check = search_criteria == 'ALL'
+            self.needs_date_check = 'SINCE' not in search_criteria
+
+        email_ids = sorted(email_ids, key=int)
+
+        # Remember how far we got so the next run starts after these emails
+        self.last_uid = last_uid
+        self.new_state = {
+            'uidvalidity': mailbox.uidvalidity,
+            'last_uid': max([last_uid, (mailbox.uidnext or 1) - 1] + [int(uid) for uid in email_ids]),
+            'highestmodseq': mailbox.highestmodseq,
+        }
+        return email_ids
+
+    def filter_by_keywords(self, email_ids, keywords, stats=None):
+        """
+        Ask the server which of the candidate UIDs contain any of the keywords,
+        so only those get downloaded. Returns the candidates unchanged if the search fails.
+        """
+        if not email_ids or not keywords:
+            return email_ids
+        keyword_criteria = keyword_search_criteria(keywords, supports_gmail_extensions(self.conn.mail))
+        if not keyword_criteria:
+            return email_ids
+        criteria = f"UID {build_message_set(email_ids)} {keyword_criteria}"
+        try:
+            matched = set(uid_search(self.conn.mail, criteria, stats))
+        except Exception as e:
+            print(f"Server-side keyword search failed, downloading all candidates: {e}")
+            return email_ids
+        return [uid for uid in email_ids if uid in matched]
+
+    def triage(self, email_ids, stats=None):
+        """Return a MessageSummary per UID: flags, date, size, a few headers and the text part to read."""
+        return list(fetch_summaries(self.conn.mail, email_ids, stats=stats))
+
+    def fetch_text(self, summaries, stats=None):
+        """Yield FetchedMessage tuples holding only the text part of each message (BODY.PEEK[n])."""
+        return fetch_text_parts(self.conn.mail, summaries, stats=stats)
+
+    def fetch(self, email_ids, stats=None):
+        """Yield FetchedMessage tuples using chunked UID FETCH commands."""
+        return fetch_messages(self.conn.mail, email_ids, stats=stats)
+
+    def finish(self, last_processed_id=None):
+        """
+        Save the sync state and return the connection to the pool.
+
+        Pass the last processed UID when only part of the new mail was handled,
+        so the next run picks up the rest.
+        """
+        if self.new_state is not None:
+            if last_processed_id is not None:
+                self.new_state['last_uid'] = max(self.last_uid, int(last_processed_id))
+                self.new_state['highestmodseq'] = None
+            save_sync_state(self.sync_key, self.new_state)
+        self.pool.release(self.conn)
+        self.conn = None
+
+    def abort(self):
+        """Drop the connection without saving state, e.g. after an unexpected error."""
+        self.pool.discard(self.conn)
+        self.conn = None
+
+def _find_text_part(payload):
+    """Return the first inline text/plain part of a format=full payload, else text/html, else None."""
+    parts = []
+    stack = [payload]
+    while stack:
+        part = stack.pop(0)
+        parts.append(part)
+        stack[0:0] = part.get('parts', [])
+    for mime_type in ('text/plain', 'text/html'):
+        for part in parts:
+            if part.get('mimeType') == mime_type and not part.get('filename') and 'data' in part.get('body', {}):
+                return part
+    return None
+
+class GmailApiTransport:
+    """
+    Find and fetch emails with the Gmail REST API.
+
+    Message IDs come from users.messages.list with a q= search, and bodies are downloaded
+    with users.messages.get requests packed into HTTP batches of up to 100 per call.
+    """
+
+    name = 'gmail_api'
+
+    def __init__(self, account=None, api_endpoint=None, http=None, batch_size=None, message_format='raw'):
+        self.account = account or EMAIL_USERNAME
+        self.api_endpoint = api_endpoint or GMAIL_API_ENDPOINT
+        self.http = http
+        self.batch_size = min(batch_size or GMAIL_API_BATCH_SIZE, 100)
+        self.message_format = message_format
+        self.service = None
+        self.sync_key = f"{self.account}/gmail_api"
+        self.history_id = None
+        self.query = ''
+        # The second each triaged message arrived in
+        self._seconds = {}
+        self.full_sync_started = 0
+        self.needs_unread_check = False
+        self.needs_date_check = False
+
+    def _batch_uri(self):
+        root = self.api_endpoint or 'https://gmail.googleapis.com/'
+        return root.rstrip('/') + '/' + GMAIL_BATCH_PATH
+
+    def connect(self, credentials, stats=None):
+        """Build the API client and check the credentials with users.getProfile."""
+        from googleapiclient.discovery import build
+        from googleapiclient.errors import HttpError
+
+        client_options = {'api_endpoint': self.api_endpoint} if self.api_endpoint else None
+        if self.http is not None:
+            self.service = build('gmail', 'v1', http=self.http, client_options=client_options,
+                                 static_discovery=True, cache_discovery=False)
+        else:
+            self.service = build('gmail', 'v1', credentials=credentials, client_options=client_options,
+                                 static_discovery=True, cache_discovery=False)
+        try:
+            if stats is not None:
+                stats.record('profile')
+            self.profile = self.service.users().getProfile(userId='me').execute()
+        except HttpError as e:
+            if e.resp.status in (401, 403):
+                raise MailAuthError(str(e)) from e
+            raise
+
+    def _list(self, query, stats=None):
+        """Return all message IDs in INBOX matching a Gmail search query."""
+        email_ids = []
+        page_token = None
+        while True:
+            if stats is not None:
+                stats.record('list')
+            response = self.service.users().messages().list(
+                userId='me', q=query, labelIds=['INBOX'], maxResults=500, pageToken=page_token
+            ).execute()
+            email_ids.extend(m['id'] for m in response.get('messages', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return email_ids
+
+    def find_new_messages(self, stats=None):
+        """
+        Return the IDs of unread emails that arrived since the last run, oldest first.
+
+        Uses the mailbox historyId to skip the search entirely when nothing has changed.
+        Gmail's after: only has one-second resolution, so the IDs already handled within
+        the last second are remembered and left out.
+        """
+        sync_state = load_sync_state(self.sync_key) or {}
+        history_id = self.profile.get('historyId')
+        self.after = sync_state.get('after') or 0
+        self.boundary_ids = set(sync_state.get('boundary_ids', []))
+        if not self.after:
+            # Full sync: once everything found has been handled, the next run starts from now
+            self.full_sync_started = int(datetime.now().timestamp())
+            self.boundary_ids = set()
+            sync_state = {}
+
+        if sync_state and history_id and sync_state.get('history_id') == history_id:
+            print(f"Mailbox unchanged since last sync (historyId {history_id})")
+            email_ids = []
+        elif sync_state:
+            # Include the boundary second itself and drop what we already handled in it
+            query = f"is:unread after:{self.after - 1}"
+            print(f"Incremental sync, using query: {query}")
+            email_ids = [m for m in self._list(query, stats) if m not in self.boundary_ids]
+            self.query = query
+            self.needs_date_check = True
+            print(f"Found {len(email_ids)} new unread emails")
+        else:
+            # Same ladder as the IMAP search: unread in the last day, any unread, then everything
+            date_since = _date_since()
+            email_ids = []
+            for query in (f"is:unread after:{int(date_since.timestamp())}", "is:unread", ""):
+                print(f"Trying Gmail search query: {query or '(all mail)'}")
+                email_ids = self._list(query, stats)
+                self.query = query
+                if email_ids:
+                    print(f"Found {len(email_ids)} emails")
+                    self.needs_unread_check = query == ""
+                    self.needs_date_check = 'after:' not in query
+                    break
+
+        # Gmail message IDs increase with time, so this is oldest first like IMAP UIDs
+        email_ids = sorted(email_ids, key=lambda message_id: int(message_id, 16))
+        self.history_id = history_id
+        return email_ids
+
+    def filter_by_keywords(self, email_ids, keywords, stats=None):
+        """
+        Re-run the last search with an OR group of the keywords and their plural forms
+        ({a b c}) and keep the candidates it returns. Gmail matches whole words, so "loads"
+        has to be asked for as well as "load". Returns the candidates unchanged if the search fails.
+        """
+        keywords = server_search_keywords(keywords, word_search=True)
+        if not email_ids or not keywords:
+            return email_ids
+        query = f"{self.query} {{{' '.join(keywords)}}}".strip()
+        try:
+            matched = set(self._list(query, stats))
+        except Exception as e:
+            print(f"Server-side keyword search failed, downloading all candidates: {e}")
+            return email_ids
+        return [message_id for message_id in email_ids if message_id in matched]
+
+    def _to_fetched(self, message):
+        internal_ms = int(message.get('internalDate', 0))
+        if self.message_format == 'raw':
+            msg = email_pkg.message_from_bytes(base64.urlsafe_b64decode(message['raw']))
+        else:
+            # metadata / full: rebuild a message from the headers only
+            msg = Message()
+            for header in message.get('payload', {}).get('headers', []):
+                msg[header['name']] = header['value']
+        return FetchedMessage(
+            uid=message['id'],
+            flags=[] if 'UNREAD' in message.get('labelIds', []) else ['\\Seen'],
+            internaldate=datetime.fromtimestamp(internal_ms / 1000),
+            message=msg
+        ), internal_ms // 1000
+
+    def _batch_get(self, email_ids, stats=None, message_format=None):
+        """Download up to batch_size messages in one HTTP call. Returns {id: message} and failed IDs."""
+        from googleapiclient.http import BatchHttpRequest
+
+        results = {}
+        failed = []
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                print(f"Error fetching message {request_id}: {exception}")
+                failed.append(request_id)
+            else:
+                results[request_id] = response
+
+        batch = BatchHttpRequest(callback=callback, batch_uri=self._batch_uri())
+        for message_id in email_ids:
+            batch.add(self.service.users().messages().get(userId='me', id=message_id,
+                                                          format=message_format or self.message_format),
+                      request_id=message_id)
+        if stats is not None:
+            stats.record('batch')
+        batch.execute(http=self.http)
+        return results, failed
+
+    def _mark_handled(self, message_id, seconds):
+        # Move the high-water mark forward, remembering every ID seen in its second
+        if seconds > self.after:
+            self.after = seconds
+            self.boundary_ids = set()
+        if seconds == self.after:
+            self.boundary_ids.add(message_id)
+
+    def _get_all(self, email_ids, stats=None, message_format=None):
+        """Yield (id, message resource) in order, one batch request per batch_size IDs."""
+        email_ids = list(email_ids)
+        for i in range(0, len(email_ids), self.batch_size):
+            chunk = email_ids[i:i + self.batch_size]
+            results, failed = self._batch_get(chunk, stats, message_format)
+            if failed:
+                # Per-message failures (usually rate limiting) get one more try in their own batch
+                retried, _ = self._batch_get(failed, stats, message_format)
+                results.update(retried)
+            for message_id in chunk:
+                if message_id in results:
+                    yield message_id, results[message_id]
+
+    def fetch(self, email_ids, stats=None):
+        """Yield FetchedMessage tuples, one batch request per batch_size IDs."""
+        for message_id, message in self._get_all(email_ids, stats):
+            fetched, seconds = self._to_fetched(message)
+            self._mark_handled(message_id, seconds)
+            yield fetched
+
+    def triage(self, email_ids, stats=None):
+        """
+        Return a MessageSummary per ID from format=metadata requests: labels, date, size and
+        headers, no body.
+
+        Metadata carries no MIME structure, so text_part only tells whether the message can
+        hold text at all (a text/* or multipart/* type); fetch_text finds the actual part.
+        """
+        summaries = []
+        for message_id, message in self._get_all(email_ids, stats, 'metadata'):
+            payload = message.get('payload', {})
+            headers = Message()
+            content_type = Message()
+            for header in payload.get('headers', []):
+                if header['name'].upper() in TRIAGE_HEADERS:
+                    headers[header['name']] = header['value']
+                elif header['name'].lower() == 'content-type':
+                    content_type['Content-Type'] = header['value']
+            internal_ms = int(message.get('internalDate', 0))
+            self._seconds[message_id] = internal_ms // 1000
+            mime_type = payload.get('mimeType') or content_type.get_content_type()
+            text_part = None
+            if mime_type.startswith(('text/', 'multipart/')):
+                text_part = TextPart(section=None, content_type=mime_type, charset=content_type.get_content_charset(),
+                                     encoding=None, size=message.get('sizeEstimate', 0))
+            summaries.append(MessageSummary(
+                uid=message_id,
+                flags=[] if 'UNREAD' in message.get('labelIds', []) else ['\\Seen'],
+                internaldate=datetime.fromtimestamp(internal_ms / 1000),
+                size=message.get('sizeEstimate', 0),
+                headers=headers,
+                text_part=text_part
+            ))
+        return summaries
+
+    def fetch_text(self, summaries, stats=None):
+        """
+        Yield FetchedMessage tuples holding the text part of each triaged message.
+
+        format=full leaves attachments out (they are only referenced by attachmentId), so
+        these batches download the text parts and not the attachments.
+        """
+        wanted = {summary.uid: summary for summary in summaries if summary.text_part is not None}
+        for message_id, message in self._get_all(wanted, stats, 'full'):
+            part = _find_text_part(message.get('payload', {}))
+            if part is None:
+                continue
+            summary = wanted[message_id]
+            content_type = Message()
+            for header in part.get('headers', []):
+                if header['name'].lower() == 'content-type':
+                    content_type['Content-Type'] = header['value']
+            yield FetchedMessage(
+                uid=summary.uid,
+                flags=summary.flags,
+                internaldate=summary.internaldate,
+                message=text_message(summary.headers, base64.urlsafe_b64decode(part['body']['data']),
+                                     part['mimeType'], content_type.get_content_charset())
+            )
+
+    def finish(self, last_processed_id=None):
+        """Save the sync state. With a last processed ID, the next run resumes after it."""
+        if last_processed_id is None and self.after < self.full_sync_started:
+            self.after, self.boundary_ids = self.full_sync_started, set()
+        for message_id, seconds in self._seconds.items():
+            if last_processed_id is None or int(message_id, 16) <= int(last_processed_id, 16):
+                self._mark_handled(message_id, seconds)
+        save_sync_state(self.sync_key, {
+            # Only trust "nothing changed" when everything found was handled
+            'history_id': self.history_id if last_processed_id is None else None,
+            'after': self.after,
+            'boundary_ids': sorted(self.boundary_ids),
+        })
+
+    def abort(self):
+        self.service = None
+
+TRANSPORTS = {
+    ImapTransport.name: ImapTransport,
+    GmailApiTransport.name: GmailApiTransport,
+}
+
+def create_transport(name=None, **kwargs):
+    """Create the transport named in config (MAIL_TRANSPORT) or by the name argument."""
+    name = name or MAIL_TRANSPORT
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unknown mail transport '{name}', expected one of: {', '.join(TRANSPORTS)}")
+    return TRANSPORTS[name](**kwargs)
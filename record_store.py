@@ -0,0 +1,426 @@
+"""
+Append-only store for extracted records.
+
+Records are appended to a SQLite database in WAL mode, one transaction per save, so a save
+costs time in proportion to the new records rather than to the whole history, a crash
+mid-write leaves the earlier records intact, and several workers (threads or processes)
+can save at the same time; writers wait up to RECORD_STORE_BUSY_TIMEOUT seconds for each
+other.
+
+Every record is keyed by the email it came from (record_key): its Message-ID, or a hash of
+From, Date and body for mail without one. A record whose email is already stored is not
+saved again, unless it adds fields the stored one lacks (e.g. after a field was added in
+the UI); the stored record is then extended and moved to the end. process_emails asks
+stored_fields() before downloading or extracting an email, so mail that was stored by an
+earlier run with every requested field costs no fetch and no LLM call.
+
+Records are also indexed by shipment_id, origin, destination, carrier, sender address and
+email date, and query() filters, sorts and pages through them with a keyset cursor, so a
+lookup touches only the rows it returns however long the history is.
+
+The old extracted_data.json is imported once, the first time the store is opened (or
+explicitly with the import command below).
+
+Usage:
+    python record_store.py import [extracted_data.json]
+    python record_store.py export out.json
+    python record_store.py count
+"""
+import os
+import json
+import time
+import base64
+import sqlite3
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime, parseaddr
+
+import config
+
+RECORD_STORE_FILE = getattr(config, 'RECORD_STORE_FILE', 'extracted_records.db')
+# The JSON history written by earlier versions, imported on first use
+LEGACY_JSON_FILE = getattr(config, 'LEGACY_JSON_FILE', 'extracted_data.json')
+RECORD_STORE_BUSY_TIMEOUT = getattr(config, 'RECORD_STORE_BUSY_TIMEOUT', 30)
+
+# Extracted fields with a column and index of their own (matched case-insensitively)
+INDEXED_FIELDS = ('shipment_id', 'origin', 'destination', 'carrier')
+# Columns query() can filter and sort on; email_date is seconds since the epoch
+FILTER_COLUMNS = INDEXED_FIELDS + ('sender',)
+SORT_COLUMNS = FILTER_COLUMNS + ('email_date', 'id')
+MAX_PAGE_SIZE = 500
+
+def message_key(message_id=None, sender=None, date=None, body=None):
+    """
+    The key an email's record is stored under: its Message-ID if it has one, otherwise a
+    hash of its From and Date headers and body.
+    """
+    message_id = (message_id or '').strip().strip('<>').strip()
+    if message_id:
+        return f"mid:{message_id}"
+    digest = hashlib.sha256()
+    for part in (sender, date, body):
+        digest.update((part or '').encode('utf-8', errors='surrogatepass'))
+        digest.update(b'\x1f')
+    return f"sha256:{digest.hexdigest()}"
+
+def record_key(record):
+    """The key of a record: the email_key process_emails set, or one rebuilt from its metadata."""
+    if record.get('email_key'):
+        return record['email_key']
+    # Records from before email_key only have the headers; the subject stands in for the body
+    return message_key(record.get('email_message_id'), record.get('email_from'), record.get('email_date'),
+                       record.get('email_subject'))
+
+def extracted_fields(record):
+    """The extracted fields of a record ({"value", "context"} entries), without its metadata."""
+    return {field for field, value in record.items() if isinstance(value, dict) and 'value' in value}
+
+def _field_value(record, field):
+    value = record.get(field)
+    value = value.get('value') if isinstance(value, dict) else value
+    # Missing values are stored as '' (not NULL) so the keyset cursor can compare them
+    return '' if value in (None, 'N/A') else str(value).strip()
+
+def _email_timestamp(date_header):
+    try:
+        return parsedate_to_datetime(date_header).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return 0.0
+
+def _index_values(record):
+    """The indexed columns of a record: its INDEXED_FIELDS, sender address and email date."""
+    sender = parseaddr(record.get('email_from') or '')[1].lower()
+    return tuple(_field_value(record, field) for field in INDEXED_FIELDS) + (
+        sender, _email_timestamp(record.get('email_date')))
+
+def _parse_time(value, end=False):
+    """
+    Seconds since the epoch for an ISO date or datetime (UTC unless it has an offset).
+    A bare date as the end of a range includes that whole day.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed.timestamp()
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        values = None
+    if not (isinstance(values, list) and len(values) == 2):
+        raise ValueError("Invalid cursor")
+    return values
+
+class RecordStore:
+    """
+    SQLite-backed append-only record store, safe to share between threads.
+
+    Args:
+        filename (str, optional): Database file. Defaults to RECORD_STORE_FILE.
+        legacy_file (str, optional): JSON history to import once. Defaults to LEGACY_JSON_FILE;
+            pass False to skip the import.
+    """
+
+    def __init__(self, filename=None, legacy_file=None):
+        self.filename = filename or RECORD_STORE_FILE
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.filename, timeout=RECORD_STORE_BUSY_TIMEOUT, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # Safe with WAL: a crash can lose the last commits but never corrupt the database
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, email_key TEXT, data TEXT NOT NULL,"
+            + ''.join(f" {column} TEXT NOT NULL DEFAULT '' COLLATE NOCASE," for column in FILTER_COLUMNS)
+            + " email_date REAL NOT NULL DEFAULT 0)"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._add_email_keys()
+        self._add_index_columns()
+        self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS records_email_key ON records (email_key)")
+        # Each filter column is indexed together with the date, so a filtered lookup over
+        # a date range, newest first, is a single index range scan
+        self.db.execute("CREATE INDEX IF NOT EXISTS records_email_date ON records (email_date, id)")
+        for column in FILTER_COLUMNS:
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS records_{column} ON records ({column}, email_date, id)")
+        self.db.commit()
+        legacy_file = LEGACY_JSON_FILE if legacy_file is None else legacy_file
+        if legacy_file and os.path.exists(legacy_file):
+            self.import_json(legacy_file)
+
+    def _add_email_keys(self):
+        """Key the records of stores created before deduplication, dropping repeated copies."""
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(records)")]
+        if 'email_key' in columns:
+            return
+        self.db.execute("ALTER TABLE records ADD COLUMN email_key TEXT")
+        seen = set()
+        duplicates = []
+        for record_id, data in self.db.execute("SELECT id, data FROM records ORDER BY id").fetchall():
+            key = record_key(json.loads(data))
+            if key in seen:
+                duplicates.append((record_id,))
+            else:
+                seen.add(key)
+                self.db.execute("UPDATE records SET email_key = ? WHERE id = ?", (key, record_id))
+        self.db.executemany("DELETE FROM records WHERE id = ?", duplicates)
+        if duplicates:
+            print(f"Removed {len(duplicates)} duplicate records from {self.filename}")
+
+    def _add_index_columns(self):
+        """Add and fill the query columns in stores created before them."""
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(records)")]
+        if 'email_date' in columns:
+            return
+        for column in FILTER_COLUMNS:
+            self.db.execute(f"ALTER TABLE records ADD COLUMN {column} TEXT NOT NULL DEFAULT '' COLLATE NOCASE")
+        self.db.execute("ALTER TABLE records ADD COLUMN email_date REAL NOT NULL DEFAULT 0")
+        rows = self.db.execute("SELECT id, data FROM records").fetchall()
+        self.db.executemany(
+            f"UPDATE records SET {', '.join(f'{c} = ?' for c in FILTER_COLUMNS)}, email_date = ? WHERE id = ?",
+            [_index_values(json.loads(data)) + (record_id,) for record_id, data in rows])
+
+    def _stored(self, keys):
+        """Return {key: (id, record)} for the keys that have a stored record."""
+        keys = list(set(keys))
+        found = {}
+        # Stay well below SQLite's limit on query parameters
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            for record_id, key, data in self.db.execute(
+                    f"SELECT id, email_key, data FROM records WHERE email_key IN ({','.join('?' * len(chunk))})",
+                    chunk):
+                found[key] = (record_id, json.loads(data))
+        return found
+
+    def _insert(self, records, now):
+        """
+        Insert records whose email is not stored yet. A record for a stored email only
+        counts if it adds fields: the stored record is then extended with them and moved
+        to the end. Returns the number of records written.
+        """
+        keyed = [(record_key(record), record) for record in records]
+        stored = self._stored(key for key, _ in keyed)
+        pending = {}
+        replaced = []
+        for key, record in keyed:
+            record_id = None
+            if key in pending:
+                base = pending[key]
+            elif key in stored:
+                record_id, base = stored[key]
+            else:
+                pending[key] = record
+                continue
+            added = {field: value for field, value in record.items() if field not in base}
+            if not extracted_fields(added):
+                continue
+            if record_id is not None:
+                replaced.append((record_id,))
+                del stored[key]
+            pending[key] = dict(base, **added)
+        self.db.executemany("DELETE FROM records WHERE id = ?", replaced)
+        before = self.db.total_changes
+        self.db.executemany(
+            f"INSERT OR IGNORE INTO records (created, email_key, data, {', '.join(FILTER_COLUMNS)}, email_date)"
+            f" VALUES (?, ?, ?, {', '.join('?' * len(FILTER_COLUMNS))}, ?)",
+            [(now, key, json.dumps(record)) + _index_values(record) for key, record in pending.items()])
+        return self.db.total_changes - before
+
+    def append(self, records):
+        """
+        Append records (dicts) in a single transaction and return how many were written;
+        records of emails that are already stored are skipped unless they add fields.
+        """
+        records = list(records)
+        if not records:
+            return 0
+        with self.lock:
+            with self.db:
+                return self._insert(records, time.time())
+
+    def stored_fields(self, keys):
+        """
+        Return {key: set of extracted fields} for the keys (see message_key) that already
+        have a stored record.
+        """
+        with self.lock:
+            return {key: extracted_fields(record) for key, (_, record) in self._stored(keys).items()}
+
+    def import_json(self, filename, force=False):
+        """
+        Append the records of a JSON history file, without duplicates. Each file is only
+        imported once unless force is set. Returns the number of records imported.
+        """
+        marker = f"imported:{os.path.abspath(filename)}"
+        with self.lock:
+            if not force and self.db.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                return 0
+        with open(filename, 'r') as f:
+            records = json.load(f)
+        records = [record for record in records if isinstance(record, dict)]
+        now = time.time()
+        with self.lock:
+            # The records and the marker are committed together, so an interrupted import
+            # is simply done again
+            with self.db:
+                imported = self._insert(records, now)
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                (marker, json.dumps({'records': imported, 'at': now})))
+        print(f"Imported {imported} records from {filename} into {self.filename}"
+              f" ({len(records) - imported} duplicates skipped)")
+        return imported
+
+    def iter_records(self, batch_size=1000):
+        """Yield every record in the order it was saved, without loading the whole history."""
+        last_id = 0
+        while True:
+            with self.lock:
+                rows = self.db.execute("SELECT id, data FROM records WHERE id > ? ORDER BY id LIMIT ?",
+                                       (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            for last_id, data in rows:
+                yield json.loads(data)
+
+    def query(self, filters=None, date_from=None, date_to=None, sort='email_date', descending=True,
+              limit=50, cursor=None):
+        """
+        Look records up through the indexes.
+
+        Args:
+            filters (dict, optional): Column (one of FILTER_COLUMNS) -> value, matched exactly
+                but case-insensitively.
+            date_from (str, optional): ISO date or datetime; only emails dated from then on.
+            date_to (str, optional): ISO date or datetime; only emails dated before then (a
+                bare date includes that day).
+            sort (str, optional): One of SORT_COLUMNS. Defaults to the email date.
+            descending (bool, optional): Defaults to newest (largest) first.
+            limit (int, optional): Records per page, at most MAX_PAGE_SIZE.
+            cursor (str, optional): next_cursor from the previous page.
+
+        Returns:
+            tuple: (records, next_cursor); next_cursor is None on the last page.
+
+        Raises:
+            ValueError: For unknown columns, malformed dates or an invalid cursor.
+        """
+        filters = {column: value for column, value in (filters or {}).items() if value not in (None, '')}
+        unknown = set(filters) - set(FILTER_COLUMNS)
+        if unknown:
+            raise ValueError(f"Cannot filter on {', '.join(sorted(unknown))}")
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort on {sort}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        where, params = [], []
+        for column, value in filters.items():
+            where.append(f"{column} = ?")
+            params.append(value.lower() if column == 'sender' else value)
+        if date_from:
+            where.append("email_date >= ?")
+            params.append(_parse_time(date_from))
+        if date_to:
+            where.append("email_date < ?")
+            params.append(_parse_time(date_to, end=True))
+        if cursor:
+            # Keyset pagination: continue after the last (sort value, id) of the previous page
+            last = _decode_cursor(cursor)
+            if sort == 'id':
+                where.append("id < ?" if descending else "id > ?")
+                params.append(last[-1])
+            else:
+                where.append(f"({sort}, id) < (?, ?)" if descending else f"({sort}, id) > (?, ?)")
+                params.extend(last)
+        order = 'DESC' if descending else 'ASC'
+        order_by = f"id {order}" if sort == 'id' else f"{sort} {order}, id {order}"
+        sql = (f"SELECT id, {sort}, data FROM records" + (" WHERE " + " AND ".join(where) if where else "")
+               + f" ORDER BY {order_by} LIMIT ?")
+        with self.lock:
+            rows = self.db.execute(sql, params + [limit + 1]).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor([rows[-1][1], rows[-1][0]])
+        return [json.loads(data) for _, _, data in rows], next_cursor
+
+    def segments(self, size):
+        """
+        Split the history into segments of size consecutive record IDs and return
+        (segment, count, max_id) for each non-empty one. Records are only ever appended, or
+        removed from their segment when an extended copy is appended, and IDs are never
+        reused, so a segment whose count and max_id are unchanged still holds the same records.
+        """
+        with self.lock:
+            return self.db.execute(
+                "SELECT (id - 1) / ?, COUNT(*), MAX(id) FROM records GROUP BY (id - 1) / ? ORDER BY 1",
+                (size, size)).fetchall()
+
+    def segment_rows(self, segment, size):
+        """Return (id, email_key, email_date, sender, record) for every record in a segment."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, email_key, email_date, sender, data FROM records WHERE id > ? AND id <= ? ORDER BY id",
+                (segment * size, (segment + 1) * size)).fetchall()
+        return [row[:4] + (json.loads(row[4]),) for row in rows]
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def export_json(self, filename):
+        """Write the whole history as a JSON array, in the format extracted_data.json had."""
+        count = 0
+        with open(filename, 'w') as f:
+            f.write('[')
+            for record in self.iter_records():
+                f.write((',\n' if count else '\n') + json.dumps(record, indent=2))
+                count += 1
+            f.write('\n]\n')
+        return count
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_record_store():
+    """Return the shared record store, opening it (and importing the JSON history) once."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RecordStore()
+        return _store
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    import_parser = subparsers.add_parser('import', help="Import a JSON history file")
+    import_parser.add_argument('file', nargs='?', default=LEGACY_JSON_FILE)
+    import_parser.add_argument('--force', action='store_true', help="Import again even if already imported")
+    export_parser = subparsers.add_parser('export', help="Write every record to a JSON file")
+    export_parser.add_argument('file')
+    subparsers.add_parser('count', help="Print the number of stored records")
+    args = parser.parse_args()
+
+    store = RecordStore(legacy_file=False)
+    if args.command == 'import':
+        if not store.import_json(args.file, force=args.force):
+            print(f"{args.file} was imported before; use --force to import it again")
+    elif args.command == 'export':
+        print(f"Exported {store.export_json(args.file)} records to {args.file}")
+    else:
+        print(store.count())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Keyword relevance scoring used to decide which emails are worth an LLM call.
+
+All keywords are compiled into one regular expression, so a body is scanned once no matter
+how many keywords there are. Keywords only match as whole words (plurals included), so
+"id" no longer matches "provided" and "eta" no longer matches "metadata".
+
+    matcher = KeywordMatcher(TRUCKING_KEYWORDS, weights=KEYWORD_WEIGHTS)
+    result = matcher.match(body)
+    if result.relevant:
+        ...
+"""
+import re
+from collections import Counter, namedtuple
+
+import config
+
+# Minimum score for an email to be sent to the LLM
+RELEVANCE_THRESHOLD = getattr(config, 'RELEVANCE_THRESHOLD', 1.0)
+
+# Keywords that are common in everyday mail count for less than the unambiguous ones
+# ("shipment", "freight", "carrier", ...), which default to 1.0
+KEYWORD_WEIGHTS = {
+    'id': 0.25, 'eta': 0.5, 'load': 0.5, 'dock': 0.5, 'route': 0.5, 'weight': 0.5,
+    'origin': 0.5, 'destination': 0.5, 'arrival': 0.5, 'departure': 0.5, 'transport': 0.5,
+    'tracking': 0.5, 'delivery': 0.5, 'shipping': 0.5, 'warehouse': 0.5,
+}
+
+RelevanceResult = namedtuple('RelevanceResult', ['score', 'counts', 'relevant'])
+
+def word_forms(keyword):
+    """The keyword plus its plural forms: load -> loads, dispatch -> dispatches, delivery -> deliveries."""
+    forms = {keyword, keyword + 's', keyword + 'es'}
+    if keyword.endswith('y'):
+        forms.add(keyword[:-1] + 'ies')
+    return forms
+
+def _trie_pattern(words):
+    """
+    Build a regex alternation shaped like a prefix tree, e.g. d(?:e(?:livery|parture)|ock).
+
+    Python's re tries alternatives one by one at every position, so sharing prefixes
+    keeps the scan close to a single pass over the text.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        optional = '' in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')' + ('?' if optional else '')
+
+    return build(trie)
+
+class KeywordMatcher:
+    """
+    Count whole-word keyword hits in one pass and turn them into a relevance score.
+
+    The score is the sum of the weights of the distinct keywords found; repeating a
+    keyword does not raise it.
+
+    Args:
+        keywords (iterable): Keywords to look for (case-insensitive).
+        weights (dict, optional): Weight per keyword. Keywords not listed weigh 1.0.
+        threshold (float, optional): Minimum score to count as relevant. Defaults to RELEVANCE_THRESHOLD.
+    """
+
+    def __init__(self, keywords, weights=None, threshold=None):
+        self.keywords = sorted({keyword.lower() for keyword in keywords})
+        self.weights = weights or {}
+        self.threshold = RELEVANCE_THRESHOLD if threshold is None else threshold
+        self._forms = {form: keyword for keyword in self.keywords for form in word_forms(keyword)}
+        # Lookarounds instead of \b so "id" does not match inside "id_number" or "2id"
+        self.pattern = re.compile(rf'(?<![a-z0-9_])({_trie_pattern(self._forms)})(?![a-z0-9_])')
+
+    def count(self, text):
+        """Return a Counter of keyword -> number of whole-word hits in the text."""
+        if not text:
+            return Counter()
+        return Counter(self._forms[form] for form in self.pattern.findall(text.lower()))
+
+    def score(self, counts):
+        return sum(self.weights.get(keyword, 1.0) for keyword in counts)
+
+    def match(self, text):
+        """Scan the text once and return a RelevanceResult(score, counts, relevant)."""
+        counts = self.count(text)
+        score = self.score(counts)
+        return RelevanceResult(score=score, counts=counts, relevant=score >= self.threshold)
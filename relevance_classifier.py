@@ -0,0 +1,238 @@
+"""
+Local relevance classifier that can skip LLM calls for emails unlikely to yield any data.
+
+A multinomial naive Bayes model over hashed words and word pairs, trained from emails that
+produced an extraction (label 1) versus emails where every field came back N/A (label 0).
+Inference is a dictionary lookup per token, well under a millisecond for a typical email.
+
+Training data is the text the model will score: the training log process_emails writes
+when RELEVANCE_TRAINING_LOG is set (one JSON object per line: {"text": ..., "label": 0 or 1},
+each text the body the classifier scored), plus optional JSON lists of extra positive /
+negative email bodies. Stored records are not used: their subjects and context snippets
+are not what the model sees at inference, and their emails are in the log already.
+
+Usage:
+    python relevance_classifier.py train [--log relevance_training.jsonl] [--positives positives.json]
+                                         [--negatives negatives.json] [--holdout 0.2]
+    python relevance_classifier.py evaluate [--log relevance_training.jsonl] [--negatives negatives.json]
+"""
+import re
+import json
+import math
+import time
+import zlib
+import random
+import argparse
+
+import config
+
+RELEVANCE_MODEL_FILE = getattr(config, 'RELEVANCE_MODEL_FILE', 'relevance_model.json')
+# Emails the model gives a lower probability than this skip the LLM
+RELEVANCE_CLASSIFIER_THRESHOLD = getattr(config, 'RELEVANCE_CLASSIFIER_THRESHOLD', 0.2)
+# Where process_emails logs LLM outcomes for training (None = off)
+RELEVANCE_TRAINING_LOG = getattr(config, 'RELEVANCE_TRAINING_LOG', None)
+
+HASH_BUCKETS = 2 ** 18
+# Only the start of very long bodies is scored, which keeps inference time bounded
+MAX_TOKENS = 2000
+MAX_LOGGED_CHARS = 20000
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+def _features(text):
+    """Hash the words and adjacent word pairs of a text into bucket numbers."""
+    words = _WORD_RE.findall((text or '').lower())[:MAX_TOKENS]
+    features = [zlib.crc32(word.encode()) % HASH_BUCKETS for word in words]
+    features.extend(zlib.crc32(f"{a} {b}".encode()) % HASH_BUCKETS for a, b in zip(words, words[1:]))
+    return features
+
+class RelevanceClassifier:
+    """
+    Hashed bag-of-words naive Bayes model.
+
+    Only the per-bucket log-likelihood ratio is kept, so scoring a text is a sum of
+    dictionary lookups followed by a sigmoid.
+    """
+
+    def __init__(self, weights=None, default_weight=0.0, bias=0.0):
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.bias = bias
+
+    @classmethod
+    def train(cls, texts, labels, alpha=1.0):
+        """Fit the model on texts with labels 1 (produced data) or 0 (all N/A)."""
+        counts = ({}, {})
+        totals = [0, 0]
+        docs = [0, 0]
+        for text, label in zip(texts, labels):
+            label = 1 if label else 0
+            docs[label] += 1
+            for feature in _features(text):
+                counts[label][feature] = counts[label].get(feature, 0) + 1
+                totals[label] += 1
+        if not docs[0] or not docs[1]:
+            raise ValueError("Training needs at least one positive and one negative example")
+
+        # Laplace smoothing over the hash space; buckets never seen in training share one weight
+        denominators = [totals[label] + alpha * HASH_BUCKETS for label in (0, 1)]
+        default_weight = math.log(alpha / denominators[1]) - math.log(alpha / denominators[0])
+        weights = {}
+        for feature in set(counts[0]) | set(counts[1]):
+            weights[feature] = (math.log((counts[1].get(feature, 0) + alpha) / denominators[1])
+                                - math.log((counts[0].get(feature, 0) + alpha) / denominators[0]))
+        bias = math.log(docs[1] / docs[0])
+        return cls(weights, default_weight, bias)
+
+    def predict_proba(self, text):
+        """Return the probability that the email will yield extracted data."""
+        score = self.bias
+        for feature in _features(text):
+            score += self.weights.get(feature, self.default_weight)
+        # Clamp so very long texts cannot overflow exp()
+        score = max(-50.0, min(50.0, score))
+        return 1.0 / (1.0 + math.exp(-score))
+
+    def save(self, filename=None):
+        filename = filename or RELEVANCE_MODEL_FILE
+        with open(filename, 'w') as f:
+            json.dump({
+                'hash_buckets': HASH_BUCKETS,
+                'bias': self.bias,
+                'default_weight': self.default_weight,
+                'weights': {str(k): round(v, 6) for k, v in self.weights.items()},
+            }, f)
+
+    @classmethod
+    def load(cls, filename=None):
+        """Load a saved model. Raises OSError or ValueError if the file is missing or incompatible."""
+        with open(filename or RELEVANCE_MODEL_FILE, 'r') as f:
+            data = json.load(f)
+        if data.get('hash_buckets') != HASH_BUCKETS:
+            raise ValueError("Model was trained with a different hash size, please retrain it")
+        return cls({int(k): v for k, v in data['weights'].items()}, data['default_weight'], data['bias'])
+
+def load_classifier(filename=None):
+    """Return the saved classifier, or None if there is no usable model file."""
+    try:
+        classifier = RelevanceClassifier.load(filename)
+        print(f"Loaded relevance classifier from {filename or RELEVANCE_MODEL_FILE}")
+        return classifier
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Could not load relevance classifier: {str(e)}")
+        return None
+
+def log_training_example(text, label, filename=None):
+    """Append one LLM outcome to the training log, if logging is enabled."""
+    filename = filename or RELEVANCE_TRAINING_LOG
+    if not filename:
+        return
+    try:
+        with open(filename, 'a') as f:
+            f.write(json.dumps({'text': (text or '')[:MAX_LOGGED_CHARS], 'label': 1 if label else 0}) + '\n')
+    except OSError as e:
+        print(f"Error writing relevance training log: {str(e)}")
+
+def _load_log(filename):
+    examples = []
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                examples.append((entry['text'], entry['label']))
+    return examples
+
+def load_examples(log=None, positives=None, negatives=None):
+    """Collect (text, label) pairs from the training log and the extra lists, skipping a missing log."""
+    examples = []
+    if log:
+        try:
+            examples.extend(_load_log(log))
+        except FileNotFoundError:
+            print(f"Skipping missing training file {log}")
+    for filename, label in ((positives, 1), (negatives, 0)):
+        if filename:
+            with open(filename, 'r') as f:
+                examples.extend((text, label) for text in json.load(f))
+    return examples
+
+def evaluate(classifier, examples, threshold=None):
+    """
+    Score labelled examples as the gate in process_emails would.
+
+    Returns:
+        dict: skip_rate (share of LLM calls avoided), recall (share of productive emails kept),
+              wasted_calls_avoided (share of all-N/A emails skipped) and mean inference time in ms.
+    """
+    threshold = RELEVANCE_CLASSIFIER_THRESHOLD if threshold is None else threshold
+    kept_positive = skipped = skipped_negative = 0
+    positives = sum(1 for _, label in examples if label)
+    negatives = len(examples) - positives
+    start = time.perf_counter()
+    for text, label in examples:
+        keep = classifier.predict_proba(text) >= threshold
+        if not keep:
+            skipped += 1
+            skipped_negative += 0 if label else 1
+        elif label:
+            kept_positive += 1
+    elapsed = time.perf_counter() - start
+    return {
+        'examples': len(examples),
+        'skip_rate': skipped / len(examples) if examples else 0.0,
+        'recall': kept_positive / positives if positives else 0.0,
+        'wasted_calls_avoided': skipped_negative / negatives if negatives else 0.0,
+        'inference_ms': elapsed / len(examples) * 1000 if examples else 0.0,
+    }
+
+def _print_report(report, threshold):
+    print(f"{report['examples']} examples at threshold {threshold:g}:")
+    print(f"  skipped LLM calls:         {report['skip_rate']:.1%}")
+    print(f"  recall (productive kept):  {report['recall']:.1%}")
+    print(f"  all-N/A emails skipped:    {report['wasted_calls_avoided']:.1%}")
+    print(f"  inference time:            {report['inference_ms']:.3f} ms per email")
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or evaluate the local relevance classifier.")
+    parser.add_argument('command', choices=['train', 'evaluate'])
+    parser.add_argument('--log', default=RELEVANCE_TRAINING_LOG or 'relevance_training.jsonl',
+                        help="JSON-lines training log written by process_emails")
+    parser.add_argument('--positives', help="JSON list of extra email bodies that contain trucking data")
+    parser.add_argument('--negatives', help="JSON list of extra email bodies without trucking data")
+    parser.add_argument('--model', default=RELEVANCE_MODEL_FILE)
+    parser.add_argument('--threshold', type=float, default=RELEVANCE_CLASSIFIER_THRESHOLD)
+    parser.add_argument('--holdout', type=float, default=0.2, help="Share of examples held out for evaluation")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'evaluate':
+        classifier = RelevanceClassifier.load(args.model)
+        examples = load_examples(args.log, args.positives, args.negatives)
+        _print_report(evaluate(classifier, examples, args.threshold), args.threshold)
+        return
+
+    examples = load_examples(args.log, args.positives, args.negatives)
+    random.Random(args.seed).shuffle(examples)
+    split = int(len(examples) * (1 - args.holdout)) if args.holdout else len(examples)
+    train_set, test_set = examples[:split], examples[split:]
+    productive = sum(1 for _, label in train_set if label)
+    if not productive or productive == len(train_set):
+        parser.exit(1, f"Cannot train on {len(train_set)} examples with {productive} productive and "
+                       f"{len(train_set) - productive} all-N/A: both kinds are needed. Let more mail go "
+                       f"through with RELEVANCE_TRAINING_LOG set, add --positives/--negatives, "
+                       f"or lower --holdout.\n")
+    print(f"Training on {len(train_set)} examples "
+          f"({productive} productive), holding out {len(test_set)}")
+    classifier = RelevanceClassifier.train([t for t, _ in train_set], [l for _, l in train_set])
+    if test_set:
+        _print_report(evaluate(classifier, test_set, args.threshold), args.threshold)
+    # Keep the model trained on everything
+    if test_set:
+        classifier = RelevanceClassifier.train([t for t, _ in examples], [l for _, l in examples])
+    classifier.save(args.model)
+    print(f"Saved model to {args.model}")
+
+if __name__ == "__main__":
+    main()
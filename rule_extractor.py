@@ -0,0 +1,185 @@
+"""
+Rule-based extraction for templated emails, tried before the LLM.
+
+Each field has a list of regular expressions with a named group "value" and a confidence.
+The first pattern that matches a field decides it; if it matches several different values
+the field is ambiguous and its confidence is halved. Only fields at or above
+RULE_CONFIDENCE_THRESHOLD are used, everything else is left to the LLM.
+
+Results have the same shape as the LLM's, plus the confidence:
+
+    {"shipment_id": {"value": "SH98765", "context": "Shipment ID SH98765", "confidence": 0.95}}
+
+Rules for specific senders can be added in RULE_EXTRACTOR_RULES_FILE, keyed by full address
+or by "@domain". They are tried before the default rules:
+
+    {
+        "@northwestfreight.example": {
+            "shipment_id": [{"pattern": "Load #\\\\s*(?P<value>\\\\d{6})", "confidence": 0.95}]
+        }
+    }
+"""
+import re
+import json
+from email.utils import parseaddr
+
+import config
+
+USE_RULE_EXTRACTOR = getattr(config, 'USE_RULE_EXTRACTOR', True)
+RULE_CONFIDENCE_THRESHOLD = getattr(config, 'RULE_CONFIDENCE_THRESHOLD', 0.8)
+RULE_EXTRACTOR_RULES_FILE = getattr(config, 'RULE_EXTRACTOR_RULES_FILE', 'extraction_rules.json')
+
+_MONTHS = (r'(?:Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|June?|July?|Aug(?:ust)?|'
+           r'Sep(?:t(?:ember)?)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)')
+DATE = (rf'(?:{_MONTHS}\.? \d{{1,2}}(?:st|nd|rd|th)?,? \d{{4}}|\d{{1,2}}/\d{{1,2}}/\d{{2,4}}|\d{{4}}-\d{{2}}-\d{{2}})')
+
+_STATES = {
+    'AL': 'Alabama', 'AK': 'Alaska', 'AZ': 'Arizona', 'AR': 'Arkansas', 'CA': 'California',
+    'CO': 'Colorado', 'CT': 'Connecticut', 'DE': 'Delaware', 'FL': 'Florida', 'GA': 'Georgia',
+    'HI': 'Hawaii', 'ID': 'Idaho', 'IL': 'Illinois', 'IN': 'Indiana', 'IA': 'Iowa', 'KS': 'Kansas',
+    'KY': 'Kentucky', 'LA': 'Louisiana', 'ME': 'Maine', 'MD': 'Maryland', 'MA': 'Massachusetts',
+    'MI': 'Michigan', 'MN': 'Minnesota', 'MS': 'Mississippi', 'MO': 'Missouri', 'MT': 'Montana',
+    'NE': 'Nebraska', 'NV': 'Nevada', 'NH': 'New Hampshire', 'NJ': 'New Jersey', 'NM': 'New Mexico',
+    'NY': 'New York', 'NC': 'North Carolina', 'ND': 'North Dakota', 'OH': 'Ohio', 'OK': 'Oklahoma',
+    'OR': 'Oregon', 'PA': 'Pennsylvania', 'RI': 'Rhode Island', 'SC': 'South Carolina',
+    'SD': 'South Dakota', 'TN': 'Tennessee', 'TX': 'Texas', 'UT': 'Utah', 'VT': 'Vermont',
+    'VA': 'Virginia', 'WA': 'Washington', 'WV': 'West Virginia', 'WI': 'Wisconsin', 'WY': 'Wyoming',
+}
+_STATE = '(?:' + '|'.join(sorted(list(_STATES.values()) + list(_STATES), key=len, reverse=True)) + r')\b'
+# "Dallas, TX", "Atlanta, Georgia", "St. Louis, MO", "Salt Lake City, UT": one capitalized word,
+# with extra words only from the usual place-name prefixes and suffixes, so capitalized words in
+# front of the city ("Auto Parts Denver, CO") are never taken for part of it
+_PLACE_PREFIX = (r'(?:New|San|Santa|Saint|St\.|Los|Las|El|La|Fort|Ft\.|Port|Mount|Mt\.|North|South|East|'
+                 r'West|Salt|Lake|Des|Baton|Corpus|Grand|Little|Palm|Long|Green|Cedar|Sioux|Council|Eau|'
+                 r'Bowling|Rock|Coral|Boca|Del|Big) ')
+_PLACE_SUFFIX = r'(?: (?:City|Beach|Springs|Falls|Rapids|Bay|Park|Heights|Creek|Island|Hills|Valley|Harbor|Point|Bluffs|Grove))'
+LOCATION = rf'(?:(?:{_PLACE_PREFIX}){{0,2}}[A-Z][a-zA-Z.\'-]*{_PLACE_SUFFIX}?, {_STATE})'
+
+_PICKUP = (rf'\b(?i:depart\w*|leav\w*|pick(?:ed|ing|s)?[ -]?up|ship(?:s|ping)? out)\b[^.\n]{{0,60}}?'
+           rf'\b(?i:on|by)\s+(?P<value>{DATE})')
+_DELIVERY = (rf'\b(?i:arriv\w*|reach\w*|deliver\w*|due)\b[^.\n]{{0,60}}?'
+             rf'\b(?i:on|by)\s+(?P<value>{DATE})')
+
+# Locations after a bare "from" or "to" ("Bob from Chicago, IL", "Reply to Austin, TX office")
+# are reported below the threshold, so only a field label or a shipping verb decides them
+DEFAULT_RULES = {
+    'shipment_id': [
+        (r'\b(?i:shipment|load|tracking|pro|bol|reference)\b\s*(?i:id|number|no\.?|#)?\s*:?\s*#?'
+         r'(?P<value>[A-Z]{2,4}-?\d{4,})\b', 0.95),
+        (r'\b(?P<value>(?:SH|TRK|LD|PRO|BOL)-?\d{4,})\b', 0.8),
+    ],
+    'origin': [
+        (rf'\b(?i:origin|pick[ -]?up(?: location)?|ship from|shipper)\s*:\s*(?P<value>{LOCATION})', 0.95),
+        (rf'\b(?i:picked up (?:in|from)|pickup in|departing from|departed from|loaded in|loading in)\s+'
+         rf'(?P<value>{LOCATION})', 0.85),
+        (rf'\b(?i:from|leaving|departing)\s+(?P<value>{LOCATION})', 0.6),
+    ],
+    'destination': [
+        (rf'\b(?i:destination|deliver to|delivery(?: location)?|drop[ -]?off|consignee|ship to)\s*[:,]\s*'
+         rf'(?P<value>{LOCATION})', 0.95),
+        (rf'\b(?i:arrive in|arriving in|arrived in|deliver(?:ed|ing|y)? (?:to|in)|bound for|en route to)\s+'
+         rf'(?P<value>{LOCATION})', 0.85),
+        (rf'\b(?i:to|reach|reaching)\s+(?P<value>{LOCATION})', 0.6),
+    ],
+    'pickup_date': [(_PICKUP, 0.85)],
+    'delivery_date': [(_DELIVERY, 0.85)],
+    'weight': [
+        (r'\b(?P<value>\d{1,3}(?:,\d{3})*(?:\.\d+)?\s*(?i:pounds|lbs?|kg|kilograms|tons?))\b', 0.9),
+    ],
+    'pallet_num': [(r'\b(?P<value>\d{1,4})\s+(?i:pallets?)\b', 0.9)],
+    'carrier': [
+        (r'\b(?i:carrier)(?: (?i:name))?\s*:\s*(?P<value>[A-Z][\w&\'-]*(?: (?:(?:Co|Inc|Ltd|Corp)\.|[A-Z][\w&\'-]*|&))*)', 0.9),
+    ],
+}
+# Same text, different names
+DEFAULT_RULES['departure_date'] = DEFAULT_RULES['pickup_date']
+DEFAULT_RULES['arrival_date'] = DEFAULT_RULES['delivery_date']
+
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+|\n')
+
+def _compile(rules):
+    return {field: [(re.compile(pattern), confidence) for pattern, confidence in patterns]
+            for field, patterns in rules.items()}
+
+def _sentence(text, start, end):
+    """The sentence (or line) around text[start:end], used as the context."""
+    left = 0
+    for boundary in _SENTENCE_END_RE.finditer(text, 0, start):
+        left = boundary.end()
+    boundary = _SENTENCE_END_RE.search(text, end)
+    right = boundary.start() if boundary else len(text)
+    return text[left:right].strip()
+
+class RuleExtractor:
+    """
+    Extract fields with regular expressions, default rules plus optional per-sender ones.
+
+    Args:
+        sender_rules (dict, optional): {"address or @domain": {field: [(pattern, confidence), ...]}}.
+        threshold (float, optional): Minimum confidence to use a value. Defaults to RULE_CONFIDENCE_THRESHOLD.
+    """
+
+    def __init__(self, sender_rules=None, threshold=None):
+        self.threshold = RULE_CONFIDENCE_THRESHOLD if threshold is None else threshold
+        self.default_rules = _compile(DEFAULT_RULES)
+        self.sender_rules = {sender.lower(): _compile(rules) for sender, rules in (sender_rules or {}).items()}
+
+    @classmethod
+    def load(cls, filename=None, threshold=None):
+        """Build an extractor with the sender rules in a JSON file, if it exists."""
+        filename = filename or RULE_EXTRACTOR_RULES_FILE
+        try:
+            with open(filename, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(threshold=threshold)
+        sender_rules = {
+            sender: {field: [(rule['pattern'], rule.get('confidence', 0.9)) for rule in rules]
+                     for field, rules in fields.items()}
+            for sender, fields in data.items()
+        }
+        print(f"Loaded extraction rules for {len(sender_rules)} senders from {filename}")
+        return cls(sender_rules, threshold)
+
+    def _rules_for(self, field, sender):
+        address = parseaddr(sender or '')[1].lower()
+        domain = '@' + address.split('@')[-1] if '@' in address else None
+        rules = []
+        for key in (address, domain):
+            if key and key in self.sender_rules:
+                rules.extend(self.sender_rules[key].get(field, []))
+        return rules + self.default_rules.get(field, [])
+
+    def extract(self, body, fields, sender=None):
+        """
+        Run the rules for each field.
+
+        Returns:
+            dict: field -> {value, context, confidence} for every field some rule matched,
+                  whatever the confidence.
+        """
+        results = {}
+        if not body:
+            return results
+        for field in fields:
+            for pattern, confidence in self._rules_for(field, sender):
+                matches = list(pattern.finditer(body))
+                if not matches:
+                    continue
+                values = {' '.join(m.group('value').split()).rstrip(',') for m in matches}
+                if len(values) > 1:
+                    # Several candidates, e.g. two different dates: let the LLM decide
+                    confidence /= 2
+                first = matches[0]
+                results[field] = {
+                    'value': ' '.join(first.group('value').split()).rstrip(','),
+                    'context': _sentence(body, first.start(), first.end()),
+                    'confidence': round(confidence, 2),
+                }
+                break
+        return results
+
+    def confident(self, body, fields, sender=None):
+        """Return only the fields extracted with at least the threshold confidence."""
+        return {field: result for field, result in self.extract(body, fields, sender).items()
+                if result['confidence'] >= self.threshold}
@@ -0,0 +1,111 @@
+"""
+Local stand-in LLM server for offline benchmarks and regression runs.
+
+POST /generate with {"prompt": "..."} answers {"text": "...", "usage": {...}} after a
+log-normal delay, or fails with 429/503 at the configured error rate, just like StubBackend
+(which it wraps).
+Point the app at it with LLM_BACKEND = "http" and LLM_STUB_URL, or use HttpBackend directly.
+
+    server = StubLLMServer(latency=0.5, error_rate=0.02).start()
+    backend = HttpBackend(server.url)
+
+Usage:
+    python stub_llm_server.py [--port 8765] [--latency 0.8] [--sigma 0.5] [--error-rate 0.0]
+                              [--responses canned.json]
+"""
+import json
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_backends import StubBackend, BackendError
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        self.server.count('request_count')
+        if self.path.rstrip('/') != '/generate':
+            self._send_json(404, {'error': {'code': 404, 'message': 'Not Found'}})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            prompt = json.loads(self.rfile.read(length))['prompt']
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {'error': {'code': 400, 'message': 'Expected {"prompt": ...}'}})
+            return
+        try:
+            completion = self.server.backend.generate(prompt)
+        except BackendError as e:
+            self.server.count('error_count')
+            self._send_json(e.code or 500, {'error': {'code': e.code, 'message': str(e)}})
+            return
+        self._send_json(200, {'text': completion.text, 'usage': {
+            'prompt_tokens': completion.prompt_tokens, 'response_tokens': completion.response_tokens}})
+
+class StubLLMServer(ThreadingHTTPServer):
+    """Threaded stub LLM server on localhost; keyword arguments are passed on to StubBackend."""
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, backend=None, **stub_options):
+        super().__init__((host, port), _Handler)
+        self.backend = backend or StubBackend(**stub_options)
+        # Read by tests and benchmarks to check call counts; handlers run on their own threads
+        self.request_count = 0
+        self.error_count = 0
+        self.counter_lock = threading.Lock()
+
+    def count(self, counter):
+        with self.counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='stub-llm-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, help="Median seconds per call")
+    parser.add_argument('--sigma', type=float, help="Spread of the log-normal latency (0 = fixed)")
+    parser.add_argument('--error-rate', type=float, help="Share of calls answered with 429 or 503")
+    parser.add_argument('--responses', help="JSON file with a list of canned response texts")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses) as f:
+            responses = [r if isinstance(r, str) else json.dumps(r) for r in json.load(f)]
+    server = StubLLMServer(args.host, args.port, latency=args.latency, latency_sigma=args.sigma,
+                           error_rate=args.error_rate, responses=responses, seed=args.seed)
+    print(f"Stub LLM server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
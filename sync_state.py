@@ -0,0 +1,43 @@
+"""
+Persisted per-mailbox sync state so repeated runs only fetch mail that arrived since the last one.
+
+For each mailbox we remember:
+    uidvalidity:    UIDs are only comparable while this value stays the same
+    last_uid:       highest UID already handled
+    highestmodseq:  mailbox HIGHESTMODSEQ at the end of the last run (CONDSTORE servers only)
+"""
+import os
+import json
+
+import config
+
+SYNC_STATE_FILE = getattr(config, 'SYNC_STATE_FILE', 'sync_state.json')
+
+def _load_all(filename):
+    if not os.path.exists(filename):
+        return {}
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading sync state, starting fresh: {str(e)}")
+        return {}
+
+def load_sync_state(key, filename=None):
+    """Return the saved state dict for a mailbox key (e.g. 'user@gmail.com/INBOX'), or None."""
+    return _load_all(filename or SYNC_STATE_FILE).get(key)
+
+def save_sync_state(key, state, filename=None):
+    """Save the state dict for a mailbox key, replacing the file atomically."""
+    filename = filename or SYNC_STATE_FILE
+    try:
+        all_states = _load_all(filename)
+        all_states[key] = state
+
+        # Write to a temporary file first so a crash never leaves a half-written state file
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(all_states, f, indent=2)
+        os.replace(tmp_filename, filename)
+    except Exception as e:
+        print(f"Error saving sync state: {str(e)}")
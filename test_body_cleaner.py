@@ -0,0 +1,71 @@
+"""
+Body cleaning: what is dropped, what is kept, and that kept text maps back to the email.
+"""
+import pytest
+
+pytest.importorskip("config")
+
+from body_cleaner import clean_body, _drop_boilerplate, _lines
+
+def _keywords(sentence):
+    return any(word in sentence.lower() for word in ('pickup', 'shipment', 'freight'))
+
+def _kept(text):
+    return [text[s:e] for s, e in _drop_boilerplate(text, list(_lines(text)), _keywords) if e > s]
+
+def test_footer_paragraph_is_dropped():
+    assert _kept("Shipment SH1 loaded.\n\nThis email is confidential. If you are not the intended "
+                 "recipient, delete it.") == ["Shipment SH1 loaded."]
+
+def test_lines_before_a_footer_are_kept():
+    # No blank line between the message and the footer
+    assert _kept("Driver will be there at noon.\nThis email is confidential.") == ["Driver will be there at noon."]
+
+@pytest.mark.parametrize('text', [
+    "Pickup at the north gate",
+    "Pickup at the north gate, keep the gate code confidential",
+    "Confidential rate: $1,200 flat",
+])
+def test_real_lines_are_kept(text):
+    assert _kept(text) == [text]
+
+def test_tender_header_lines_are_not_reply_history():
+    tender = ("Load 4411 tender.\n\nFrom: Chicago, IL\nDate: 10/21 pickup 08:00\nTo: Dallas, TX\n"
+              "Rate: $2,400\nWeight: 42000 lbs")
+    assert clean_body(tender).text == tender
+
+def test_quoted_tender_keeps_its_header_like_lines():
+    tender = "From: Chicago, IL\nDate: 10/21 pickup 08:00\nTo: Dallas, TX"
+    reply = ("See below.\n\nFrom: Broker <broker@example.com>\nSent: Monday, October 19, 2026 9:00 AM\n"
+             "To: ops@example.com\nSubject: Tender\n\n" + tender)
+    # Only the reply header is dropped from the quoted part that is kept
+    assert clean_body(reply, is_relevant=lambda text: 'Chicago' in text).text == "See below.\n" + tender
+    forward = ("FYI\n---------- Forwarded message ---------\nFrom: Broker <broker@example.com>\n"
+               "Date: Mon, Oct 19, 2026\nSubject: Tender\nTo: ops@example.com\n\n" + tender)
+    assert clean_body(forward).text == "FYI\n" + tender
+
+def test_contexts_map_back_to_the_email():
+    body = ("Load SH98765 picked up in Dallas, TX.\n\n"
+            "To unsubscribe from these alerts, click here.\n\n"
+            "ETA Seattle, WA on Friday.\n\n"
+            "On Mon, Oct 12, 2026 at 9:00 AM Broker <broker@example.com> wrote:\n"
+            "> Can you confirm the pickup?\n")
+    cleaned = clean_body(body, is_keyword_sentence=_keywords)
+    assert cleaned.text == "Load SH98765 picked up in Dallas, TX.\nETA Seattle, WA on Friday."
+    # Every kept slice is verbatim
+    for text_start, source_start, length in cleaned.segments:
+        assert cleaned.text[text_start:text_start + length] == body[source_start:source_start + length]
+    start, end = cleaned.locate("ETA Seattle, WA")
+    assert body[start:end] == "ETA Seattle, WA"
+    # A context quoted across the cut covers the dropped line in the email
+    start, end = cleaned.locate("Dallas, TX.\nETA Seattle")
+    assert body[start:end] == "Dallas, TX.\n\nTo unsubscribe from these alerts, click here.\n\nETA Seattle"
+    assert cleaned.locate("Houston, TX") is None
+
+    # process_emails stores the contexts as they are in the email
+    import email_processor
+    record = email_processor._contexts_to_source(
+        {'destination': {'value': 'Seattle, WA', 'context': "Dallas, TX.\nETA Seattle"},
+         'carrier': {'value': 'N/A', 'context': ''}}, cleaned)
+    assert record['destination']['context'] == body[start:end]
+    assert record['carrier'] == {'value': 'N/A', 'context': ''}
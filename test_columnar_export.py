@@ -0,0 +1,57 @@
+"""
+Columnar exports: the records come back intact, unchanged data is served from the cache,
+and new records are picked up.
+"""
+import os
+
+import pytest
+
+pytest.importorskip("config")
+pa = pytest.importorskip("pyarrow")
+
+import columnar_export
+from record_store import RecordStore
+
+def _record(i):
+    return {
+        'shipment_id': {'value': f"SH{10000 + i}", 'context': f"Shipment SH{10000 + i} picked up"},
+        'carrier': {'value': 'N/A', 'context': ''},
+        'email_subject': f"Load {i}",
+        'email_from': 'Broker <broker@example.com>',
+        'email_date': 'Mon, 12 Oct 2026 09:00:00 +0000',
+        'email_message_id': f"<load{i}@example.com>",
+    }
+
+def test_export_round_trip_cache_and_rebuild(tmp_path, monkeypatch):
+    monkeypatch.setattr(columnar_export, 'EXPORT_SEGMENT_SIZE', 2)
+    store = RecordStore(str(tmp_path / 'records.db'), legacy_file=False)
+    store.append([_record(i) for i in range(3)])
+    cache_dir = str(tmp_path / 'exports')
+    fields = ['shipment_id', 'carrier']
+    rebuilt = []
+    segment_rows = store.segment_rows
+    monkeypatch.setattr(store, 'segment_rows',
+                        lambda segment, size: rebuilt.append(segment) or segment_rows(segment, size))
+
+    path = columnar_export.export_records(fields, 'parquet', store=store, cache_dir=cache_dir)
+    table = pa.parquet.read_table(path)
+    assert table.column('shipment_id_value').to_pylist() == ['SH10000', 'SH10001', 'SH10002']
+    assert table.column('carrier_value').to_pylist() == [None, None, None]
+    assert table.column('email_message_id').to_pylist()[0] == '<load0@example.com>'
+    assert table.column('sender').to_pylist()[0] == 'broker@example.com'
+
+    assert rebuilt == [0, 1]
+
+    # Unchanged data: the same file, without reading a single segment from the store
+    assert columnar_export.export_records(fields, 'parquet', store=store, cache_dir=cache_dir) == path
+    assert rebuilt == [0, 1]
+
+    # A new record rebuilds only the segment it lands in; the superseded file is kept
+    store.append([_record(3)])
+    new_path = columnar_export.export_records(fields, 'arrow', store=store, cache_dir=cache_dir)
+    assert new_path != path and os.path.exists(path)
+    assert rebuilt == [0, 1, 1]
+    with pa.memory_map(new_path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    assert table.column('shipment_id_value').to_pylist() == ['SH10000', 'SH10001', 'SH10002', 'SH10003']
+    assert not [name for name in os.listdir(cache_dir) if name.endswith('.tmp')]
@@ -0,0 +1,33 @@
+"""
+Rate limits of the extraction executor.
+"""
+import time
+
+import pytest
+
+pytest.importorskip("config")
+
+import extraction_executor
+from extraction_executor import ExtractionExecutor, TokenBucket
+
+def test_zero_means_unlimited_and_none_means_configured(monkeypatch):
+    monkeypatch.setattr(extraction_executor, 'LLM_REQUESTS_PER_MINUTE', 60)
+    monkeypatch.setattr(extraction_executor, 'LLM_TOKENS_PER_MINUTE', None)
+    unlimited = ExtractionExecutor(lambda body, fields: {}, requests_per_minute=0, tokens_per_minute=0)
+    start = time.perf_counter()
+    for _ in range(500):
+        unlimited.request_bucket.acquire()
+        unlimited.token_bucket.acquire(10 ** 9)
+    assert time.perf_counter() - start < 1
+
+    configured = ExtractionExecutor(lambda body, fields: {})
+    assert configured.request_bucket.rate == 60
+    # None in the config is no limit as well
+    assert configured.token_bucket.rate is None
+
+def test_bucket_waits_once_it_is_empty():
+    bucket = TokenBucket(6000)
+    bucket.tokens = 0
+    start = time.perf_counter()
+    bucket.acquire(5)
+    assert 0.03 < time.perf_counter() - start < 1
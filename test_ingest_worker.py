@@ -0,0 +1,58 @@
+"""
+Run the IDLE ingestion worker against the local fake IMAP server.
+"""
+import time
+import threading
+
+import pytest
+
+pytest.importorskip("config")
+
+import email_processor
+from fake_imap_server import FakeIMAPServer
+from imap_pool import IMAPConnectionPool
+from ingest_worker import IngestWorker
+
+class _Credentials:
+    token = "test-token"
+    expired = False
+    expiry = None
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_worker_picks_up_new_mail(isolated_stores, monkeypatch):
+    monkeypatch.setattr(email_processor, 'extract_data_with_llm',
+                        lambda body, fields: {'shipment_id': {'value': body.split()[1], 'context': body}})
+
+    server = FakeIMAPServer().start()
+    pool = IMAPConnectionPool(host=server.host, port=server.port, use_ssl=False)
+    records = []
+    worker = IngestWorker(lambda: _Credentials(), pool=pool, on_record=records.append,
+                          account='dispatch@example.com', idle_timeout=5)
+    thread = threading.Thread(target=worker.run, daemon=True)
+    thread.start()
+    try:
+        assert _wait_for(lambda: worker.runs >= 1)
+
+        server.add_message(b"Subject: Load update\r\nFrom: broker@example.com\r\n\r\n"
+                           b"Shipment SH98765 picked up, truck en route")
+        assert _wait_for(lambda: len(records) == 1)
+        assert records[0]['shipment_id']['value'] == 'SH98765'
+
+        # A second message is picked up over the same pooled connection
+        server.add_message(b"Subject: Delivered\r\nFrom: broker@example.com\r\n\r\n"
+                           b"Shipment TRK-45092 delivery completed")
+        assert _wait_for(lambda: len(records) == 2)
+        assert records[1]['shipment_id']['value'] == 'TRK-45092'
+        assert pool.connects == 1
+    finally:
+        worker.stop()
+        thread.join(timeout=10)
+        pool.close_all()
+        server.stop()
@@ -0,0 +1,69 @@
+"""
+Background jobs: status reporting, coalescing per key and event replay.
+"""
+import threading
+
+import pytest
+
+pytest.importorskip("config")
+
+from job_queue import JobQueue
+
+def test_jobs_for_the_same_key_are_coalesced():
+    # The job waits on gates, so what a subscriber sees does not depend on thread timing
+    start, emitted, release = threading.Event(), threading.Event(), threading.Event()
+
+    def run(job):
+        start.wait(10)
+        job.set_progress('found', {'found': 2})
+        job.add_record({'shipment_id': {'value': 'SH1', 'context': ''}})
+        emitted.set()
+        release.wait(10)
+        job.add_record({'shipment_id': {'value': 'SH2', 'context': ''}})
+        return "Processed 2 emails"
+
+    jobs = JobQueue(workers=2)
+    job, coalesced = jobs.submit('dispatch@example.com', run)
+    assert not coalesced
+    # A second submission for the mailbox joins the running job; another mailbox gets its own
+    again, coalesced = jobs.submit('dispatch@example.com', run)
+    assert coalesced and again is job
+    other, coalesced = jobs.submit('other@example.com', lambda job: "done")
+    assert not coalesced and other is not job
+
+    # An early subscriber gets the events live, in the order they happen
+    early = job.subscribe()
+    start.set()
+    assert early.get(timeout=10) == ('progress', {'found': 2, 'stage': 'found'})
+    assert early.get(timeout=10) == ('record', {'shipment_id': {'value': 'SH1', 'context': ''}})
+
+    # A late subscriber first gets what happened so far, then the live events
+    assert emitted.wait(10)
+    late = job.subscribe()
+    assert late.get(timeout=10) == ('record', {'shipment_id': {'value': 'SH1', 'context': ''}})
+    assert late.get(timeout=10) == ('progress', {'found': 2})
+    release.set()
+    for events in (early, late):
+        assert events.get(timeout=10) == ('record', {'shipment_id': {'value': 'SH2', 'context': ''}})
+        assert events.get(timeout=10) == ('done', {'job_id': job.id, 'message': "Processed 2 emails"})
+
+    status = jobs.get(job.id).to_dict()
+    assert status['status'] == 'done' and status['record_count'] == 2
+    assert status['progress'] == {'found': 2} and status['run_seconds'] is not None
+    # Once it has finished, the next submission starts a new job
+    assert jobs.submit('dispatch@example.com', run)[0] is not job
+    release.set()
+
+def test_failed_job_reports_its_error():
+    start = threading.Event()
+
+    def run(job):
+        start.wait(10)
+        raise RuntimeError("IMAP login failed")
+
+    jobs = JobQueue(workers=1)
+    job, _ = jobs.submit('dispatch@example.com', run)
+    events = job.subscribe()
+    start.set()
+    assert events.get(timeout=10) == ('error', {'job_id': job.id, 'error': "IMAP login failed"})
+    assert jobs.get(job.id).to_dict()['status'] == 'failed'
@@ -0,0 +1,69 @@
+"""
+The server-side keyword search must never drop an email the local keyword check accepts.
+"""
+import itertools
+
+import httplib2
+import pytest
+
+pytest.importorskip("config")
+
+from email_processor import TRUCKING_KEYWORDS, is_trucking_related, server_search_is_safe
+from fake_gmail_api import FakeGmailApiServer
+from fake_imap_server import FakeIMAPServer, FakeMailbox
+from imap_pool import IMAPConnectionPool
+from mail_transport import ImapTransport, GmailApiTransport
+from relevance import word_forms
+
+class _Credentials:
+    token = "test-token"
+
+def _bodies():
+    """Every keyword in every form the local matcher counts, paired with another keyword."""
+    keywords = sorted(TRUCKING_KEYWORDS)
+    forms = itertools.cycle(range(4))
+    for keyword, other in zip(keywords, keywords[1:] + keywords[:1]):
+        first, second = sorted(word_forms(keyword)), sorted(word_forms(other))
+        yield (f"{first[next(forms) % len(first)].capitalize()} and "
+               f"{second[next(forms) % len(second)]} update.")
+    yield "Load 4411 ETA 3pm"
+    yield "Loads 12 and 13, ETAs attached"
+
+def _mailbox():
+    mailbox = FakeMailbox()
+    accepted = []
+    for i, body in enumerate(_bodies()):
+        uid = mailbox.add((f"Message-ID: <{i}@example.com>\r\nFrom: broker@example.com\r\n"
+                           f"Subject: Update {i}\r\n\r\n{body}\r\n").encode())
+        if is_trucking_related(body):
+            accepted.append(uid)
+    mailbox.add(b"Subject: Newsletter\r\nFrom: news@shop.example\r\n\r\n"
+                b"Hello friends, new recipes and a sale on shoes.\r\n")
+    return mailbox, accepted
+
+@pytest.mark.parametrize('transport', ['imap', 'gmail_imap', 'gmail_api'])
+def test_server_search_keeps_every_accepted_email(isolated_stores, transport):
+    assert server_search_is_safe()
+    mailbox, accepted = _mailbox()
+    assert len(accepted) > len(TRUCKING_KEYWORDS) // 2
+    if transport == 'gmail_api':
+        server = FakeGmailApiServer(mailbox=mailbox).start()
+        mail = GmailApiTransport(account='test@example.com', api_endpoint=server.url, http=httplib2.Http())
+        pool = None
+    else:
+        server = FakeIMAPServer(mailbox=mailbox, gmail_extensions=transport == 'gmail_imap').start()
+        pool = IMAPConnectionPool(host=server.host, port=server.port, use_ssl=False)
+        mail = ImapTransport(pool=pool, account='test@example.com')
+    try:
+        mail.connect(_Credentials())
+        email_ids = mail.find_new_messages()
+        kept = mail.filter_by_keywords(email_ids, TRUCKING_KEYWORDS)
+        # The newsletter is filtered out, and every email the local check accepts is kept
+        assert len(kept) < len(email_ids)
+        kept_uids = {int(message_id, 16) if transport == 'gmail_api' else int(message_id) for message_id in kept}
+        assert set(accepted) <= kept_uids
+        mail.finish()
+    finally:
+        if pool:
+            pool.close_all()
+        server.stop()
@@ -0,0 +1,141 @@
+"""
+Run process_emails end to end offline: the fake IMAP server and the stub LLM server.
+"""
+import pytest
+
+pytest.importorskip("config")
+
+import email_processor
+import llm_processor
+import llm_usage
+import record_store
+from fake_imap_server import FakeIMAPServer
+from imap_pool import IMAPConnectionPool
+from llm_backends import HttpBackend
+from llm_resilience import CircuitBreaker
+from mail_transport import ImapTransport, MailAuthError
+from stub_llm_server import StubLLMServer
+
+class _Credentials:
+    token = "test-token"
+    expired = False
+    expiry = None
+
+def test_pipeline_with_stub_llm(isolated_stores, monkeypatch):
+    tmp_path = isolated_stores
+    # Every email needs the LLM, and every first attempt fails with a 429 or 503
+    monkeypatch.setattr(email_processor, 'USE_RULE_EXTRACTOR', False)
+    # Enough retries, and a breaker patient enough, that a run of 429s can't stop the run
+    monkeypatch.setattr(llm_processor, '_caller', llm_processor.ResilientCaller(
+        max_retries=10, base_delay=0.01, breaker=CircuitBreaker(threshold=20)))
+
+    llm_server = StubLLMServer(latency=0, error_rate=0.5, seed=3).start()
+    monkeypatch.setattr(llm_processor, '_backend', HttpBackend(llm_server.url))
+    server = FakeIMAPServer().start()
+    pool = IMAPConnectionPool(host=server.host, port=server.port, use_ssl=False)
+    try:
+        for i in range(5):
+            # Some with a Message-ID, some to be told apart by a hash of their headers and body
+            message_id = f"Message-ID: <load{i}@example.com>\r\n" if i % 2 else ""
+            server.add_message(f"Subject: Load {i}\r\nFrom: broker@example.com\r\n{message_id}\r\n"
+                               f"Shipment SH{10000 + i} picked up, truck en route".encode())
+        records = email_processor.process_emails(
+            fields_to_extract=['shipment_id', 'origin'],
+            credentials_provider=lambda: _Credentials(), transport=ImapTransport(pool=pool))
+        assert len(records) == 5
+        assert records[0]['shipment_id']['value'] == 'shipment_id-0'
+        assert llm_server.error_count > 0
+
+        # Every call was accounted to the run, retries and reported tokens included
+        run = llm_usage.get_usage_log().recent_runs(1)[0]
+        assert run['calls'] == 5 and run['outcomes']['parsed'] == 5
+        assert run['retries'] == llm_server.error_count
+        assert run['prompt_tokens'] > 0 and run['estimated_calls'] == 0
+
+        # The second run finds nothing new, and the stub is not called again
+        email_processor.save_records(records)
+        requests_before = llm_server.request_count
+        assert email_processor.process_emails(
+            credentials_provider=lambda: _Credentials(), transport=ImapTransport(pool=pool)) == []
+        assert llm_server.request_count == requests_before
+
+        # After a full resync every email is recognised as already stored
+        (tmp_path / 'sync_state.json').unlink()
+        progress = {}
+        assert email_processor.process_emails(
+            fields_to_extract=['shipment_id', 'origin'],
+            credentials_provider=lambda: _Credentials(), transport=ImapTransport(pool=pool),
+            on_progress=lambda stage, counts: progress.update(counts)) == []
+        assert progress['duplicates'] == 5 and progress['fetched'] == 3
+        assert llm_server.request_count == requests_before
+        email_processor.save_records(records)
+        assert record_store.get_record_store().count() == 5
+
+        # A field added later is extracted from the stored mail, and only that field
+        (tmp_path / 'sync_state.json').unlink()
+        llm_server.backend.error_rate = 0
+        records = email_processor.process_emails(
+            fields_to_extract=['shipment_id', 'origin', 'carrier'],
+            credentials_provider=lambda: _Credentials(), transport=ImapTransport(pool=pool))
+        assert len(records) == 5
+        assert llm_usage.get_usage_log().recent_runs(1)[0]['calls'] == 5
+        assert llm_server.request_count > requests_before
+        email_processor.save_records(records)
+        stored = list(record_store.get_record_store().iter_records())
+        assert len(stored) == 5
+        assert all(record['carrier']['value'] == 'carrier-0' and record['shipment_id']['value'] == 'shipment_id-0'
+                   for record in stored)
+    finally:
+        pool.close_all()
+        server.stop()
+        llm_server.stop()
+
+def test_failed_run_raises_when_asked(isolated_stores):
+    server = FakeIMAPServer().start()
+    server.reject_auth = True
+    pool = IMAPConnectionPool(host=server.host, port=server.port, use_ssl=False)
+    try:
+        # A rejected login looks like an empty run unless the caller asks for the error
+        assert email_processor.process_emails(
+            credentials_provider=lambda: _Credentials(), transport=ImapTransport(pool=pool)) == []
+        with pytest.raises(MailAuthError):
+            email_processor.process_emails(
+                credentials_provider=lambda: _Credentials(), transport=ImapTransport(pool=pool),
+                raise_errors=True)
+    finally:
+        pool.close_all()
+        server.stop()
+
+def test_failed_save_keeps_the_sync_state(isolated_stores, monkeypatch):
+    monkeypatch.setattr(email_processor, 'USE_RULE_EXTRACTOR', False)
+    llm_server = StubLLMServer(latency=0, error_rate=0).start()
+    monkeypatch.setattr(llm_processor, '_backend', HttpBackend(llm_server.url))
+    server = FakeIMAPServer().start()
+    pool = IMAPConnectionPool(host=server.host, port=server.port, use_ssl=False)
+    try:
+        for i in range(3):
+            server.add_message(f"Subject: Load {i}\r\nFrom: broker@example.com\r\n"
+                               f"Message-ID: <load{i}@example.com>\r\n\r\n"
+                               f"Shipment SH{10000 + i} picked up, truck en route".encode())
+        store = record_store.get_record_store()
+
+        def locked(records):
+            raise record_store.sqlite3.OperationalError("database is locked")
+        store.append = locked
+        with pytest.raises(record_store.sqlite3.OperationalError):
+            email_processor.process_emails(
+                fields_to_extract=['shipment_id'], credentials_provider=lambda: _Credentials(),
+                transport=ImapTransport(pool=pool), raise_errors=True, save=True)
+        assert not (isolated_stores / 'sync_state.json').exists()
+
+        # The next run fetches the same mail again and stores it
+        del store.append
+        records = email_processor.process_emails(
+            fields_to_extract=['shipment_id'], credentials_provider=lambda: _Credentials(),
+            transport=ImapTransport(pool=pool), save=True)
+        assert len(records) == 3 and store.count() == 3
+        assert (isolated_stores / 'sync_state.json').exists()
+    finally:
+        pool.close_all()
+        server.stop()
+        llm_server.stop()
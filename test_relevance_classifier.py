@@ -0,0 +1,33 @@
+"""
+Relevance classifier training: what it learns from and when it refuses to train.
+"""
+import json
+import sys
+
+import pytest
+
+pytest.importorskip("config")
+
+import relevance_classifier
+
+def _write_log(path, examples):
+    with open(path, 'w') as f:
+        for text, label in examples:
+            f.write(json.dumps({'text': text, 'label': label}) + '\n')
+
+def test_training_uses_the_logged_text_only(tmp_path):
+    log = tmp_path / 'training.jsonl'
+    _write_log(log, [("Shipment SH1 picked up in Dallas", 1), ("Your receipt is attached", 0)])
+    assert relevance_classifier.load_examples(str(log)) == [
+        ("Shipment SH1 picked up in Dallas", 1), ("Your receipt is attached", 0)]
+
+def test_train_without_negatives_exits_with_a_message(tmp_path, monkeypatch, capsys):
+    log = tmp_path / 'training.jsonl'
+    _write_log(log, [(f"Shipment SH{i} picked up", 1) for i in range(5)])
+    monkeypatch.setattr(sys, 'argv', ['relevance_classifier.py', 'train', '--log', str(log),
+                                      '--model', str(tmp_path / 'model.json')])
+    with pytest.raises(SystemExit) as exit_info:
+        relevance_classifier.main()
+    assert exit_info.value.code == 1
+    assert "both kinds are needed" in capsys.readouterr().err
+    assert not (tmp_path / 'model.json').exists()
@@ -0,0 +1,47 @@
+"""
+Rule-based extraction: templated values are found, look-alikes in ordinary text are not.
+"""
+import pytest
+
+pytest.importorskip("config")
+
+from rule_extractor import RuleExtractor
+
+FIELDS = ['shipment_id', 'origin', 'destination', 'carrier', 'weight', 'pickup_date']
+
+def _confident(text):
+    return {field: result['value'] for field, result in RuleExtractor(threshold=0.8).confident(text, FIELDS).items()}
+
+def test_templated_fields_are_extracted():
+    assert _confident("Shipment ID: SH98765 picked up in Dallas, TX on 2026-10-01, en route to "
+                      "Salt Lake City, UT. Carrier: Swift Transport Inc.") == {
+        'shipment_id': 'SH98765',
+        'origin': 'Dallas, TX',
+        'destination': 'Salt Lake City, UT',
+        'carrier': 'Swift Transport Inc.',
+        'pickup_date': '2026-10-01',
+    }
+    assert _confident("Origin: St. Louis, MO\nDestination: Kansas City, KS\nWeight: 12,000 lbs") == {
+        'origin': 'St. Louis, MO', 'destination': 'Kansas City, KS', 'weight': '12,000 lbs'}
+
+@pytest.mark.parametrize('text', [
+    # Keywords inside longer words
+    "Please download ABCD12345",
+    "Auto Parts Denver, CO",
+    # Capitalized words in front of the city
+    "Destination: Auto Parts Denver, CO",
+    # Locations after a bare from/to are below the threshold
+    "Bob from Chicago, IL",
+    "Reply to Austin, TX office",
+    # A carrier needs its label
+    "Carrier Please confirm",
+    # The tail of a longer number
+    "Order 123456 lbs of flour",
+])
+def test_lookalikes_are_not_confident(text):
+    assert _confident(text) == {}
+
+def test_bare_locations_are_left_to_the_llm():
+    results = RuleExtractor(threshold=0.8).extract("Bob from Chicago, IL", ['origin'])
+    assert results['origin']['value'] == 'Chicago, IL'
+    assert results['origin']['confidence'] < 0.8